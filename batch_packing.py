@@ -0,0 +1,177 @@
+import os
+import math
+import heapq
+import random
+import argparse
+import tempfile
+
+from pypdf import PdfReader, PdfWriter
+
+# ================================
+# 配置区
+# ================================
+# 单个 PDF 的限制 (见 README：单个文件最大 2G、最大 1000 页)
+MAX_PDF_PAGES = 1000
+MAX_PDF_BYTES = 2 * 1024 ** 3
+# Gemini 对 PDF 按页计费，每页约 258 个 token
+TOKENS_PER_PAGE = 258
+# 单个请求的输入 token 上限 (gemini-2.5-pro 上下文长度)
+MAX_REQUEST_TOKENS = 1_048_576
+# 每个批处理作业最多包含的文件数，以及输入 token 总量的上限
+BATCH_MAX_FILES = 20
+BATCH_MAX_TOKENS = 2_000_000
+# 无法解析页面树 (加密、损坏) 时按文件大小估算页数
+BYTES_PER_PAGE_ESTIMATE = 100 * 1024
+
+
+def count_pdf_pages(path):
+    """
+    用 pypdf 读取页数：只解析 xref/trailer 和页面树根节点的 /Count，不读页面内容，
+    增量更新、对象流、嵌套字典都由 pypdf 按最新的 xref 正确处理。加密或损坏无法解析时返回 None。
+    """
+    if os.path.getsize(path) == 0:
+        return None
+    try:
+        return len(PdfReader(path).pages)
+    except Exception:
+        return None
+
+
+def estimate_pdf(path):
+    """
+    本地估算一个 PDF 的页数与输入 token 数，返回要写入状态的字段。
+    oversized 为 True 表示超出单个请求的限制，需要先拆分再上传。
+    """
+    size_bytes = os.path.getsize(path)
+    pages = count_pdf_pages(path)
+    source = 'page_tree'
+    if pages is None:
+        pages = max(1, math.ceil(size_bytes / BYTES_PER_PAGE_ESTIMATE))
+        source = 'file_size'
+    tokens = pages * TOKENS_PER_PAGE
+    return {
+        'size_bytes': size_bytes,
+        'page_count': pages,
+        'page_count_source': source,
+        'estimated_tokens': tokens,
+        'oversized': pages > MAX_PDF_PAGES or size_bytes > MAX_PDF_BYTES or tokens > MAX_REQUEST_TOKENS,
+    }
+
+
+def estimate_text_tokens(text):
+    """粗略估算提示词的 token 数：中日韩字符约 1 字 1 token，其余约 4 个字符 1 token。"""
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿')
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def annotate_estimates(state, pdf_folder, filenames):
+    """
+    为尚无估算的文件写入页数、token 估算，超出限制的文件状态改为 needs_split，不再上传。
+    返回被判定为超限的文件列表。
+    """
+    oversized = []
+    for pdf_file in filenames:
+        entry = state.get(pdf_file)
+        if entry is None or 'estimated_tokens' in entry:
+            continue
+        estimate = estimate_pdf(os.path.join(pdf_folder, pdf_file))
+        if estimate.pop('oversized') and entry.get('status') == 'pending_upload':
+            estimate['status'] = 'needs_split'
+            oversized.append(pdf_file)
+        state.update(pdf_file, **estimate)
+    return oversized
+
+
+def pack_batches(items, max_files=BATCH_MAX_FILES, max_tokens=BATCH_MAX_TOKENS):
+    """
+    把 (文件名, token 数) 装箱成若干批次：先按文件数和 token 上限算出最少批次数，
+    再按 token 从大到小依次放入当前 token 最少、且仍有空位的批次 (LPT)，
+    各批次总 token 尽量均衡，一本大书不会和十几本小书挤在一个作业里拖慢它们。
+    单个超过 max_tokens 的文件独占一个批次。返回文件名列表的列表。
+    """
+    items = sorted(items, key=lambda item: item[1], reverse=True)
+    if not items:
+        return []
+    total = sum(tokens for _, tokens in items)
+    count = max(math.ceil(len(items) / max_files), math.ceil(total / max_tokens))
+    bins = [[] for _ in range(count)]
+    totals = [0] * count
+    heap = [(0, i) for i in range(count)]
+    for name, tokens in items:
+        skipped = []
+        target = None
+        while heap:
+            load, i = heapq.heappop(heap)
+            if len(bins[i]) < max_files and (load + tokens <= max_tokens or not bins[i]):
+                target = i
+                break
+            skipped.append((load, i))
+        if target is None:
+            bins.append([])
+            totals.append(0)
+            target = len(bins) - 1
+        bins[target].append(name)
+        totals[target] += tokens
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+        if len(bins[target]) < max_files:
+            heapq.heappush(heap, (totals[target], target))
+    return [b for b in bins if b]
+
+
+def pack_state_batches(entries, prompt_tokens=0, max_files=BATCH_MAX_FILES, max_tokens=BATCH_MAX_TOKENS):
+    """entries: {文件名: 状态条目}。每个请求的 token 数为 PDF 估算值加上提示词。"""
+    return pack_batches([(name, entry.get('estimated_tokens', 0) + prompt_tokens) for name, entry in entries.items()],
+                        max_files, max_tokens)
+
+
+# ================================
+# 离线模拟
+# ================================
+def write_synthetic_pdf(path, pages):
+    """生成只有空白页的 PDF，用于验证页数读取与装箱效果。"""
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=612, height=792)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+def _describe(label, batches, tokens_of):
+    loads = [sum(tokens_of[name] for name in batch) for batch in batches]
+    print(f"{label:<16} {len(batches):>4} {max(loads):>12,} {min(loads):>12,} {max(loads) / (sum(loads) / len(loads)):>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用合成 PDF 比较固定 20 本一批与按 token 装箱的批次均衡程度")
+    parser.add_argument('--books', type=int, default=120, help="合成的 PDF 数量")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tokens_of = {}
+    oversized = []
+    with tempfile.TemporaryDirectory() as folder:
+        for i in range(args.books):
+            # 大多数是几百页的书，少数是上千页的手册
+            pages = int(rng.lognormvariate(5.3, 0.7))
+            name = f"book_{i:04d}.pdf"
+            path = os.path.join(folder, name)
+            write_synthetic_pdf(path, pages)
+            estimate = estimate_pdf(path)
+            assert estimate['page_count'] == pages, (name, pages, estimate)
+            if estimate['oversized']:
+                oversized.append(name)
+            else:
+                tokens_of[name] = estimate['estimated_tokens']
+
+    print(f"共 {args.books} 本，页数全部读取正确；{len(oversized)} 本超过 {MAX_PDF_PAGES} 页，转入拆分。")
+    names = sorted(tokens_of)
+    print(f"{'方式':<16} {'批次':>4} {'最大批 token':>12} {'最小批 token':>12} {'最大/平均':>8}")
+    _describe('固定 20 本一批', [names[i:i + BATCH_MAX_FILES] for i in range(0, len(names), BATCH_MAX_FILES)],
+              tokens_of)
+    _describe('按 token 装箱', pack_batches(tokens_of.items()), tokens_of)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from merge_json import file_sha256
+from state_store import StateStore
+
+# ================================
+# 配置区
+# ================================
+# 同时上传的文件数
+UPLOAD_WORKERS = 4
+# 单个文件失败后的重试次数与首次退避秒数 (之后指数增长并加随机抖动)
+UPLOAD_RETRIES = 3
+UPLOAD_BACKOFF_SECONDS = 5.0
+# 这些 HTTP 状态码说明请求本身有问题，重试也不会成功
+PERMANENT_HTTP_CODES = {400, 401, 403, 404}
+
+# 上传去重缓存：内容哈希 -> 云端文件
+UPLOAD_CACHE_FILE = "upload_cache.json"
+# File API 中的文件保留 48 小时；剩余时间不足以跑完一个批处理作业的副本不再复用
+FILE_API_TTL_HOURS = 48
+UPLOAD_REUSE_MIN_REMAINING_HOURS = 12
+
+
+# ================================
+# 缓存写入
+# ================================
+def write_json_atomic(path, data):
+    """先写临时文件再替换，写到一半崩溃也不会损坏原文件。"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# ================================
+# 并发上传
+# ================================
+def is_retryable_upload_error(e):
+    """本地文件问题和明确的客户端错误不重试，其余 (网络中断、429、5xx) 都退避后重试。"""
+    if isinstance(e, (FileNotFoundError, PermissionError, IsADirectoryError)):
+        return False
+    code = getattr(e, 'code', None)
+    return not (isinstance(code, int) and code in PERMANENT_HTTP_CODES)
+
+
+def upload_with_retry(files_api, path, retries=UPLOAD_RETRIES, backoff=UPLOAD_BACKOFF_SECONDS, on_retry=None):
+    """上传单个文件 (files_api 即 client.files)，可重试的错误按指数退避重试，最后一次仍失败时抛出异常。"""
+    for attempt in range(retries + 1):
+        try:
+            return files_api.upload(file=path)
+        except Exception as e:
+            if attempt >= retries or not is_retryable_upload_error(e):
+                raise
+            delay = backoff * (2 ** attempt) * (0.5 + random.random())
+            if on_retry:
+                on_retry(attempt + 1, e, delay)
+            time.sleep(delay)
+
+
+def upload_with_cache(files_api, path, cache=None, retries=UPLOAD_RETRIES, backoff=UPLOAD_BACKOFF_SECONDS,
+                      on_retry=None):
+    """
+    先按内容哈希查找仍然有效的云端副本，命中则直接复用，否则上传并记入缓存。
+    同一内容的查找与上传持有该哈希的锁，并发上传相同文件时只有第一个真正上传，其余等它完成后命中缓存。
+    返回 (云端文件, 是否复用)。cache 为 None 时等同于 upload_with_retry。
+    """
+    if cache is None:
+        return upload_with_retry(files_api, path, retries, backoff, on_retry), False
+    sha256 = cache.hash_file(path)
+    with cache.hash_lock(sha256):
+        remote = cache.lookup(sha256, files_api)
+        if remote is not None:
+            return remote, True
+        remote = upload_with_retry(files_api, path, retries, backoff, on_retry)
+        cache.store(sha256, remote)
+    return remote, False
+
+
+def upload_one_file(client, state, pdf_folder, pdf_file, retries=UPLOAD_RETRIES, backoff=UPLOAD_BACKOFF_SECONDS,
+                    cache=None):
+    """上传 (或复用) 单个 PDF 并立即更新它在 state (StateStore) 中的条目，返回是否成功。"""
+    pdf_path = os.path.join(pdf_folder, pdf_file)
+    start = time.perf_counter()
+    print(f"  - 正在上传: {pdf_file}")
+    with metrics.span('upload', metrics.trace_id_for(pdf_file), file=pdf_file) as span:
+        try:
+            response, reused = upload_with_cache(
+                client.files, pdf_path, cache, retries, backoff,
+                on_retry=lambda attempt, e, delay: print(
+                    f"    - ⚠️ 上传 '{pdf_file}' 失败 ({e})，{delay:.1f}s 后第 {attempt} 次重试..."))
+        except Exception as e:
+            state.update(pdf_file, status='failed_upload', error=str(e))
+            print(f"  - ❌ 上传失败: {pdf_file}，原因: {e}")
+            span.status = 'error'
+            span.attrs['error'] = str(e)[:200]
+            metrics.counter('uploads_total', result='failed')
+            return False
+        span.attrs['reused'] = reused
+    elapsed = time.perf_counter() - start
+    # uploaded_at 用于计算文件在批次队列中的等待时间
+    state.update(pdf_file, status='uploaded', uploaded_file_uri=response.uri, uploaded_file_name=response.name,
+                 uploaded_at=time.time())
+    if reused:
+        metrics.counter('uploads_total', result='reused')
+        print(f"  - ♻️ 复用云端副本: {pdf_file} -> {response.name}")
+    else:
+        size = os.path.getsize(pdf_path)
+        metrics.counter('uploads_total', result='uploaded')
+        metrics.counter('upload_bytes_total', size)
+        if elapsed > 0:
+            metrics.observe('upload_bytes_per_second', size / elapsed)
+        print(f"  - ✅ 上传完成: {pdf_file} ({elapsed:.1f}s)")
+    return True
+
+
+def upload_pending_files(client, state, pdf_folder, files_to_upload, workers=UPLOAD_WORKERS,
+                         retries=UPLOAD_RETRIES, backoff=UPLOAD_BACKOFF_SECONDS, cache=None):
+    """
+    用固定大小的线程池并发上传 PDF，每个文件上传完成 (或最终失败) 时立即更新状态。
+    state 为 StateStore，每次 update 都是一个线程安全的单行事务。
+    提供 cache (UploadCache) 时，内容相同且云端副本仍有效的文件直接复用，不再上传。
+    返回 (成功数, 失败数)。
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(
+            lambda pdf_file: upload_one_file(client, state, pdf_folder, pdf_file, retries, backoff, cache),
+            files_to_upload))
+    succeeded = sum(results)
+    return succeeded, len(results) - succeeded
+
+
+# ================================
+# 上传去重缓存
+# ================================
+def _expiry_of(remote):
+    """云端文件的过期时间 (UTC)；SDK 未返回时按 File API 的保留期估算。"""
+    expiration = getattr(remote, 'expiration_time', None)
+    if isinstance(expiration, datetime):
+        return expiration if expiration.tzinfo else expiration.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) + timedelta(hours=FILE_API_TTL_HOURS)
+
+
+class UploadCache:
+    """
+    以 PDF 内容的 SHA-256 为键，记录云端副本的 name、uri 与过期时间，保存在 upload_cache.json。
+    按内容而不是文件名查找，因此 name_process.py 重命名后的文件、error_process.py 重置为
+    pending_upload 的文件都能命中仍然有效的副本，不必重新上传数百 MB 到数 GB 的 PDF。
+
+    lookup 会向 File API 确认副本仍然存在且未失败 (一次很轻的 get 请求)，
+    距离过期不足 UPLOAD_REUSE_MIN_REMAINING_HOURS 的副本视为失效。
+    同一路径的哈希按 (大小, mtime) 记忆，未修改的文件不重复计算。线程安全；
+    hash_lock 让同一内容的查找与上传在进程内串行，避免并发的两个线程都未命中而重复上传。
+    """
+
+    def __init__(self, path=UPLOAD_CACHE_FILE, min_remaining_hours=UPLOAD_REUSE_MIN_REMAINING_HOURS):
+        self.path = path
+        self.min_remaining = timedelta(hours=min_remaining_hours)
+        self.entries = {}
+        self.hashes = {}
+        self.lock = threading.Lock()
+        self._hash_locks = {}    # sha256 -> 该内容的上传锁
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get('entries', {})
+            self.hashes = data.get('hashes', {})
+
+    def _save(self):
+        write_json_atomic(self.path, {'entries': self.entries, 'hashes': self.hashes})
+
+    def hash_file(self, path):
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        with self.lock:
+            known = self.hashes.get(key)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['sha256']
+        sha256 = file_sha256(path)
+        with self.lock:
+            self.hashes[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+            self._save()
+        return sha256
+
+    def hash_lock(self, sha256):
+        with self.lock:
+            return self._hash_locks.setdefault(sha256, threading.Lock())
+
+    def _drop(self, sha256):
+        with self.lock:
+            if self.entries.pop(sha256, None) is not None:
+                self._save()
+
+    def lookup(self, sha256, files_api=None):
+        """返回仍然有效的云端文件；files_api 为 None 时只按本地记录判断，返回记录本身。"""
+        with self.lock:
+            entry = self.entries.get(sha256)
+        if entry is None:
+            return None
+        expires_at = datetime.fromisoformat(entry['expires_at'])
+        if expires_at - datetime.now(timezone.utc) < self.min_remaining:
+            self._drop(sha256)
+            return None
+        if files_api is None:
+            return entry
+        try:
+            remote = files_api.get(name=entry['name'])
+        except Exception:
+            # 已被删除 (例如 error_process.py / cloud_manager.py) 或无法确认，重新上传
+            self._drop(sha256)
+            return None
+        remote_state = getattr(remote, 'state', None)
+        if getattr(remote_state, 'name', remote_state) == 'FAILED':
+            self._drop(sha256)
+            return None
+        return remote
+
+    def store(self, sha256, remote):
+        with self.lock:
+            self.entries[sha256] = {
+                'name': remote.name,
+                'uri': remote.uri,
+                'expires_at': _expiry_of(remote).isoformat(),
+            }
+            self._save()
+
+    def forget(self, remote_names):
+        """云端文件被主动删除后调用，移除指向它们的缓存条目。"""
+        remote_names = set(remote_names)
+        with self.lock:
+            stale = [sha256 for sha256, entry in self.entries.items() if entry['name'] in remote_names]
+            for sha256 in stale:
+                del self.entries[sha256]
+            if stale:
+                self._save()
+        return len(stale)
+
+
+class LegacyGenaiFiles:
+    """把旧版 google.generativeai 的 upload_file / get_file 包装成与 client.files 相同的接口。"""
+
+    def __init__(self, genai_module):
+        self.genai = genai_module
+
+    def upload(self, file, config=None):
+        return self.genai.upload_file(file)
+
+    def get(self, name):
+        return self.genai.get_file(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用本地替身 File API 测试并发上传、重试、上传去重缓存与状态写入")
+    parser.add_argument('--files', type=int, default=40, help="模拟的 PDF 数量")
+    parser.add_argument('--size-mb', type=float, default=1.0, help="每个模拟 PDF 的大小 (MB)")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, UPLOAD_WORKERS], help="要比较的并发数列表")
+    parser.add_argument('--latency', type=float, default=0.2, help="每次上传的固定延迟 (秒)")
+    parser.add_argument('--bandwidth', type=float, default=None, help="模拟带宽 (MB/s)，不设置则不按大小计时")
+    parser.add_argument('--failure-rate', type=float, default=0.2, help="每次上传失败的概率")
+    parser.add_argument('--retries', type=int, default=UPLOAD_RETRIES, help="重试次数")
+    parser.add_argument('--backoff', type=float, default=0.05, help="首次退避秒数")
+    args = parser.parse_args()
+
+    from fake_backend import FakeFileAPI, FakeGenaiClient
+
+    work_dir = tempfile.mkdtemp(prefix='kg_upload_bench_')
+    try:
+        pdf_folder = os.path.join(work_dir, 'data')
+        os.makedirs(pdf_folder)
+        payload = os.urandom(int(args.size_mb * 1024 * 1024))
+        pdf_files = [f"book_{i:04d}.pdf" for i in range(args.files)]
+        for i, pdf_file in enumerate(pdf_files):
+            with open(os.path.join(pdf_folder, pdf_file), 'wb') as f:
+                f.write(i.to_bytes(4, 'big') + payload)
+
+        for workers in args.workers:
+            state = StateStore(os.path.join(work_dir, f"state_{workers}.db"), legacy_json=None)
+            state.add_missing(pdf_files, {'status': 'pending_upload'})
+            cache = UploadCache(os.path.join(work_dir, f"upload_cache_{workers}.json"))
+            files_api = FakeFileAPI(args.latency, args.failure_rate, args.bandwidth, seed=workers)
+            start = time.perf_counter()
+            succeeded, failed = upload_pending_files(FakeGenaiClient(files_api), state, pdf_folder, pdf_files,
+                                                     workers, args.retries, args.backoff, cache)
+            elapsed = time.perf_counter() - start
+            counts = state.status_counts()
+            print(f"\n并发 {workers}: 成功 {succeeded}，失败 {failed}，耗时 {elapsed:.2f}s，"
+                  f"上传调用 {files_api.upload_calls} 次 (失败 {files_api.failures} 次)，"
+                  f"最大并发 {files_api.max_concurrency}，状态库: {counts}。\n")
+
+            # 模拟 error_process.py 把条目重置为 pending_upload 后重跑：内容未变的文件应全部命中缓存
+            calls_before = files_api.upload_calls
+            for pdf_file in pdf_files:
+                state.set(pdf_file, {'status': 'pending_upload'})
+            start = time.perf_counter()
+            upload_pending_files(FakeGenaiClient(files_api), state, pdf_folder, pdf_files,
+                                 workers, args.retries, args.backoff, cache)
+            print(f"\n并发 {workers} 重置后重跑: 耗时 {time.perf_counter() - start:.2f}s，"
+                  f"新增上传调用 {files_api.upload_calls - calls_before} 次。\n")
+            state.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
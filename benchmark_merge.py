@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+# ================================
+# 配置区
+# ================================
+# 每种规模的书籍数量
+CORPUS_SIZES = [50, 200, 800]
+# 每本书的节点数与关系数
+NODES_PER_BOOK = 400
+RELS_PER_BOOK = 800
+
+LABELS = ['Alloy', 'Element', 'Phase', 'MechanicalProperty', 'HeatTreatment', 'Defect']
+REL_TYPES = ['CONTAINS_ELEMENT', 'HAS_PHASE', 'HAS_PROPERTY', 'PROCESSED_BY', 'CAN_CAUSE_DEFECT']
+
+
+# ================================
+# 合成语料
+# ================================
+def generate_synthetic_corpus(directory, n_books, nodes_per_book=NODES_PER_BOOK,
+                              rels_per_book=RELS_PER_BOOK, seed=0):
+    """生成 n_books 个与 LLM 输出结构相同的知识图谱 JSON 文件，返回总字节数。"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    total_bytes = 0
+    for b in range(n_books):
+        nodes = []
+        for i in range(nodes_per_book):
+            label = rng.choice(LABELS)
+            nodes.append({
+                "id": f"{label.lower()}_{b}_{i}",
+                "label": label,
+                "properties": {
+                    "name": f"{label} {b}-{i}",
+                    "description": "高温合金相关实体的描述文本。" * rng.randint(1, 4),
+                    "composition": {"ni": rng.random() * 60, "cr": rng.random() * 20}
+                }
+            })
+        rels = []
+        for _ in range(rels_per_book):
+            source, target = rng.sample(nodes, 2)
+            rels.append({
+                "source": source["id"],
+                "target": target["id"],
+                "type": rng.choice(REL_TYPES),
+                "properties": {"context": "原文中证明该关系的句子。", "detail": {"weight_percentage": 19.5}}
+            })
+        path = os.path.join(directory, f"book_{b:05d}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"nodes": nodes, "relationships": rels}, f, ensure_ascii=False, indent=2)
+        total_bytes += os.path.getsize(path)
+    return total_bytes
+
+
+# ================================
+# 子进程中运行合并并测量
+# ================================
+_CHILD_CODE = """
+import sys, time, json, io, hashlib, contextlib
+import merge_json
+args = json.loads(sys.argv[1])
+mode = args.pop('mode')
+func = {'legacy': merge_json.merge_and_flatten_knowledge_graph_json,
+        'stream': merge_json.stream_merge_knowledge_graph_json}[mode.split('+')[0]]
+if mode.endswith('+dedup'):
+    args['dedup'] = True
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    func(**args)
+elapsed = time.perf_counter() - start
+with open(args['output_filename'], 'rb') as f:
+    digest = hashlib.sha256(f.read()).hexdigest()
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+except ImportError:
+    try:
+        import psutil
+        rss_mb = psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    except (ImportError, AttributeError):
+        rss_mb = None
+print(json.dumps({'seconds': elapsed, 'peak_rss_mb': rss_mb, 'sha256': digest}))
+"""
+
+
+def run_merge_in_child(mode, **kwargs):
+    """在独立进程中运行一次合并，返回耗时、峰值 RSS 与输出文件哈希，避免各次运行互相影响。"""
+    payload = json.dumps(dict(kwargs, mode=mode))
+    proc = subprocess.run([sys.executable, '-c', _CHILD_CODE, payload],
+                          cwd=os.path.dirname(os.path.abspath(__file__)),
+                          capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="merge_json.py 内存、耗时与多进程加速基准测试")
+    parser.add_argument('--sizes', type=int, nargs='+', default=CORPUS_SIZES, help="书籍数量列表")
+    parser.add_argument('--nodes', type=int, default=NODES_PER_BOOK, help="每本书的节点数")
+    parser.add_argument('--rels', type=int, default=RELS_PER_BOOK, help="每本书的关系数")
+    parser.add_argument('--modes', nargs='+', default=['legacy', 'stream'], help="要比较的合并模式 (legacy / stream / stream+dedup)")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1],
+                        help="流式模式下要比较的进程数列表，例如 1 2 4 8")
+    parser.add_argument('--output', default=None, help="结果 JSONL 文件 (可选)")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='kg_merge_bench_')
+    results = []
+    try:
+        print(f"{'书籍数':>8} {'语料(MB)':>10} {'模式':>14} {'进程数':>6} {'耗时(s)':>10} "
+              f"{'峰值RSS(MB)':>12} {'加速比':>8} {'输出一致':>8}")
+        for n_books in args.sizes:
+            corpus_dir = os.path.join(work_dir, f"corpus_{n_books}")
+            corpus_bytes = generate_synthetic_corpus(corpus_dir, n_books, args.nodes, args.rels)
+            for mode in args.modes:
+                # legacy 模式不支持多进程，只跑一次
+                worker_counts = [1] if mode == 'legacy' else args.workers
+                baseline = None
+                for workers in worker_counts:
+                    output_file = os.path.join(work_dir, f"merged_{n_books}_{mode}_{workers}.json")
+                    kwargs = dict(source_directory=corpus_dir, output_filename=output_file)
+                    if mode != 'legacy':
+                        kwargs['workers'] = workers
+                    stats = run_merge_in_child(mode, **kwargs)
+                    baseline = baseline or stats
+                    speedup = baseline['seconds'] / stats['seconds'] if stats['seconds'] else 0.0
+                    identical = stats['sha256'] == baseline['sha256']
+                    rss = f"{stats['peak_rss_mb']:.1f}" if stats['peak_rss_mb'] is not None else 'N/A'
+                    print(f"{n_books:>8} {corpus_bytes / 1e6:>10.1f} {mode:>14} {workers:>6} {stats['seconds']:>10.2f} "
+                          f"{rss:>12} {speedup:>8.2f} {'是' if identical else '否':>8}")
+                    results.append(dict(stats, books=n_books, corpus_bytes=corpus_bytes, mode=mode,
+                                        workers=workers, speedup=speedup, identical_to_first=identical))
+                    os.remove(output_file)
+            shutil.rmtree(corpus_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for r in results:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        print(f"\n结果已写入: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+from datetime import datetime, timezone
+
+import metrics
+from gemini_json_batch import BATCH_SIZE, process_job_results
+from job_scheduler import FakeBatchJob
+from fake_backend import FakeBackend
+from merge_json import _iter_flattened_file, list_source_files, stream_merge_knowledge_graph_json
+from neo4j_import import FakeNeo4jDriver, import_graph
+from state_store import StateStore
+
+# ================================
+# 配置区
+# ================================
+# 每种规模的书籍数量
+CORPUS_SIZES = [20, 100, 400]
+# 每本书的节点数与关系数
+NODES_PER_BOOK = 200
+RELS_PER_BOOK = 400
+# 节点取自跨书共享实体池 (会被去重合并) 的比例
+DUPLICATE_RATE = 0.3
+# 共享实体池的大小
+SHARED_ENTITIES = 2000
+# 与 --baseline 比较时，耗时超过基线多少比例视为性能回退
+REGRESSION_TOLERANCE = 0.25
+# 短于此时长的阶段受计时噪声影响太大，不参与回退判断
+MIN_COMPARE_SECONDS = 0.05
+# 每种规模重复运行的次数，各阶段取最短耗时
+REPEATS = 3
+STAGES = ['state_io', 'result_parsing', 'flatten', 'merge', 'dedup', 'import']
+
+# 合成实体名称：中文、希腊字母与合金牌号混合，覆盖 entity_dedup 的各种规范化路径
+ENTITY_NAMES = {
+    'Alloy': ['Inconel 718', 'IN718', 'GH4169', 'Rene 88DT', 'Waspaloy', 'CMSX-4', 'K417G', '镍基高温合金'],
+    'Phase': ['γ′相', 'γ″相', 'δ相', 'Laves相', 'η相', 'σ相', 'μ相', 'MC碳化物'],
+    'Element': ['镍', '铬', '钴', '铌', '钼', '铝', '钛', '钨'],
+    'MechanicalProperty': ['屈服强度', '蠕变强度', '持久寿命', '疲劳强度', '抗氧化性'],
+    'HeatTreatment': ['固溶处理', '时效处理', '双级时效', '热等静压'],
+    'Defect': ['堆垛层错', '孪晶', '位错', '雀斑', '缩孔'],
+}
+# 同一实体在不同书中的写法 (希腊字母拼写、撇号、大小写、全角空格)
+NAME_VARIANTS = [
+    lambda name: name,
+    lambda name: name.replace('γ', 'gamma ').replace('δ', 'delta ').replace('η', 'eta ').replace('σ', 'sigma ')
+                     .replace('μ', 'mu ').replace('′', ' prime').replace('″', ' doubleprime'),
+    lambda name: name.upper(),
+    lambda name: name.replace(' ', '　'),
+]
+REL_TYPES = ['CONTAINS_ELEMENT', 'HAS_PHASE', 'HAS_PROPERTY', 'PROCESSED_BY', 'CAN_CAUSE_DEFECT']
+
+
+# ================================
+# 合成语料
+# ================================
+def _shared_entity(index):
+    label = list(ENTITY_NAMES)[index % len(ENTITY_NAMES)]
+    base = ENTITY_NAMES[label][(index // len(ENTITY_NAMES)) % len(ENTITY_NAMES[label])]
+    name = f"{base} {index}"
+    return label, name
+
+
+def generate_book_graph(rng, book_index, nodes_per_book, rels_per_book, duplicate_rate, shared_entities):
+    """生成一本书的图谱：duplicate_rate 比例的节点来自共享实体池，并使用随机的名称写法。"""
+    nodes = []
+    seen = set()
+    for i in range(nodes_per_book):
+        if rng.random() < duplicate_rate:
+            index = rng.randrange(shared_entities)
+            label, name = _shared_entity(index)
+            name = rng.choice(NAME_VARIANTS)(name)
+            # 有时带 label 前缀，有时不带，由 entity_dedup 的规范化键合并
+            node_id = f"{label.lower()}_{index}" if rng.random() < 0.5 else f"shared_{index}"
+        else:
+            label = rng.choice(list(ENTITY_NAMES))
+            name = f"{rng.choice(ENTITY_NAMES[label])} 第{book_index}册-{i}"
+            node_id = f"{label.lower()}_b{book_index}_{i}"
+        if node_id in seen:
+            continue
+        seen.add(node_id)
+        nodes.append({'id': node_id, 'label': label,
+                      'properties': {'name': name, 'description': '高温合金相关实体的描述文本。' * rng.randint(1, 3),
+                                     'composition': {'ni': round(rng.random() * 60, 2), 'cr': round(rng.random() * 20, 2)}}})
+    rels = []
+    for _ in range(rels_per_book):
+        source, target = rng.sample(nodes, 2)
+        rels.append({'source': source['id'], 'target': target['id'], 'type': rng.choice(REL_TYPES),
+                     'properties': {'context': '原文中证明该关系的句子。', 'detail': {'weight_percentage': 19.5}}})
+    return {'nodes': nodes, 'relationships': rels}
+
+
+def build_result_files(backend, books, graphs):
+    """把每本书的图谱包装成批处理结果 JSONL (每 BATCH_SIZE 本一个作业)，放进替身后端，返回作业列表。"""
+    jobs = []
+    now = datetime.now(timezone.utc)
+    for start in range(0, len(books), BATCH_SIZE):
+        lines = []
+        for book, graph in zip(books[start:start + BATCH_SIZE], graphs[start:start + BATCH_SIZE]):
+            text = json.dumps(graph, ensure_ascii=False)
+            lines.append(json.dumps({'key': book, 'response': {
+                'candidates': [{'content': {'parts': [{'text': f"```json\n{text}\n```"}]}}]}}, ensure_ascii=False))
+        job = FakeBatchJob(f"batches/bench-{start // BATCH_SIZE}", 'JOB_STATE_SUCCEEDED', now, now)
+        job.dest = type('Dest', (), {'file_name': backend.files.put(('\n'.join(lines) + '\n').encode('utf-8'),
+                                                                    job.name)})()
+        jobs.append(job)
+    return jobs
+
+
+# ================================
+# 各阶段计时
+# ================================
+def _timed(func):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        items = func()
+    return time.perf_counter() - start, items
+
+
+def run_stages(work_dir, n_books, nodes_per_book, rels_per_book, duplicate_rate, import_workers, seed):
+    """在 work_dir 中按顺序跑完所有阶段，返回 {阶段: (耗时, 处理条数)}。"""
+    rng = random.Random(seed)
+    books = [f"book_{i:05d}.pdf" for i in range(n_books)]
+    graphs = [generate_book_graph(rng, i, nodes_per_book, rels_per_book, duplicate_rate, SHARED_ENTITIES)
+              for i in range(n_books)]
+    json_dir = os.path.join(work_dir, 'json')
+    os.makedirs(json_dir)
+    results = {}
+    state = StateStore(os.path.join(work_dir, 'state.db'), legacy_json=None)
+    try:
+        # 状态读写：与 gemini_json_batch.py 一次运行中的读写模式相同
+        def state_io():
+            state.add_missing(books, {'status': 'pending_upload'})
+            for i, book in enumerate(books):
+                state.update(book, status='uploaded', uploaded_file_name=f"files/{i}", uploaded_file_uri=f"uri/{i}")
+            for start in range(0, n_books, BATCH_SIZE):
+                chunk = list(state.by_status('uploaded'))[:BATCH_SIZE]
+                state.update_many(chunk, status='processing', batch_job_name=f"batches/bench-{start // BATCH_SIZE}")
+            state.job_names_with_status('processing')
+            return n_books * 3
+        results['state_io'] = _timed(state_io)
+
+        backend = FakeBackend()
+        jobs = build_result_files(backend, books, graphs)
+
+        def result_parsing():
+            for job in jobs:
+                process_job_results(backend, job, state, json_dir)
+            return sum(len(g['nodes']) + len(g['relationships']) for g in graphs)
+        results['result_parsing'] = _timed(result_parsing)
+    finally:
+        state.close()
+
+    def flatten():
+        return sum(1 for name in list_source_files(json_dir) for _ in _iter_flattened_file(os.path.join(json_dir, name)))
+    results['flatten'] = _timed(flatten)
+
+    merged = os.path.join(work_dir, 'merged.json')
+    deduped = os.path.join(work_dir, 'merged_dedup.json')
+    source_items = results['flatten'][1]
+
+    def merge(output, dedup):
+        stream_merge_knowledge_graph_json(json_dir, output, dedup=dedup)
+        return source_items
+    results['merge'] = _timed(lambda: merge(merged, False))
+    results['dedup'] = _timed(lambda: merge(deduped, True))
+
+    def neo4j_import():
+        stats = import_graph(deduped, FakeNeo4jDriver(), workers=import_workers)
+        return stats.rows['nodes'] + stats.rows['relationships']
+    results['import'] = _timed(neo4j_import)
+    return results
+
+
+def compare_with_baseline(results, baseline_path, tolerance):
+    """按 (书籍数, 阶段) 与基线结果比较，返回回退的条目列表。"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(r['books'], r['stage']): r for r in map(json.loads, f) if r}
+    regressions = []
+    print(f"\n与基线 '{baseline_path}' 比较 (容差 {tolerance:.0%}):")
+    for r in results:
+        base = baseline.get((r['books'], r['stage']))
+        if not base or max(base['seconds'], r['seconds']) < MIN_COMPARE_SECONDS:
+            continue
+        ratio = r['seconds'] / base['seconds']
+        flag = '❌ 回退' if ratio > 1 + tolerance else '✅'
+        print(f"  {r['books']:>6} {r['stage']:<16} {base['seconds']:>9.3f}s -> {r['seconds']:>9.3f}s ({ratio:.2f}x) {flag}")
+        if ratio > 1 + tolerance:
+            regressions.append(r)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从批处理结果解析到 Neo4j 导入的端到端基准测试 (全部使用本地替身)")
+    parser.add_argument('--sizes', type=int, nargs='+', default=CORPUS_SIZES, help="书籍数量列表")
+    parser.add_argument('--nodes', type=int, default=NODES_PER_BOOK, help="每本书的节点数")
+    parser.add_argument('--rels', type=int, default=RELS_PER_BOOK, help="每本书的关系数")
+    parser.add_argument('--duplicate-rate', type=float, default=DUPLICATE_RATE, help="取自跨书共享实体的节点比例")
+    parser.add_argument('--import-workers', type=int, default=1, help="导入阶段的并发会话数")
+    parser.add_argument('--repeats', type=int, default=REPEATS, help="每种规模重复次数，各阶段取最短耗时")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.jsonl', help="结果 JSONL 文件")
+    parser.add_argument('--baseline', default=None, help="之前的结果文件，用于检测性能回退")
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE, help="允许的耗时增幅")
+    args = parser.parse_args()
+    # 基准只测各阶段本身，不把埋点写文件的开销和事件混进正式指标
+    metrics.REGISTRY.enabled = False
+
+    results = []
+    print(f"{'书籍数':>8} {'阶段':<16} {'耗时(s)':>10} {'条数':>10} {'条/秒':>12}")
+    for n_books in args.sizes:
+        stages = {}
+        for _ in range(max(1, args.repeats)):
+            work_dir = tempfile.mkdtemp(prefix='kg_pipeline_bench_')
+            try:
+                run = run_stages(work_dir, n_books, args.nodes, args.rels, args.duplicate_rate,
+                                 args.import_workers, args.seed)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            for stage, (seconds, items) in run.items():
+                if stage not in stages or seconds < stages[stage][0]:
+                    stages[stage] = (seconds, items)
+        for stage in STAGES:
+            seconds, items = stages[stage]
+            rate = items / seconds if seconds else 0.0
+            print(f"{n_books:>8} {stage:<16} {seconds:>10.3f} {items:>10} {rate:>12.0f}")
+            results.append({'books': n_books, 'nodes_per_book': args.nodes, 'rels_per_book': args.rels,
+                            'duplicate_rate': args.duplicate_rate, 'stage': stage, 'seconds': seconds,
+                            'items': items, 'items_per_second': rate, 'repeats': args.repeats,
+                            'python': sys.version.split()[0]})
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for r in results:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    print(f"\n结果已写入: {args.output}")
+
+    if args.baseline and compare_with_baseline(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,9 @@
-import os
-from google import genai
-from google.api_core import exceptions
 from datetime import datetime, timezone
 
-# ================================
-# 配置区
-# ================================
-# 配置代理 (如果需要)
-os.environ["http_proxy"] = "http://127.0.0.1:7890"
-os.environ["https_proxy"] = "http://127.0.0.1:7890"
+from batch_upload import UploadCache
+from error_process import PART_FIELDS
+from llm_backend import create_backend
+from state_store import StateStore
 
 
 # ================================
@@ -67,14 +62,27 @@ def manage_uploaded_files(client):
             indices = sorted(indices)
 
         print("\n🔥 正在删除所选文件，请稍候...")
+        deleted_names = []
         for idx in indices:
             f = files[idx - 1]
             display_name = f.display_name or "未知"
             try:
                 client.files.delete(name=f.name)
+                deleted_names.append(f.name)
                 print(f"  - 已删除 {display_name} ({f.name})")
             except Exception as e:
                 print(f"  - 🔥 删除 {display_name} 失败: {e}")
+        # 已删除的云端文件不能再被上传去重缓存复用；引用它们且尚未提交作业的条目重置为待上传
+        UploadCache().forget(deleted_names)
+        with StateStore() as store:
+            stale = {filename: data for filename, data in store.by_uploaded_file(deleted_names).items()
+                     if data.get('status') == 'uploaded'}
+            for filename, data in stale.items():
+                # 分卷/片段保留来源与页码，拼接和片段说明都依赖这些字段
+                part_fields = {k: data[k] for k in PART_FIELDS if k in data}
+                store.set(filename, {'status': 'pending_upload', **part_fields})
+        if stale:
+            print(f"  - 🔄 {len(stale)} 个尚未提交作业的文件已在状态库中重置为待上传。")
         print("\n✅ 文件删除操作完成！")
 
     except Exception as e:
@@ -140,12 +148,19 @@ def manage_batch_jobs(client):
                     print(f"  - 正在取消作业: {job.display_name}...")
                     client.batches.cancel(name=job.name)  # 优先取消
                     print(f"    - 取消成功。")
+                    with StateStore() as store:
+                        updated = store.update_job(job.name, status='failed_job_state_cancelled',
+                                                   error=f'作业已在 cloud_manager 中手动取消 '
+                                                         f'(运行 {job.duration_hours:.1f} 小时，'
+                                                         f'超过所设阈值 {HOURS_THRESHOLD} 小时)')
+                    if updated:
+                        print(f"    - 状态库中 {updated} 个相关文件已标记为失败。")
 
                     # 取消后通常需要一点时间才能删除，这里我们直接尝试
                     try:
                         client.batches.delete(name=job.name)  # 然后删除
                         print(f"    - 已从列表中删除。")
-                    except exceptions.PermissionDenied as e:
+                    except Exception as e:
                         print(f"    - 提示：作业已取消，但立即删除失败 (这通常是正常的，稍后会自动清理): {e}")
 
                 except Exception as e:
@@ -165,14 +180,9 @@ def main():
     """
     主菜单，让用户选择要管理的项目。
     """
-    # 初始化新版 SDK 客户端
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("❌ 错误: 请设置 GEMINI_API_KEY 环境变量")
-        return
-
+    # 初始化客户端 (LLM_BACKEND=fake 时使用本地替身)
     try:
-        client = genai.Client(api_key=api_key)
+        client = create_backend()
         print("✅ Gemini 客户端初始化成功。")
     except Exception as e:
         print(f"❌ Gemini 初始化失败: {e}")
@@ -0,0 +1,265 @@
+import re
+import json
+import unicodedata
+
+
+# ================================
+# 配置区
+# ================================
+# 规范化名称时使用的希腊字母替换表 (γ′ 与 gamma_prime 归一为同一个键)
+GREEK_LETTER_NAMES = {
+    'α': 'alpha', 'β': 'beta', 'γ': 'gamma', 'δ': 'delta', 'ε': 'epsilon', 'ζ': 'zeta',
+    'η': 'eta', 'θ': 'theta', 'ι': 'iota', 'κ': 'kappa', 'λ': 'lambda', 'μ': 'mu',
+    'ν': 'nu', 'ξ': 'xi', 'ο': 'omicron', 'π': 'pi', 'ρ': 'rho', 'σ': 'sigma', 'ς': 'sigma',
+    'τ': 'tau', 'υ': 'upsilon', 'φ': 'phi', 'χ': 'chi', 'ψ': 'psi', 'ω': 'omega',
+}
+# 各种撇号/角分符号都视为 prime
+PRIME_MARKS = {'′': 'prime', '″': 'doubleprime', "'": 'prime', '’': 'prime', 'ʹ': 'prime'}
+
+# 规范化键的改写规则 (正则, 替换)，例如 IN718 -> Inconel 718
+ALIAS_RULES = [
+    (re.compile(r'^in(\d{3}[a-z]?)$'), r'inconel\1'),
+]
+
+# 属性冲突时保留更长文本的字段
+LONGEST_TEXT_PROPERTIES = {'description', 'context'}
+
+_NON_WORD_RE = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalize_entity_key(text):
+    """
+    将实体名称或 id 规范化为比较用的键：
+    全角转半角、忽略大小写、希腊字母与撇号转为英文单词、去掉空格下划线等分隔符。
+    """
+    if not isinstance(text, str):
+        return ''
+    # 先替换 ″，因为 NFKC 会把它拆成两个 ′
+    text = text.replace('″', 'doubleprime')
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = ''.join(GREEK_LETTER_NAMES.get(ch, PRIME_MARKS.get(ch, ch)) for ch in text)
+    key = _NON_WORD_RE.sub('', text)
+    for pattern, replacement in ALIAS_RULES:
+        key = pattern.sub(replacement, key)
+    return key
+
+
+def load_alias_file(filepath):
+    """
+    加载人工维护的别名表，格式为 {"别名": "标准名称", ...}。
+    返回 {规范化别名: 规范化标准名称}。
+    """
+    with open(filepath, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+    return {normalize_entity_key(alias): normalize_entity_key(canonical) for alias, canonical in raw.items()}
+
+
+def _is_empty(value):
+    return value is None or value == '' or value == [] or value == {}
+
+
+def merge_properties(target, incoming):
+    """
+    将 incoming 的属性合并进 target，冲突规则：
+      1. target 中缺失或为空的字段直接取 incoming 的值；
+      2. 两边都是列表时取并集，保持首次出现的顺序；
+      3. description / context 等文本字段保留更长的一份；
+      4. 其他冲突一律保留先出现的值。
+    """
+    for key, value in incoming.items():
+        if _is_empty(value):
+            continue
+        current = target.get(key)
+        if _is_empty(current):
+            target[key] = value
+        elif isinstance(current, list) and isinstance(value, list):
+            seen = {json.dumps(v, sort_keys=True, ensure_ascii=False) for v in current}
+            for v in value:
+                marker = json.dumps(v, sort_keys=True, ensure_ascii=False)
+                if marker not in seen:
+                    seen.add(marker)
+                    current.append(v)
+        elif key in LONGEST_TEXT_PROPERTIES and isinstance(current, str) and isinstance(value, str):
+            if len(value) > len(current):
+                target[key] = value
+    return target
+
+
+class GraphDeduplicator:
+    """
+    合并阶段的实体去重与 id 规范化索引。
+
+    节点按以下顺序查找已存在的规范节点：
+      1. 完全相同的 id；
+      2. 同一 label 下规范化后的 id (去掉 label 前缀)；
+      3. 同一 label 下规范化后的 name。
+    命中后合并 properties，否则以该节点 id 作为新的规范 id。先出现的节点总是规范节点，
+    因此在文件顺序固定时结果是确定的。
+
+    关系在 flush 时统一改写为规范 id，并按 (source, type, target) 去重合并属性。
+    内存占用与去重后的实体数量成正比。
+
+    接口与 StreamingGraphWriter 一致 (write_node / write_relationship / begin_file /
+    commit_file / rollback_file)，可直接替换写出器接入合并流程。
+    """
+
+    def __init__(self, aliases=None):
+        self.aliases = aliases or {}
+        self.nodes = {}          # 规范 id -> 节点
+        self.id_map = {}         # 原始 id -> 规范 id
+        self.alias_index = {}    # (label, 规范化键) -> 规范 id
+        self.anonymous_nodes = []  # 没有 id 的节点原样保留
+        self.relationships = {}  # 原始 (source, type, target) -> 关系
+        self.input_node_count = 0
+        self.input_rel_count = 0
+        self.alias_merge_count = 0
+        self.dropped_self_loops = 0
+        self._pending = None
+
+    # ---------- 与写出器相同的接口 ----------
+    def begin_file(self):
+        self._pending = ([], [])
+
+    def commit_file(self):
+        nodes, rels = self._pending
+        self._pending = None
+        for node in nodes:
+            self.add_node(node)
+        for rel in rels:
+            self.add_relationship(rel)
+
+    def rollback_file(self):
+        self._pending = None
+
+    def write_node(self, node):
+        if self._pending is not None:
+            self._pending[0].append(node)
+        else:
+            self.add_node(node)
+
+    def write_relationship(self, rel):
+        if self._pending is not None:
+            self._pending[1].append(rel)
+        else:
+            self.add_relationship(rel)
+
+    # ---------- 索引 ----------
+    def _alias_keys(self, node):
+        label = node.get('label') or ''
+        keys = []
+        node_id = node.get('id')
+        if isinstance(node_id, str):
+            prefix = label.lower() + '_'
+            stripped = node_id[len(prefix):] if label and node_id.lower().startswith(prefix) else node_id
+            keys.append(normalize_entity_key(stripped))
+        properties = node.get('properties')
+        if isinstance(properties, dict):
+            keys.append(normalize_entity_key(properties.get('name')))
+        result = []
+        for key in keys:
+            key = self.aliases.get(key, key)
+            if key and (label, key) not in result:
+                result.append((label, key))
+        return result
+
+    def add_node(self, node):
+        self.input_node_count += 1
+        node_id = node.get('id')
+        if not node_id or not isinstance(node_id, str):
+            self.anonymous_nodes.append(node)
+            return
+        alias_keys = self._alias_keys(node)
+        canonical_id = self.id_map.get(node_id)
+        if canonical_id is None:
+            for key in alias_keys:
+                canonical_id = self.alias_index.get(key)
+                if canonical_id is not None:
+                    self.alias_merge_count += 1
+                    break
+
+        if canonical_id is None:
+            canonical_id = node_id
+            properties = node.get('properties')
+            self.nodes[canonical_id] = {
+                'id': node_id,
+                'label': node.get('label'),
+                'properties': dict(properties) if isinstance(properties, dict) else {},
+            }
+            for k, v in node.items():
+                self.nodes[canonical_id].setdefault(k, v)
+        else:
+            canonical = self.nodes[canonical_id]
+            if isinstance(node.get('properties'), dict):
+                merge_properties(canonical['properties'], node['properties'])
+            if not canonical.get('label') and node.get('label'):
+                canonical['label'] = node['label']
+
+        self.id_map[node_id] = canonical_id
+        for key in alias_keys:
+            self.alias_index.setdefault(key, canonical_id)
+
+    def add_relationship(self, rel):
+        self.input_rel_count += 1
+        key = (rel.get('source'), rel.get('type'), rel.get('target'))
+        try:
+            existing = self.relationships.get(key)
+        except TypeError:
+            # source/target 不是可哈希的值，无法去重，按唯一关系保留
+            self.relationships[(id(rel), None, None)] = rel
+            return
+        if existing is None:
+            self.relationships[key] = rel
+        elif isinstance(rel.get('properties'), dict):
+            existing.setdefault('properties', {})
+            if isinstance(existing['properties'], dict):
+                merge_properties(existing['properties'], rel['properties'])
+
+    def resolve(self, node_id):
+        """返回 node_id 对应的规范 id，未知 id 原样返回。"""
+        try:
+            return self.id_map.get(node_id, node_id)
+        except TypeError:
+            return node_id
+
+    # ---------- 输出 ----------
+    def iter_relationships(self):
+        """改写为规范 id 并再次按 (source, type, target) 合并后的关系。"""
+        resolved = {}
+        for (source, rel_type, target), rel in self.relationships.items():
+            new_source = self.resolve(rel.get('source'))
+            new_target = self.resolve(rel.get('target'))
+            # 别名归并产生的自环没有意义，直接丢弃
+            if new_source == new_target and rel.get('source') != rel.get('target'):
+                self.dropped_self_loops += 1
+                continue
+            rel['source'], rel['target'] = new_source, new_target
+            try:
+                key = (new_source, rel.get('type'), new_target)
+                existing = resolved.get(key)
+            except TypeError:
+                key, existing = (id(rel), None, None), None
+            if existing is None:
+                resolved[key] = rel
+            elif isinstance(rel.get('properties'), dict):
+                existing.setdefault('properties', {})
+                if isinstance(existing['properties'], dict):
+                    merge_properties(existing['properties'], rel['properties'])
+        return resolved.values()
+
+    def flush(self, writer):
+        """将去重后的节点与关系写入 writer。"""
+        for node in self.nodes.values():
+            writer.write_node(node)
+        for node in self.anonymous_nodes:
+            writer.write_node(node)
+        for rel in self.iter_relationships():
+            writer.write_relationship(rel)
+
+    def summary(self):
+        return {
+            'input_nodes': self.input_node_count,
+            'unique_nodes': len(self.nodes) + len(self.anonymous_nodes),
+            'alias_merges': self.alias_merge_count,
+            'input_relationships': self.input_rel_count,
+            'dropped_self_loops': self.dropped_self_loops,
+        }
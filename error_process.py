@@ -1,18 +1,19 @@
-import json
 import os
 import shutil
 from collections import defaultdict
-from google import genai
-from google.api_core import exceptions
+from batch_upload import UploadCache
+from llm_backend import create_backend, is_not_found
+from state_store import STATE_DB_FILE, LEGACY_STATE_FILE, StateStore
 
 # ================================
 # 配置区
 # ================================
-os.environ["http_proxy"] = "http://127.0.0.1:7890"
-os.environ["https_proxy"] = "http://127.0.0.1:7890"
-
-STATE_FILE = "processing_state.json"
+STATE_FILE = STATE_DB_FILE
 PDF_SOURCE_FOLDER = "data"
+# 超出页数/token 限制的整本书不再归档，改为标记 needs_split，由 pdf_split.py 拆分后重新处理
+SPLIT_FOLDER = "files_oversized"
+# 分卷条目重置时需要保留的字段
+PART_FIELDS = ('parent', 'page_start', 'page_end')
 
 # 【核心修改】更新错误映射，将错误类型归类到指定的三个文件夹中
 UNRECOVERABLE_ERROR_MAP = {
@@ -25,6 +26,8 @@ UNRECOVERABLE_ERROR_MAP = {
     "[WinError 10054]": "files_disconnected",
 
     # 其他问题 -> files_other_questions
+    # (拆分后的分卷仍然超限时原书记为此错误，归档后人工调小 SPLIT_MAX_PAGES 再处理，避免反复拆分重跑)
+    "分卷仍超出限制": "files_other_questions",
     "The document has no pages": "files_other_questions",
     "Request contains an invalid argument": "files_other_questions"
 }
@@ -34,12 +37,7 @@ UNRECOVERABLE_ERROR_MAP = {
 # ================================
 
 def load_state(state_file):
-    with open(state_file, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-def save_state(state, state_file):
-    with open(state_file, 'w', encoding='utf-8') as f:
-        json.dump(state, f, indent=2, ensure_ascii=False)
+    return StateStore(state_file)
 
 def save_error_md_table(error_dict, md_file='错误文件清单.md'):
     with open(md_file, 'w', encoding='utf-8') as f:
@@ -58,6 +56,7 @@ def delete_cloud_files(client, state, files_to_delete):
         print("✅ 无需删除云端文件。")
         return
     deleted_count = 0
+    deleted_names = []
     for filename in files_to_delete:
         file_info = state.get(filename, {})
         cloud_file_id = file_info.get('uploaded_file_name')
@@ -67,12 +66,17 @@ def delete_cloud_files(client, state, files_to_delete):
                 client.files.delete(name=cloud_file_id)
                 print(f"    - ✅ 删除成功。")
                 deleted_count += 1
-            except exceptions.NotFound:
-                print(f"    - ⚠️ 警告：文件 {cloud_file_id} 在云端未找到。")
+                deleted_names.append(cloud_file_id)
             except Exception as e:
-                print(f"    - ❌ 删除失败: {filename} (ID: {cloud_file_id})，原因: {e}")
+                if is_not_found(e):
+                    print(f"    - ⚠️ 警告：文件 {cloud_file_id} 在云端未找到。")
+                    deleted_names.append(cloud_file_id)
+                else:
+                    print(f"    - ❌ 删除失败: {filename} (ID: {cloud_file_id})，原因: {e}")
         else:
             print(f"  - ℹ️ 跳过: {filename} (无云端文件ID)。")
+    # 云端副本已不存在，从上传去重缓存中移除，重试时重新上传
+    UploadCache().forget(deleted_names)
     print(f"\n✅ 云端文件删除操作完成，共删除 {deleted_count} 个文件。")
 
 def move_and_quarantine_files(quarantine_plan):
@@ -89,9 +93,10 @@ def move_and_quarantine_files(quarantine_plan):
 
     moved_count = 0
     for filename, folder in quarantine_plan.items():
-        os.makedirs(folder, exist_ok=True)
         source_path = os.path.join(PDF_SOURCE_FOLDER, filename)
         destination_path = os.path.join(folder, filename)
+        # 分卷的文件名带 parts/ 子目录
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
 
         if os.path.exists(source_path):
             try:
@@ -112,22 +117,19 @@ def main():
     """主执行函数，完成错误处理的全流程。"""
     # 1. 初始化客户端
     print("⚙️ 初始化 Gemini Client...")
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("❌ 错误：请设置 GEMINI_API_KEY 环境变量后重试。")
-        return
     try:
-        client = genai.Client(api_key=api_key)
+        client = create_backend()
         print("✅ Client 初始化成功。")
     except Exception as e:
         print(f"❌ Client 初始化失败: {e}")
         return
 
     # 2. 加载状态文件
-    if not os.path.exists(STATE_FILE):
+    if not os.path.exists(STATE_FILE) and not os.path.exists(LEGACY_STATE_FILE):
         print(f"❌ 错误：状态文件 '{STATE_FILE}' 不存在。")
         return
-    state = load_state(STATE_FILE)
+    store = load_state(STATE_FILE)
+    state = store.all()
 
     # 3. 识别并分类出错文件，制定归档计划
     print(f"\n" + "=" * 50)
@@ -136,20 +138,30 @@ def main():
     error_type_dict = defaultdict(list)
     files_with_errors = []
     files_to_quarantine = {}
+    files_to_split = set()
+    # 超限的分卷：原书 -> (分卷, 错误信息)
+    failed_parts = {}
 
     for filename, data in state.items():
-        if 'failed' in data.get('status', '') or 'error' in data:
-            error_message = data.get('error', '未知错误')
+        # 成功的条目会把 error 置为 None，只看有值的 error
+        if 'failed' in data.get('status', '') or data.get('error'):
+            error_message = data.get('error') or '未知错误'
             files_with_errors.append(filename)
             error_type_dict[error_message].append(filename)
 
             for error_key, folder in UNRECOVERABLE_ERROR_MAP.items():
                 if error_key in error_message:
-                    files_to_quarantine[filename] = folder
+                    if folder == SPLIT_FOLDER and 'parent' not in data:
+                        files_to_split.add(filename)
+                    else:
+                        if folder == SPLIT_FOLDER:
+                            failed_parts[data['parent']] = (filename, error_message)
+                        files_to_quarantine[filename] = folder
                     break
 
     if not files_with_errors:
         print("\n🎉 恭喜！状态文件中没有发现任何出错的文件。")
+        store.close()
         return
 
     # 4. 报错错误报告
@@ -168,23 +180,39 @@ def main():
     files_to_remove_from_state = set(files_to_quarantine.keys())
     removed_count = 0
     reset_count = 0
+    split_count = 0
 
     for filename in files_with_errors:
         if filename in state:
             if filename in files_to_remove_from_state:
-                del state[filename]
+                store.delete(filename)
                 removed_count += 1
                 print(f"  - 🗑️ 已从状态文件中移除条目: {filename}")
+            elif filename in files_to_split:
+                store.set(filename, {'status': 'needs_split'})
+                split_count += 1
+                print(f"  - ✂️ 已标记为待拆分: {filename}")
             else:
-                state[filename] = {'status': 'pending_upload'}
+                part_fields = {k: state[filename][k] for k in PART_FIELDS if k in state[filename]}
+                store.set(filename, {'status': 'pending_upload', **part_fields})
                 reset_count += 1
                 print(f"  - 🔄 已重置状态以便重试: {filename}")
 
-    # 8. 保存最终状态并总结
-    save_state(state, STATE_FILE)
+    # 分卷被归档后原书永远等不到全部分卷完成，直接标记原书失败并记下是哪个分卷
+    for parent, (part, error_message) in failed_parts.items():
+        if parent in state:
+            store.update(parent, status='failed_split',
+                         error=f"分卷仍超出限制: {part}，需调小 SPLIT_MAX_PAGES 后重新拆分")
+            print(f"  - ❌ '{parent}' 的分卷 '{part}' 仍超出限制 ({error_message})，原书已标记为 failed_split。")
+
+    # 8. 总结 (每个条目在修改时已即时写入数据库)
+    store.close()
     print(f"\n✅ 状态文件更新完成。")
     print(f"  - {removed_count} 个条目因文件被归档而移除。")
     print(f"  - {reset_count} 个条目被重置为 'pending_upload' 以便重试。")
+    print(f"  - {split_count} 个超限条目被标记为 'needs_split'，下次运行 gemini_json_batch.py 时自动拆分。")
+    if failed_parts:
+        print(f"  - {len(failed_parts)} 本书因分卷仍超限被标记为 'failed_split'。")
     print(f"💾 新的状态已保存到 '{STATE_FILE}'。")
 
 if __name__ == '__main__':
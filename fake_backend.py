@@ -0,0 +1,399 @@
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+
+from batch_upload import FILE_API_TTL_HOURS
+from job_scheduler import FakeBatchJob
+from llm_backend import LLM_MODEL, LLMBackend
+
+# ================================
+# 本地替身 File API (不联网，用于测试并发与重试)
+# ================================
+class FakeFileAPIError(Exception):
+    """模拟 File API 返回的错误，code 与 google.genai.errors.APIError 一致。"""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FakeUploadedFile:
+    def __init__(self, name, uri, display_name, size_bytes):
+        self.name = name
+        self.uri = uri
+        self.display_name = display_name
+        self.size_bytes = size_bytes
+        self.state = 'ACTIVE'
+        self.expiration_time = datetime.now(timezone.utc) + timedelta(hours=FILE_API_TTL_HOURS)
+
+
+class FakeFileAPI:
+    """
+    模拟 client.files：upload 按 latency + 文件大小 / bandwidth 休眠，
+    并以 failure_rate 的概率抛出 503 错误。记录上传次数、失败次数与最大并发数。
+    """
+
+    def __init__(self, latency=0.5, failure_rate=0.0, bandwidth_mb_s=None, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.bandwidth_mb_s = bandwidth_mb_s
+        self.files = {}
+        self.upload_calls = 0
+        self.failures = 0
+        self.max_concurrency = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def upload(self, file, config=None):
+        size = os.path.getsize(file)
+        with self._lock:
+            self.upload_calls += 1
+            self._active += 1
+            self.max_concurrency = max(self.max_concurrency, self._active)
+            fail = self._rng.random() < self.failure_rate
+        try:
+            delay = self.latency
+            if self.bandwidth_mb_s:
+                delay += size / (self.bandwidth_mb_s * 1024 * 1024)
+            time.sleep(delay)
+            if fail:
+                with self._lock:
+                    self.failures += 1
+                raise FakeFileAPIError(503, "Service Unavailable (fake)")
+            with self._lock:
+                name = f"files/fake-{len(self.files) + 1:06d}"
+                uploaded = FakeUploadedFile(name, f"https://fake.local/v1beta/{name}",
+                                            os.path.basename(file), size)
+                self.files[name] = uploaded
+            return uploaded
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def get(self, name):
+        if name not in self.files:
+            raise FakeFileAPIError(404, f"File {name} not found (fake)")
+        return self.files[name]
+
+    def delete(self, name):
+        self.get(name)
+        with self._lock:
+            del self.files[name]
+
+    def list(self):
+        return list(self.files.values())
+
+
+class FakeGenaiClient:
+    """只提供 files 属性的替身客户端，可替换 genai.Client 传给上传函数。"""
+
+    def __init__(self, files):
+        self.files = files
+
+
+# ================================
+# 本地替身后端
+# ================================
+def canned_graph(key):
+    """替身返回的知识图谱：每个请求两个节点、一条关系，另有一个所有请求共享的节点。"""
+    stem = os.path.splitext(os.path.basename(key))[0].lower()
+    return {
+        'nodes': [
+            {'id': f"document_{stem}", 'label': 'Document', 'properties': {'name': key}},
+            {'id': 'alloy_inconel_718', 'label': 'Alloy',
+             'properties': {'name': 'Inconel 718', 'description': '镍基高温合金'}},
+        ],
+        'relationships': [
+            {'source': f"document_{stem}", 'target': 'alloy_inconel_718', 'type': 'MENTIONS',
+             'properties': {'context': f"{key} 中讨论了 Inconel 718。"}},
+        ],
+    }
+
+
+def canned_text(contents):
+    """generate_content 的默认替身回答：要求写 Cypher 时返回一条查询，否则返回图谱 JSON。"""
+    prompt = json.dumps(contents, ensure_ascii=False) if not isinstance(contents, str) else contents
+    if 'Cypher' in prompt or 'cypher' in prompt:
+        return "```cypher\nMATCH (a:Alloy) RETURN a.name AS name LIMIT 5\n```"
+    if '查询结果' in prompt:
+        return "根据知识图谱，Inconel 718 是一种镍基高温合金。"
+    return json.dumps(canned_graph('document.pdf'), ensure_ascii=False)
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeDest:
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+
+class _FakeCachedContent:
+    def __init__(self, name, model, expire_time):
+        self.name = name
+        self.model = model
+        self.expire_time = expire_time
+
+
+class FakeFiles(FakeFileAPI):
+    """在 FakeFileAPI 的基础上保存 JSONL 请求文件与结果文件的内容，供替身批处理读取、下载。"""
+
+    def __init__(self, latency=0.05, failure_rate=0.0, seed=None):
+        super().__init__(latency, failure_rate, seed=seed)
+        self.contents = {}
+        self.result_count = 0
+
+    def upload(self, file, config=None):
+        uploaded = super().upload(file, config)
+        if str(file).endswith('.jsonl'):
+            with open(file, 'rb') as f:
+                self.contents[uploaded.name] = f.read()
+        return uploaded
+
+    def put(self, content, display_name):
+        """替身批处理写出结果文件。"""
+        with self._lock:
+            self.result_count += 1
+            name = f"files/fake-result-{self.result_count:06d}"
+            self.files[name] = FakeUploadedFile(name, f"https://fake.local/v1beta/{name}", display_name, len(content))
+            self.contents[name] = content
+        return name
+
+    def download(self, file):
+        if file not in self.contents:
+            raise FakeFileAPIError(404, f"File {file} not found (fake)")
+        return self.contents[file]
+
+    def delete(self, name):
+        super().delete(name)
+        self.contents.pop(name, None)
+
+
+class FakeBatches:
+    """
+    替身批处理服务：作业耗时 = base_seconds + 每个请求 seconds_per_request (真实时间)。
+    作业以 job_failure_rate 的概率整体失败，单个请求以 request_failure_rate 的概率返回错误，
+    成功的请求返回 responder(key) 生成的图谱 JSON，其中 truncation_rate 比例的输出在后半段被截断
+    (模拟超出输出 token 上限)。
+    """
+
+    def __init__(self, files, base_seconds=2.0, seconds_per_request=0.05, job_failure_rate=0.0,
+                 request_failure_rate=0.0, responder=canned_graph, seed=None, truncation_rate=0.0):
+        self.files = files
+        self.base_seconds = base_seconds
+        self.seconds_per_request = seconds_per_request
+        self.job_failure_rate = job_failure_rate
+        self.request_failure_rate = request_failure_rate
+        self.responder = responder
+        self.truncation_rate = truncation_rate
+        self.jobs = {}     # name -> {'job': FakeBatchJob, 'keys': [...], 'finish_at': 时间}
+        self.get_calls = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def create(self, model, src, config=None):
+        keys = [json.loads(line)['key'] for line in self.files.download(src).decode('utf-8').splitlines()
+                if line.strip()]
+        now = time.time()
+        with self._lock:
+            name = f"batches/fake-{len(self.jobs) + 1:06d}"
+            job = FakeBatchJob(name, 'JOB_STATE_PENDING', datetime.fromtimestamp(now, timezone.utc))
+            job.display_name = (config or {}).get('display_name')
+            job.dest = None
+            self.jobs[name] = {'job': job, 'keys': keys,
+                               'finish_at': now + self.base_seconds + self.seconds_per_request * len(keys)}
+        return job
+
+    def _finish(self, info):
+        job = info['job']
+        job.end_time = datetime.fromtimestamp(info['finish_at'], timezone.utc)
+        if self._rng.random() < self.job_failure_rate:
+            job.state.name = 'JOB_STATE_FAILED'
+            job.error = 'fake job failure'
+            return
+        lines = []
+        for key in info['keys']:
+            if self._rng.random() < self.request_failure_rate:
+                lines.append({'key': key, 'error': {'code': 500, 'message': 'Internal error (fake)'}})
+            else:
+                text = json.dumps(self.responder(key), ensure_ascii=False)
+                if self._rng.random() < self.truncation_rate:
+                    text = text[:self._rng.randrange(len(text) // 2, len(text))]
+                lines.append({'key': key, 'response': {'candidates': [{'content': {'parts': [{'text': text}]}}]}})
+        content = ''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in lines).encode('utf-8')
+        job.dest = _FakeDest(self.files.put(content, f"{job.name}-results.jsonl"))
+        job.state.name = 'JOB_STATE_SUCCEEDED'
+
+    def get(self, name):
+        with self._lock:
+            self.get_calls += 1
+            info = self.jobs.get(name)
+            if info is None:
+                raise FakeFileAPIError(404, f"Batch {name} not found (fake)")
+            job = info['job']
+            if job.state.name in ('JOB_STATE_PENDING', 'JOB_STATE_RUNNING'):
+                if time.time() >= info['finish_at']:
+                    self._finish(info)
+                else:
+                    job.state.name = 'JOB_STATE_RUNNING'
+            return job
+
+    def cancel(self, name):
+        job = self.get(name)
+        with self._lock:
+            if job.state.name in ('JOB_STATE_PENDING', 'JOB_STATE_RUNNING'):
+                job.state.name = 'JOB_STATE_CANCELLED'
+
+    def delete(self, name):
+        self.get(name)
+        with self._lock:
+            del self.jobs[name]
+
+    def list(self):
+        return [info['job'] for info in self.jobs.values()]
+
+
+class FakeCaches:
+    """替身缓存上下文：记录内容与过期时间，generate_content 引用时把内容拼回提示词前面。"""
+
+    def __init__(self):
+        self.contents = {}
+        self.create_calls = 0
+        self._lock = threading.Lock()
+
+    def create(self, model, config=None):
+        config = config or {}
+        text = ''.join(part.get('text', '') for content in config.get('contents', []) for part in content['parts'])
+        ttl = float(str(config.get('ttl', '3600s')).rstrip('s'))
+        with self._lock:
+            self.create_calls += 1
+            name = f"cachedContents/fake-{self.create_calls:06d}"
+            self.contents[name] = text
+        return _FakeCachedContent(name, model, datetime.fromtimestamp(time.time() + ttl, timezone.utc))
+
+    def get(self, name):
+        if name not in self.contents:
+            raise FakeFileAPIError(404, f"{name} not found (fake)")
+        return self.contents[name]
+
+    def delete(self, name):
+        self.get(name)
+        with self._lock:
+            del self.contents[name]
+
+
+class FakeModels:
+    """
+    替身 generate_content：休眠 latency 秒，以 failure_rate 的概率返回 503。
+    config 中带 cached_content 时先从 caches 取回缓存的前缀再交给 responder。
+    """
+
+    def __init__(self, latency=0.2, failure_rate=0.0, responder=canned_text, seed=None, caches=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.responder = responder
+        self.caches = caches
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def generate_content(self, model, contents, config=None):
+        with self._lock:
+            self.calls += 1
+            fail = self._rng.random() < self.failure_rate
+        time.sleep(self.latency)
+        if fail:
+            raise FakeFileAPIError(503, "Service Unavailable (fake)")
+        cached_content = (config or {}).get('cached_content')
+        if cached_content:
+            if not isinstance(contents, str):
+                contents = json.dumps(contents, ensure_ascii=False)
+            contents = self.caches.get(cached_content) + contents
+        return _FakeResponse(self.responder(contents))
+
+
+class FakeBackend(LLMBackend):
+    """完全在本地运行的后端，用于离线测试编排逻辑的吞吐与并发。"""
+
+    def __init__(self, model_name=LLM_MODEL, upload_latency=0.05, upload_failure_rate=0.0, job_base_seconds=2.0,
+                 job_seconds_per_request=0.05, job_failure_rate=0.0, request_failure_rate=0.0,
+                 generate_latency=0.2, generate_failure_rate=0.0, seed=None, truncation_rate=0.0):
+        self.model_name = model_name
+        self.files = FakeFiles(upload_latency, upload_failure_rate, seed)
+        self.batches = FakeBatches(self.files, job_base_seconds, job_seconds_per_request, job_failure_rate,
+                                   request_failure_rate, seed=seed, truncation_rate=truncation_rate)
+        self.caches = FakeCaches()
+        self.models = FakeModels(generate_latency, generate_failure_rate, seed=seed, caches=self.caches)
+
+    def download(self, file_name, dest_path):
+        with open(dest_path, 'wb') as f:
+            f.write(self.files.download(file_name))
+
+
+# ================================
+# 离线吞吐测试
+# ================================
+def main():
+    from batch_packing import write_synthetic_pdf
+    from batch_upload import UploadCache
+    from gemini_json_batch import run_phases, run_pipeline
+    from prompt_assets import PromptContextCache
+    from state_store import StateStore
+
+    parser = argparse.ArgumentParser(description="用替身后端跑完整的 gemini_json_batch 流程，测量编排吞吐")
+    parser.add_argument('--books', type=int, default=60, help="合成的 PDF 数量")
+    parser.add_argument('--mode', choices=['phases', 'pipeline'], nargs='+', default=['phases', 'pipeline'])
+    parser.add_argument('--upload-latency', type=float, default=0.05)
+    parser.add_argument('--upload-failure-rate', type=float, default=0.05)
+    parser.add_argument('--job-seconds', type=float, default=2.0, help="每个作业的基础耗时")
+    parser.add_argument('--job-failure-rate', type=float, default=0.0)
+    parser.add_argument('--request-failure-rate', type=float, default=0.05)
+    parser.add_argument('--truncation-rate', type=float, default=0.0, help="输出被截断的请求比例")
+    parser.add_argument('--poll-seconds', type=float, default=0.5, help="轮询间隔下限")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix='kg_backend_bench_')
+    try:
+        pdf_folder = os.path.join(work_dir, 'data')
+        os.makedirs(pdf_folder)
+        books = [f"book_{i:04d}.pdf" for i in range(args.books)]
+        for book in books:
+            write_synthetic_pdf(os.path.join(pdf_folder, book), rng.randint(50, 600))
+
+        for mode in args.mode:
+            backend = FakeBackend(upload_latency=args.upload_latency, upload_failure_rate=args.upload_failure_rate,
+                                  job_base_seconds=args.job_seconds, job_failure_rate=args.job_failure_rate,
+                                  request_failure_rate=args.request_failure_rate, seed=args.seed,
+                                  truncation_rate=args.truncation_rate)
+            output_folder = os.path.join(work_dir, f"json_{mode}")
+            os.makedirs(output_folder)
+            with StateStore(os.path.join(work_dir, f"state_{mode}.db"), legacy_json=None) as state:
+                state.add_missing(books, {'status': 'pending_upload'})
+                start = time.perf_counter()
+                run = run_pipeline if mode == 'pipeline' else run_phases
+                run(backend, state, pdf_folder, output_folder, "提取知识图谱", backend.model_name,
+                    min_poll_seconds=args.poll_seconds,
+                    cache=UploadCache(os.path.join(work_dir, f"upload_cache_{mode}.json")),
+                    prompt_cache=PromptContextCache(os.path.join(work_dir, f"prompt_cache_{mode}.json")))
+                elapsed = time.perf_counter() - start
+                counts = state.status_counts()
+            print(f"\n📊 {mode}: {args.books} 本书耗时 {elapsed:.2f}s ({args.books / elapsed:.1f} 本/秒)，"
+                  f"上传调用 {backend.files.upload_calls} 次，作业 {len(backend.batches.jobs)} 个，"
+                  f"查询作业 {backend.batches.get_calls} 次，最终状态: {counts}\n")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,79 +1,92 @@
 import os
 import json
 import time
+import asyncio
+import argparse
+import tempfile
 from datetime import datetime, timedelta
 
-from google import genai
-from google.genai import types
-from google.api_core import exceptions
+import metrics
+from batch_packing import BATCH_MAX_TOKENS, annotate_estimates, estimate_text_tokens, pack_state_batches
+from batch_upload import UPLOAD_WORKERS, UploadCache, upload_one_file, upload_pending_files
+from job_scheduler import POLL_MIN_SECONDS, JobPollScheduler, job_duration_seconds
+from json_recovery import recover_graph_json
+from llm_backend import create_backend, is_not_found
+from pdf_split import CHUNK_PAGES, chunk_context, chunk_pending_books, split_oversized, stitch_completed_books
+from pipeline import BatchPipeline
+from prompt_assets import GRAPH_INSTRUCTIONS_FILE, PromptContextCache, load_asset
+from state_store import STATE_DB_FILE, StateStore
 
 # ================================
 # 配置区
 # ================================
-# 每个小批次包含的PDF文件数量
+# 每个小批次最多包含的PDF文件数量，以及输入 token 总量上限 (按 token 装箱，见 batch_packing.py)
 BATCH_SIZE = 20
+BATCH_TOKEN_BUDGET = BATCH_MAX_TOKENS
+# 结果 JSON 损坏时的容错解析 (见 json_recovery.py)：保留比例低于该值的书重新排队，最多重排的次数
+SALVAGE_MIN_RATE = 0.9
+PARSE_REQUEUE_LIMIT = 2
 # 单个批次的最长轮询时间
 BATCH_POLLING_TIMEOUT_SECONDS = 8 * 60 * 60
-# 状态持久化文件
-STATE_FILE = "processing_state.json"
-
-# 配置代理（如果需要）
-os.environ["http_proxy"] = "http://127.0.0.1:7890"
-os.environ["https_proxy"] = "http://127.0.0.1:7890"
+# 状态数据库 (旧版 processing_state.json 会在首次运行时自动迁移)
+STATE_FILE = STATE_DB_FILE
+# 模型、代理与后端 (gemini / fake) 由 llm_backend.py 的 LLM_MODEL / LLM_PROXY / LLM_BACKEND 环境变量配置
 
 
 # ================================
 # 状态管理函数
 # ================================
 def load_state():
-    """加载处理状态，如果文件不存在则初始化。"""
-    if os.path.exists(STATE_FILE):
-        with open(STATE_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
-
-
-def save_state(state):
-    """将当前处理状态保存到文件。"""
-    with open(STATE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(state, f, indent=2, ensure_ascii=False)
+    """打开处理状态数据库，不存在时自动创建。每次修改都即时写入，无需单独保存。"""
+    return StateStore(STATE_FILE)
 
 
 # ================================
 # 指令加载函数
 # ================================
-def load_graph_instructions(filepath="任务：根据混合Schema从PDF构建可直接导入的知识图谱.md"):
+def load_graph_instructions(filepath=GRAPH_INSTRUCTIONS_FILE):
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            return f.read()
+        return load_asset(filepath).text
     except FileNotFoundError:
         return None
 
 
+# ================================
+# 结果文件逐行解析
+# ================================
+def iter_result_lines(path):
+    """逐行读取 JSONL 结果文件并解析，同一时刻内存中只有一条响应。"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
 # ================================
 # 核心功能函数 (重构和实现)
 # ================================
 def process_job_results(client, batch_job, state, output_folder):
     """
     【已实现】处理成功作业的结果，并更新状态文件。
+    结果文件先流式下载到临时文件，再逐行解析，每个 key 的输出在读到时立即写出。
     """
     print(f"  -> 正在处理作业 '{batch_job.name}' 的结果...")
     if not (batch_job.dest and batch_job.dest.file_name):
         print(f"  - ❌ 错误：作业 '{batch_job.name}' 成功，但未找到输出文件。")
         # 将所有与此作业相关的任务标记为失败
-        for pdf_file, data in state.items():
-            if data.get('batch_job_name') == batch_job.name:
-                data.update({'status': 'failed_job_no_output', 'error': '作业成功但无输出文件'})
+        state.update_job(batch_job.name, status='failed_job_no_output', error='作业成功但无输出文件')
         return
 
     result_file_name = batch_job.dest.file_name
+    fd, download_path = tempfile.mkstemp(prefix='batch_results_', suffix='.jsonl')
+    os.close(fd)
     try:
         print(f"  - 📥 正在下载结果文件: {result_file_name}")
-        file_content = client.files.download(file=result_file_name).decode('utf-8')
+        with metrics.timer('result_download_seconds'):
+            client.download(result_file_name, download_path)
 
         # 逐行解析 JSONL 结果文件
-        for line in file_content.strip().split('\n'):
-            result = json.loads(line)
+        for result in iter_result_lines(download_path):
             original_pdf_key = result.get("key")
 
             # 如果找不到key，则无法关联，跳过此行
@@ -90,34 +103,253 @@ def process_job_results(client, batch_job, state, output_folder):
             if result.get("response"):
                 output_filename = os.path.splitext(original_pdf_key)[0] + ".json"
                 output_path = os.path.join(output_folder, output_filename)
+                # 拆分出的分卷 (parts/...) 写在输出目录的子目录中
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
                 try:
-                    # 提取 JSON 内容
-                    json_text = result["response"]["candidates"][0]["content"]["parts"][0]["text"]
-                    # 清理并验证
-                    cleaned_json = json_text.strip().replace("```json", "").replace("```", "").strip()
-                    json_data = json.loads(cleaned_json)
-                    with open(output_path, "w", encoding="utf-8") as f:
-                        json.dump(json_data, f, ensure_ascii=False, indent=2)
-
-                    state[original_pdf_key].update({'status': 'completed', 'output_path': output_path})
-                    print(f"    - ✅ 成功: '{original_pdf_key}' 的结果已保存到 {output_path}")
-
-                except (KeyError, IndexError, json.JSONDecodeError) as e:
-                    state[original_pdf_key].update({'status': 'failed_parsing', 'error': f"解析结果失败: {e}"})
+                    with metrics.span('parse', metrics.trace_id_for(original_pdf_key), file=original_pdf_key,
+                                      job=batch_job.name) as span:
+                        # 提取 JSON 内容
+                        json_text = result["response"]["candidates"][0]["content"]["parts"][0]["text"]
+                        # 容错解析：截断或有语法错误时尽量保留有效的节点和关系
+                        json_data, report = recover_graph_json(json_text)
+                        span.attrs.update(mode=report['mode'], salvage_rate=report['salvage_rate'])
+                        metrics.counter('result_parse_total', mode=report['mode'])
+                        usable = json_data is not None and report['salvage_rate'] >= SALVAGE_MIN_RATE
+                        # 被截断的输出即使抢救率很高也缺了后半部分，重试次数内一律重跑；
+                        # 重试用完后仍被截断时保留已恢复的部分
+                        requeued = ((not usable or report['truncated'])
+                                    and requeue_incomplete(state, original_pdf_key, report))
+                        salvaged = usable and not requeued
+                        if salvaged:
+                            with open(output_path, "w", encoding="utf-8") as f:
+                                json.dump(json_data, f, ensure_ascii=False, indent=2)
+                        else:
+                            span.status = 'error'
+
+                    if requeued:
+                        # requeue_incomplete 已把它改回 uploaded，下次运行重新提交
+                        continue
+                    if not salvaged:
+                        fail_unsalvageable(state, original_pdf_key, report)
+                    elif report['mode'] == 'strict':
+                        # 清掉之前重新排队或失败时留下的记录，error_process.py 不会再把它当成失败
+                        state.update(original_pdf_key, status='completed', output_path=output_path, error=None,
+                                     requeue_reason=None, recovery=None)
+                        print(f"    - ✅ 成功: '{original_pdf_key}' 的结果已保存到 {output_path}")
+                    else:
+                        state.update(original_pdf_key, status='completed', output_path=output_path, error=None,
+                                     requeue_reason=None, recovery=report)
+                        print(f"    - 🩹 已恢复: '{original_pdf_key}' ({describe_recovery(report)}) -> {output_path}")
+
+                except (KeyError, IndexError) as e:
+                    state.update(original_pdf_key, status='failed_parsing', error=f"解析结果失败: {e}")
                     print(f"    - ❌ 失败: 解析 '{original_pdf_key}' 的结果时出错: {e}")
 
             # 处理单个请求的失败情况
             elif result.get("error"):
                 error_message = result['error'].get('message', '未知错误')
-                state[original_pdf_key].update({'status': 'failed_in_job', 'error': error_message})
+                state.update(original_pdf_key, status='failed_in_job', error=error_message)
                 print(f"    - ❌ 失败: 处理 '{original_pdf_key}' 时API返回错误: {error_message}")
 
     except Exception as e:
         print(f"  - ❌ 严重错误: 处理结果文件 '{result_file_name}' 时发生意外: {e}")
         # 将所有与此作业相关的任务标记为失败
-        for pdf_file, data in state.items():
-            if data.get('batch_job_name') == batch_job.name:
-                data.update({'status': 'failed_processing_results', 'error': str(e)})
+        state.update_job(batch_job.name, status='failed_processing_results', error=str(e))
+    finally:
+        if os.path.exists(download_path):
+            os.remove(download_path)
+
+
+def describe_recovery(report):
+    kept, dropped = report['kept'], report['dropped']
+    text = (f"{report['mode']}，保留 {kept['nodes']} 个节点、{kept['relationships']} 条关系，"
+            f"丢弃 {dropped['nodes']} 个节点、{dropped['relationships']} 条关系，抢救率 {report['salvage_rate']:.0%}")
+    if report['repairs']:
+        text += f"，修复: {', '.join(report['repairs'])}"
+    if report['truncated']:
+        text += "，输出被截断"
+    if report['missing_sections']:
+        text += f"，缺失: {', '.join(report['missing_sections'])}"
+    return text
+
+
+def requeue_incomplete(state, pdf_file, report):
+    """
+    结果不完整 (抢救率低于 SALVAGE_MIN_RATE 或输出被截断) 时，只要云端副本还在、且重试不超过 PARSE_REQUEUE_LIMIT 次，
+    就改回 uploaded，下次运行重新进入批处理作业 (原因记在 requeue_reason 而不是 error，
+    error_process.py 不会把排队中的书当成失败)。返回是否已重新排队。
+    """
+    entry = state.get(pdf_file, {})
+    attempts = entry.get('parse_attempts', 0) + 1
+    if attempts > PARSE_REQUEUE_LIMIT or not entry.get('uploaded_file_uri'):
+        return False
+    state.update(pdf_file, status='uploaded', batch_job_name=None, parse_attempts=attempts,
+                 requeue_reason=f"结果不完整: {describe_recovery(report)}", recovery=report)
+    print(f"    - 🔁 重新排队: '{pdf_file}' ({describe_recovery(report)})，第 {attempts} 次")
+    return True
+
+
+def fail_unsalvageable(state, pdf_file, report):
+    """无法重试且抢救率不足的结果不写出，标记为 failed_parsing，交给 error_process.py。"""
+    attempts = state.get(pdf_file, {}).get('parse_attempts', 0) + 1
+    state.update(pdf_file, status='failed_parsing', parse_attempts=attempts,
+                 error=f"结果无法充分恢复: {describe_recovery(report)}", recovery=report)
+    print(f"    - ❌ 失败: '{pdf_file}' 的结果无法恢复 ({describe_recovery(report)})")
+
+
+# ================================
+# 作业创建与结束处理 (分阶段执行和流水线共用)
+# ================================
+def build_batch_request(pdf_file, file_uri, instructions, context=None, cached_content=None):
+    """
+    context 为分卷/片段的补充说明 (见 pdf_split.chunk_context)，放在指令之后、PDF 之前。
+    cached_content 为已注册的指令缓存 (见 prompt_assets.PromptContextCache)，此时请求中不再内联指令原文。
+    """
+    parts = [] if cached_content else [{"text": instructions}]
+    if context:
+        parts.append({"text": context})
+    parts.append({"file_data": {"mime_type": "application/pdf", "file_uri": file_uri}})
+    request = {
+        "contents": [{"role": "user", "parts": parts}],
+        "generationConfig": {"response_mime_type": "application/json"}
+    }
+    if cached_content:
+        request["cachedContent"] = cached_content
+    return {"key": pdf_file, "request": request}
+
+
+def create_batch_job(client, state, files_in_chunk, instructions, model_name, index, cached_content=None):
+    """为一组已上传的文件创建批处理作业并更新状态，返回作业名；失败时返回 None。"""
+    batch_requests_file = f"temp_batch_requests_{index}.jsonl"
+    job_display_name = f"KG-Batch-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{index + 1}"
+    entries = {pdf_file: state.get(pdf_file) for pdf_file in files_in_chunk}
+
+    try:
+        # 写入临时的 JSONL 文件
+        with open(batch_requests_file, "w", encoding="utf-8") as f:
+            for pdf_file, data in entries.items():
+                request = build_batch_request(pdf_file, data['uploaded_file_uri'], instructions,
+                                              chunk_context(pdf_file, data), cached_content)
+                f.write(json.dumps(request) + "\n")
+
+        # 上传 JSONL 文件
+        print(f"  - 正在上传请求文件 '{batch_requests_file}'...")
+        batch_input_file = client.files.upload(
+            file=batch_requests_file,
+            config={'display_name': job_display_name, 'mime_type': 'jsonl'}
+        )
+
+        # 创建批处理作业
+        print(f"  - 正在创建批处理作业 '{job_display_name}'...")
+        batch_job = client.batches.create(
+            model=model_name,
+            src=batch_input_file.name,
+            config={'display_name': job_display_name}
+        )
+        print(f"  - ✅ 作业创建成功: {batch_job.name}")
+
+        # 每个文件从上传完成到进入作业的等待时间
+        now = time.time()
+        for pdf_file, data in entries.items():
+            if data.get('uploaded_at'):
+                metrics.record_span('batch_queue', metrics.trace_id_for(pdf_file), now - data['uploaded_at'],
+                                    file=pdf_file, job=batch_job.name)
+
+        # 更新状态
+        state.update_many(files_in_chunk, status='processing', batch_job_name=batch_job.name)
+        return batch_job.name
+
+    except Exception as e:
+        print(f"  - ❌ 创建批处理作业块 {index + 1} 时失败: {e}")
+        # 将此块中的文件标记为失败
+        state.update_many(files_in_chunk, status='failed_job_creation', error=str(e))
+        return None
+    finally:
+        # 清理临时文件
+        if os.path.exists(batch_requests_file):
+            os.remove(batch_requests_file)
+
+
+def handle_finished_job(client, job, state, output_folder):
+    print(f"  -> 作业 '{job.name}' 已完成，状态: {job.state.name}")
+    seconds = job_duration_seconds(job)
+    if seconds is not None:
+        metrics.observe('job_run_seconds', seconds, state=job.state.name)
+        status = 'ok' if job.state.name == 'JOB_STATE_SUCCEEDED' else 'error'
+        for pdf_file in state.by_job(job.name):
+            metrics.record_span('job', metrics.trace_id_for(pdf_file), seconds, status=status, file=pdf_file,
+                                job=job.name, state=job.state.name)
+    if job.state.name == 'JOB_STATE_SUCCEEDED':
+        process_job_results(client, job, state, output_folder)
+    else:
+        error_detail = str(job.error) if job.error else f"作业以状态 {job.state.name} 结束"
+        state.update_job(job.name, status=f'failed_{job.state.name.lower()}', error=error_detail)
+
+
+def cancel_timed_out_job(client, state, job_name):
+    print(f"⏰ 作业 '{job_name}' 超时，正在尝试取消...")
+    try:
+        client.batches.cancel(name=job_name)
+    except Exception as e:
+        if not is_not_found(e):
+            raise
+    state.update_job(job_name, status='failed_timeout', error='批处理作业运行超时')
+
+
+def handle_poll_error(state, job_name, e):
+    """查询作业出错时调用，返回 True 表示不再跟踪该作业。"""
+    if is_not_found(e):
+        print(f"  - ⚠️ 作业 '{job_name}' 在API侧未找到，可能已被删除。将其标记为失败。")
+        state.update_job(job_name, status='failed_job_not_found', error='作业在API侧丢失')
+        return True
+    # 避免无限循环，暂时不从监控中移除，稍后再试
+    print(f"  - ❌ 监控作业 '{job_name}' 时发生错误: {e}")
+    return False
+
+
+class GeminiPipelineStages:
+    """把上面的各个函数适配为 pipeline.BatchPipeline 需要的阶段接口。"""
+
+    def __init__(self, client, state, pdf_folder, output_folder, instructions, model_name, cache=None,
+                 prompt_cache=None):
+        self.client = client
+        self.state = state
+        self.pdf_folder = pdf_folder
+        self.output_folder = output_folder
+        self.instructions = instructions
+        self.model_name = model_name
+        self.cache = cache
+        self.prompt_cache = prompt_cache
+        self.prompt_tokens = estimate_text_tokens(instructions)
+        self.job_count = 0
+
+    def upload(self, pdf_file):
+        return upload_one_file(self.client, self.state, self.pdf_folder, pdf_file, cache=self.cache)
+
+    def estimate_tokens(self, pdf_file):
+        return self.state.get(pdf_file, {}).get('estimated_tokens', 0) + self.prompt_tokens
+
+    def create_job(self, files):
+        self.job_count += 1
+        cached_content = self.prompt_cache and self.prompt_cache.handle(self.client, self.model_name,
+                                                                        self.instructions)
+        return create_batch_job(self.client, self.state, files, self.instructions, self.model_name,
+                                self.job_count - 1, cached_content)
+
+    def get_job(self, job_name):
+        return self.client.batches.get(name=job_name)
+
+    def process_job(self, job):
+        handle_finished_job(self.client, job, self.state, self.output_folder)
+
+    def on_timeout(self, job_name):
+        cancel_timed_out_job(self.client, self.state, job_name)
+
+    def on_poll_error(self, job_name, e):
+        return handle_poll_error(self.state, job_name, e)
+
+    def record_durations(self, durations):
+        self.state.set_meta('job_durations', durations)
 
 
 def generate_final_report(state):
@@ -136,6 +368,11 @@ def generate_final_report(state):
         for f in successful_files: print(f"  - {f}")
     else:
         print("  - 无")
+    recovered_files = [f for f in successful_files if state[f].get('recovery')]
+    if recovered_files:
+        print(f"\n🩹 其中 {len(recovered_files)} 个文件的结果经过容错恢复 (详见状态中的 recovery 字段):")
+        for f in recovered_files:
+            print(f"  - {f} ({describe_recovery(state[f]['recovery'])})")
 
     print(f"\n❌ 处理失败 ({len(failed_files)} 个文件):")
     if failed_files:
@@ -152,22 +389,99 @@ def generate_final_report(state):
     print("\n" + "=" * 50)
 
 
+def run_phases(client, state, pdf_folder, output_folder, instructions, model_name, min_poll_seconds=POLL_MIN_SECONDS,
+               cache=None, prompt_cache=None):
+    """原来的分阶段流程：全部上传完再统一建作业，最后统一监控。"""
+    # 3. 上传待上传的文件
+    print("\n Fase 2: 上传新文件...")
+    files_to_upload = list(state.by_status('pending_upload'))
+    if files_to_upload:
+        print(f"  - 共 {len(files_to_upload)} 个文件，{UPLOAD_WORKERS} 个并发上传...")
+        succeeded, failed = upload_pending_files(client, state, pdf_folder, files_to_upload,
+                                                 workers=UPLOAD_WORKERS,
+                                                 cache=UploadCache() if cache is None else cache)
+        print(f"  - 上传完成：成功 {succeeded} 个，失败 {failed} 个。")
+    else:
+        print("  - 无新文件需要上传。")
+
+    # 4. 创建批处理作业
+    print("\n Fase 3: 为待处理文件创建批处理作业...")
+    files_to_process = state.by_status('uploaded')
+    if files_to_process:
+        batches = pack_state_batches(files_to_process, estimate_text_tokens(instructions), BATCH_SIZE,
+                                     BATCH_TOKEN_BUDGET)
+        print(f"  - {len(files_to_process)} 个文件按 token 估算装箱为 {len(batches)} 个作业。")
+        # 指令注册为缓存上下文后，每个请求只引用句柄；不支持或太短时内联
+        prompt_cache = PromptContextCache() if prompt_cache is None else prompt_cache
+        cached_content = prompt_cache.handle(client, model_name, instructions)
+        for i, files_in_chunk in enumerate(batches):
+            create_batch_job(client, state, files_in_chunk, instructions, model_name, i, cached_content)
+    else:
+        print("  - 无待处理文件需要创建新作业。")
+
+    # 5. 监控所有“处理中”的作业
+    print("\n Fase 4: 监控所有处理中的作业...")
+    active_job_names = state.job_names_with_status('processing')
+    if not active_job_names:
+        print("  - 当前无活动作业需要监控。")
+        return
+
+    def handle_finished(job):
+        handle_finished_job(client, job, state, output_folder)
+        # 记录作业耗时，下次运行时据此安排轮询
+        state.set_meta('job_durations', scheduler.model.durations)
+
+    scheduler = JobPollScheduler(lambda name: client.batches.get(name=name), handle_finished,
+                                 lambda name: cancel_timed_out_job(client, state, name),
+                                 lambda name, e: handle_poll_error(state, name, e),
+                                 durations=state.get_meta('job_durations', []),
+                                 timeout_seconds=BATCH_POLLING_TIMEOUT_SECONDS, min_poll_seconds=min_poll_seconds)
+    for job_name in sorted(active_job_names):
+        scheduler.add(job_name)
+    print(f"  - 正在监控 {len(scheduler)} 个活动作业，按各自的预计完成时间轮询...")
+    scheduler.run()
+    print(f"  - 所有作业均已结束，共查询作业状态 {scheduler.poll_count} 次。")
+
+
+def run_pipeline(client, state, pdf_folder, output_folder, instructions, model_name,
+                 min_poll_seconds=POLL_MIN_SECONDS, cache=None, prompt_cache=None):
+    """上传、建作业、轮询、解析四个阶段重叠执行 (见 pipeline.py)。"""
+    print("\n Fase 2-4: 以流水线方式上传、创建作业并监控...")
+    stages = GeminiPipelineStages(client, state, pdf_folder, output_folder, instructions, model_name,
+                                  cache=UploadCache() if cache is None else cache,
+                                  prompt_cache=PromptContextCache() if prompt_cache is None else prompt_cache)
+    pipeline = BatchPipeline(stages, batch_size=BATCH_SIZE, max_tokens=BATCH_TOKEN_BUDGET,
+                             upload_workers=UPLOAD_WORKERS, durations=state.get_meta('job_durations', []),
+                             timeout_seconds=BATCH_POLLING_TIMEOUT_SECONDS, min_poll_seconds=min_poll_seconds)
+    stats = asyncio.run(pipeline.run(
+        pending_uploads=list(state.by_status('pending_upload')),
+        uploaded=list(state.by_status('uploaded')),
+        processing_jobs=sorted(state.job_names_with_status('processing'))))
+    print(f"  - 流水线结束：上传 {stats['uploaded']} 个 (失败 {stats['failed_uploads']} 个)，"
+          f"新建作业 {stats['jobs_created']} 个，处理作业 {stats['jobs_finished']} 个，"
+          f"查询作业状态 {stats['polls']} 次。")
+
+
 # ================================
 # 主程序 (全新工作流)
 # ================================
 def main():
+    parser = argparse.ArgumentParser(description="使用 Gemini Batch API 从 PDF 批量构建知识图谱 JSON")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="上传、建作业、轮询、解析以流水线方式重叠执行，而不是逐阶段执行")
+    parser.add_argument('--chunk-pages', type=int, default=0, metavar='PAGES',
+                        help=f"分片抽取：超过该页数的书按章节/页码窗口切成片段分别请求 (0 为整本请求，建议 {CHUNK_PAGES})")
+    args = parser.parse_args()
+
     # 1. 初始化
     pdf_folder = "data"
     output_folder = "json"
-    model_name = "models/gemini-2.5-pro"
 
     if not os.path.exists(pdf_folder): os.makedirs(pdf_folder)
     os.makedirs(output_folder, exist_ok=True)
 
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key: raise ValueError("❌ 错误：请设置 GEMINI_API_KEY 环境变量")
-
-    client = genai.Client(api_key=api_key)
+    client = create_backend()
+    model_name = client.model_name
     instructions = load_graph_instructions()
     if not instructions:
         print("❌ 错误：未能加载指令文件。")
@@ -177,169 +491,36 @@ def main():
 
     # 2. 文件发现与状态同步
     print(" Fase 1: 文件发现与状态同步...")
-    current_pdfs = {f for f in os.listdir(pdf_folder) if f.lower().endswith(".pdf")}
-    for pdf_file in current_pdfs:
-        if pdf_file not in state:
-            state[pdf_file] = {'status': 'pending_upload'}
-    save_state(state)
-    print("  - 状态同步完成。")
-
-    # 3. 上传待上传的文件
-    print("\n Fase 2: 上传新文件...")
-    files_to_upload = [f for f, data in state.items() if data['status'] == 'pending_upload']
-    if files_to_upload:
-        for pdf_file in files_to_upload:
-            pdf_path = os.path.join(pdf_folder, pdf_file)
-            try:
-                print(f"  - 正在上传: {pdf_file}")
-                response = client.files.upload(file=pdf_path)
-                state[pdf_file].update({
-                    'status': 'uploaded',
-                    'uploaded_file_uri': response.uri,
-                    'uploaded_file_name': response.name
-                })
-            except Exception as e:
-                state[pdf_file].update({'status': 'failed_upload', 'error': str(e)})
-            finally:
-                save_state(state)
+    current_pdfs = sorted(f for f in os.listdir(pdf_folder) if f.lower().endswith(".pdf"))
+    added = state.add_missing(current_pdfs, {'status': 'pending_upload'})
+    print(f"  - 状态同步完成，新增 {added} 个文件。")
+    # 本地读取页面树估算页数与 token，超出单个请求限制的文件转入拆分，不再上传后失败
+    oversized = annotate_estimates(state, pdf_folder, current_pdfs)
+    if oversized:
+        print(f"  - ⚠️ {len(oversized)} 个文件超出页数/大小限制，已标记为 needs_split: {', '.join(oversized)}")
+    # 超限的书在本地按页码区间拆分，分卷作为新文件进入后续流程
+    if args.chunk_pages:
+        split_oversized(state, pdf_folder, max_pages=args.chunk_pages)
+        chunked = chunk_pending_books(state, pdf_folder, args.chunk_pages)
+        if chunked:
+            print(f"  - 分片抽取：{len(chunked)} 本书切分为 {sum(chunked.values())} 个片段。")
     else:
-        print("  - 无新文件需要上传。")
+        split_oversized(state, pdf_folder)
 
-    # 4. 创建批处理作业
-    print("\n Fase 3: 为待处理文件创建批处理作业...")
-    requests_to_process = []
-    files_for_this_batch = []  # 记录哪些文件被包含在将要创建的批处理中
-    for pdf_file, data in state.items():
-        if data['status'] == 'uploaded':
-            requests_to_process.append({
-                "key": pdf_file,
-                "request": {
-                    "contents": [{"role": "user", "parts": [{"text": instructions}, {
-                        "file_data": {"mime_type": "application/pdf", "file_uri": data['uploaded_file_uri']}}]}],
-                    "generationConfig": {"response_mime_type": "application/json"}
-                }
-            })
-            files_for_this_batch.append(pdf_file)
-
-    if requests_to_process:
-        request_chunks = [requests_to_process[i:i + BATCH_SIZE] for i in range(0, len(requests_to_process), BATCH_SIZE)]
-        files_chunks = [files_for_this_batch[i:i + BATCH_SIZE] for i in range(0, len(files_for_this_batch), BATCH_SIZE)]
-
-        for i, (chunk, files_in_chunk) in enumerate(zip(request_chunks, files_chunks)):
-            batch_requests_file = f"temp_batch_requests_{i}.jsonl"
-            job_display_name = f"KG-Batch-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{i + 1}"
-
-            try:
-                # 写入临时的 JSONL 文件
-                with open(batch_requests_file, "w", encoding="utf-8") as f:
-                    for req in chunk:
-                        f.write(json.dumps(req) + "\n")
-
-                # 上传 JSONL 文件
-                print(f"  - 正在上传请求文件 '{batch_requests_file}'...")
-                batch_input_file = client.files.upload(
-                    file=batch_requests_file,
-                    config=types.UploadFileConfig(display_name=job_display_name, mime_type='jsonl')
-                )
-
-                # 创建批处理作业
-                print(f"  - 正在创建批处理作业 '{job_display_name}'...")
-                batch_job = client.batches.create(
-                    model=model_name,
-                    src=batch_input_file.name,
-                    config={'display_name': job_display_name}
-                )
-                print(f"  - ✅ 作业创建成功: {batch_job.name}")
-
-                # 更新状态
-                for pdf in files_in_chunk:
-                    state[pdf].update({'status': 'processing', 'batch_job_name': batch_job.name})
-                save_state(state)
-
-            except Exception as e:
-                print(f"  - ❌ 创建批处理作业块 {i + 1} 时失败: {e}")
-                # 将此块中的文件标记为失败
-                for pdf in files_in_chunk:
-                    state[pdf].update({'status': 'failed_job_creation', 'error': str(e)})
-                save_state(state)
-            finally:
-                # 清理临时文件
-                if os.path.exists(batch_requests_file):
-                    os.remove(batch_requests_file)
+    if args.pipeline:
+        run_pipeline(client, state, pdf_folder, output_folder, instructions, model_name)
     else:
-        print("  - 无待处理文件需要创建新作业。")
+        run_phases(client, state, pdf_folder, output_folder, instructions, model_name)
 
-    # 5. 监控所有“处理中”的作业
-    print("\n Fase 4: 监控所有处理中的作业...")
-    active_job_names = {data['batch_job_name'] for data in state.values() if data.get('status') == 'processing'}
-
-    if not active_job_names:
-        print("  - 当前无活动作业需要监控。")
-    else:
-        start_times = {name: datetime.now() for name in active_job_names}
-        while active_job_names:
-            print(f"  - 正在监控 {len(active_job_names)} 个活动作业...")
-            for job_name in active_job_names:
-                try:
-                    job = client.batches.get(name=job_name)
-                    print(f"  - 作业 '{job_name}' 当前状态: {job.state.name} ({time.strftime('%Y-%m-%d %H:%M:%S')})")
-                except Exception as e:
-                    print(f"  - 获取作业 '{job_name}' 状态时出错: {e}")
-            sleep_interval = 600
-            time.sleep(sleep_interval)
-            finished_jobs = set()
-
-            for job_name in list(active_job_names):
-                # 检查超时
-                elapsed = datetime.now() - start_times.get(job_name, datetime.now())
-                if elapsed.total_seconds() > BATCH_POLLING_TIMEOUT_SECONDS:
-                    print(f"⏰ 作业 '{job_name}' 超时，正在尝试取消...")
-                    try:
-                        client.batches.cancel(name=job_name)
-                    except exceptions.NotFound:
-                        pass
-
-                    for pdf, data in state.items():
-                        if data.get('batch_job_name') == job_name:
-                            data.update({'status': 'failed_timeout', 'error': '批处理作业运行超时'})
-                    save_state(state)
-                    finished_jobs.add(job_name)
-                    continue
-
-                # 获取作业状态
-                try:
-                    job = client.batches.get(name=job_name)
-                    if job.state.name in ('JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_EXPIRED',
-                                          'JOB_STATE_CANCELLED'):
-                        print(f"  -> 作业 '{job.name}' 已完成，状态: {job.state.name}")
-                        if job.state.name == 'JOB_STATE_SUCCEEDED':
-                            process_job_results(client, job, state, output_folder)
-                        else:
-                            error_detail = str(job.error) if job.error else f"作业以状态 {job.state.name} 结束"
-                            for pdf, data in state.items():
-                                if data.get('batch_job_name') == job_name:
-                                    data.update({'status': f'failed_{job.state.name.lower()}', 'error': error_detail})
-
-                        save_state(state)
-                        finished_jobs.add(job_name)
-                except exceptions.NotFound:
-                    print(f"  - ⚠️ 作业 '{job_name}' 在API侧未找到，可能已被删除。将其标记为失败。")
-                    for pdf, data in state.items():
-                        if data.get('batch_job_name') == job_name:
-                            data.update({'status': 'failed_job_not_found', 'error': '作业在API侧丢失'})
-                    save_state(state)
-                    finished_jobs.add(job_name)
-                except Exception as e:
-                    print(f"  - ❌ 监控作业 '{job_name}' 时发生错误: {e}")
-                    # 避免无限循环，暂时不从此轮监控中移除，下次再试
-
-            active_job_names -= finished_jobs
-            if active_job_names:
-                print(f"  - 仍有 {len(active_job_names)} 个作业在运行中，将在 {sleep_interval}s后再次检查...")
+    # 分卷/片段全部完成的书拼接回整本书的 JSON
+    stitched = stitch_completed_books(state, output_folder)
+    if stitched:
+        print(f"  - 已将 {stitched} 本拆分过的书拼接为完整的 JSON。")
 
     # 6. 生成最终报告
     print("\n Fase 5: 所有作业处理完毕，生成报告...")
-    generate_final_report(state)
+    generate_final_report(state.all())
+    state.close()
 
 
 if __name__ == "__main__":
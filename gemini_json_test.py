@@ -2,6 +2,8 @@ import os
 import json
 import google.generativeai as genai
 
+from batch_upload import LegacyGenaiFiles, UploadCache, upload_with_cache
+
 # ================================
 # 配置代理（默认 clash7890）
 # ================================
@@ -70,6 +72,8 @@ def main():
         return
 
     print(f"\n🚀 发现 {len(pdf_files)} 个 PDF 文件，准备开始处理...")
+    files_api = LegacyGenaiFiles(genai)
+    upload_cache = UploadCache()
 
     for pdf_file in pdf_files:
         pdf_path = os.path.join(pdf_folder, pdf_file)
@@ -81,7 +85,9 @@ def main():
         try:
             # 步骤 1: 上传PDF文件
             print("📄 正在上传 PDF:", pdf_file)
-            uploaded_file = genai.upload_file(pdf_path)
+            uploaded_file, reused = upload_with_cache(files_api, pdf_path, upload_cache)
+            if reused:
+                print(f"  ♻️ 复用已上传的云端副本: {uploaded_file.name}")
 
             # 步骤 2: 调用模型生成内容
             print("  开始PDF转化为JSON处理...")
@@ -1,14 +1,8 @@
 import os
 import json
 import time
-from google import genai
-from google.genai import types
-
-# ================================
-# 配置代理（如果需要）
-# ================================
-os.environ["http_proxy"] = "http://127.0.0.1:7890"
-os.environ["https_proxy"] = "http://127.0.0.1:7890"
+from batch_upload import UploadCache, upload_with_cache
+from llm_backend import create_backend
 
 # ================================
 # 构造 OCR 规则 (与您原有的函数相同)
@@ -39,12 +33,8 @@ def main():
     output_folder = "output"
     batch_requests_file = "batch_ocr_requests.jsonl"
 
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("请设置 GEMINI_API_KEY 环境变量")
-
-    # 1. 初始化新版 SDK 客户端
-    client = genai.Client(api_key=api_key)
+    # 1. 初始化客户端 (模型、代理见 llm_backend.py)
+    client = create_backend()
     print("✅ Gemini 客户端初始化完成。")
 
     pdf_files = [f for f in os.listdir(pdf_folder) if f.lower().endswith(".pdf")]
@@ -54,13 +44,14 @@ def main():
 
     # 2. 上传所有 PDF 文件到 File API
     uploaded_files = {}
+    upload_cache = UploadCache()
     print("📄 开始上传 PDF 文件...")
     for pdf_file in pdf_files:
         pdf_path = os.path.join(pdf_folder, pdf_file)
         print(f"  - 正在上传: {pdf_file}")
-        response = client.files.upload(file=pdf_path)
+        response, reused = upload_with_cache(client.files, pdf_path, upload_cache)
         uploaded_files[pdf_file] = response
-        print(f"  - 上传成功: {response.name}")
+        print(f"  - {'复用云端副本' if reused else '上传成功'}: {response.name}")
     print("✅ 所有 PDF 文件上传完成。")
 
     # 3. 构造批处理请求的 JSONL 文件
@@ -94,13 +85,13 @@ def main():
     print("📤 正在上传批处理请求文件...")
     batch_input_file = client.files.upload(
         file=batch_requests_file,
-        config=types.UploadFileConfig(display_name='batch_ocr_requests',mime_type='jsonl')
+        config={'display_name': 'batch_ocr_requests', 'mime_type': 'jsonl'}
     )
     print(f"  - 上传成功: {batch_input_file.name}")
 
     print("⚙️ 正在创建批处理作业...")
     batch_job = client.batches.create(
-        model="models/gemini-2.5-pro",  # 请确保模型支持批处理
+        model=client.model_name,  # 请确保模型支持批处理
         src=batch_input_file.name,
         config={'display_name': "batch-ocr-job"}
     )
@@ -1,6 +1,8 @@
 import os
 import google.generativeai as genai
 
+from batch_upload import LegacyGenaiFiles, UploadCache, upload_with_cache
+
 # ================================
 # 配置代理（默认 clash7890）
 # ================================
@@ -47,9 +49,11 @@ def main():
     # 构造规则
     instructions = build_instructions(no_math=True, no_table=True, no_images=True)
 
+    files_api = LegacyGenaiFiles(genai)
+    upload_cache = UploadCache()
     for pdf_file, output_file in zip(pdf_files, output_files):
         print("📄 正在上传 PDF:", pdf_file)
-        uploaded_file = genai.upload_file(os.path.join(pdf_folder, pdf_file))
+        uploaded_file, _ = upload_with_cache(files_api, os.path.join(pdf_folder, pdf_file), upload_cache)
 
         print("⚙️ 开始 OCR 处理...")
         response = model.generate_content(
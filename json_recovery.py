@@ -0,0 +1,349 @@
+import re
+import json
+import time
+import random
+import argparse
+
+# ================================
+# 配置区
+# ================================
+# 图谱 JSON 中需要逐条抢救的数组，以及每种条目必须具备的字段
+GRAPH_SECTIONS = {
+    'nodes': ('id',),
+    'relationships': ('source', 'target'),
+}
+# 报告中保留的被丢弃片段数量与每段长度
+DROPPED_SAMPLE_COUNT = 5
+DROPPED_SAMPLE_CHARS = 200
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?")
+_SECTION_RE = re.compile(r'"(%s)"\s*:\s*\[' % '|'.join(GRAPH_SECTIONS))
+# 词法单元：字符串 (允许跨行、允许未闭合)、紧跟 } 或 ] 的逗号、注释、Python 字面量
+_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"?|,(?=\s*[}\]])|//[^\n]*|/\*.*?(?:\*/|$)|\b(?:True|False|None|NaN|Infinity)\b',
+                       re.S)
+_ESCAPE_RE = re.compile(r'\\(.?)', re.S)
+_VALID_ESCAPES = set('"\\/bfnrtu')
+_CONTROL_RE = re.compile(r'[\x00-\x1f]')
+# 数组中相邻两个对象条目的边界，用于语法错误打乱了引号配对之后重新同步
+_BOUNDARY_RE = re.compile(r'\}\s*(?:,\s*(?=\{)|(?=\]))')
+_DECODER = json.JSONDecoder()
+_PY_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null', 'NaN': 'null', 'Infinity': 'null'}
+_CLOSERS = {'{': '}', '[': ']'}
+
+
+def strip_fences(text):
+    """去掉 markdown 代码块标记，以及第一个 { 之前、最后一个 } 之后的说明文字。"""
+    text = _FENCE_RE.sub('', text).strip()
+    start = text.find('{')
+    if start > 0:
+        text = text[start:]
+    end = text.rfind('}')
+    if end >= 0 and text[end + 1:].strip() and not text[end + 1:].strip().startswith((',', ']', '}')):
+        text = text[:end + 1]
+    return text
+
+
+def _fix_escape(match):
+    if match.group(1) and match.group(1) in _VALID_ESCAPES:
+        return match.group()
+    return '\\\\' + match.group(1)
+
+
+def _repair_string(literal, repairs):
+    fixed = literal
+    if '\\' in fixed:
+        fixed = _ESCAPE_RE.sub(_fix_escape, fixed)
+        if fixed != literal:
+            repairs.add('invalid_escape')
+    if _CONTROL_RE.search(fixed):
+        fixed = _CONTROL_RE.sub(lambda m: json.dumps(m.group())[1:-1], fixed)
+        repairs.add('control_character')
+    if len(fixed) == 1 or not fixed.endswith('"') or fixed.endswith('\\"') and not fixed.endswith('\\\\"'):
+        # 只有截断处的最后一个字符串会没有闭合
+        fixed += '"'
+        repairs.add('unterminated_string')
+    return fixed
+
+
+def repair_json_text(text):
+    """
+    修复模型输出中常见的语法错误 (只在字符串外部改写结构，字符串内部只修转义)：
+      - 对象/数组末尾多余的逗号；
+      - 字符串中未转义的换行、制表符等控制字符，以及 \\_ 这类非法转义；
+      - Python 风格的 True / False / None / NaN；
+      - // 与 /* */ 注释。
+    用一个正则按词法单元扫描 (字符串整体匹配，不会误改字符串内容)，速度接近 json.loads。
+    返回 (修复后的文本, 实际用到的修复项集合)。
+    """
+    repairs = set()
+
+    def fix(match):
+        token = match.group()
+        if token[0] == '"':
+            return _repair_string(token, repairs)
+        if token == ',':
+            repairs.add('trailing_comma')
+            return ''
+        if token[0] == '/':
+            repairs.add('comment')
+            return ''
+        repairs.add('python_literal')
+        return _PY_LITERALS[token]
+
+    return _TOKEN_RE.sub(fix, text), repairs
+
+
+def scan_value_end(text, pos):
+    """
+    从 pos 处的一个 JSON 值开始，找到它结束后的位置 (字符串感知的括号匹配)。
+    对象/数组在文本结束前没有闭合 (输出被截断) 时返回 None；
+    标量或无法识别的内容一直读到同层的下一个 , 或 ]。
+    """
+    n = len(text)
+    if text[pos] not in _CLOSERS:
+        depth = 0
+        in_string = False
+        i = pos
+        while i < n:
+            ch = text[i]
+            if in_string:
+                if ch == '\\':
+                    i += 1
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch in '{[':
+                depth += 1
+            elif ch in '}]':
+                if depth == 0:
+                    return i
+                depth -= 1
+            elif ch == ',' and depth == 0:
+                return i
+            i += 1
+        return None
+    stack = []
+    in_string = False
+    i = pos
+    while i < n:
+        ch = text[i]
+        if in_string:
+            if ch == '\\':
+                i += 1
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+        elif ch in '}]':
+            # 括号不配对时按模型漏写处理，继续弹栈直到配对
+            while stack and stack[-1] != ch:
+                stack.pop()
+            if stack:
+                stack.pop()
+            if not stack:
+                return i + 1
+        i += 1
+    return None
+
+
+def _is_valid_item(item, required):
+    return isinstance(item, dict) and all(item.get(key) not in (None, '') for key in required)
+
+
+def _decode_item(segment, repairs):
+    try:
+        return json.loads(segment)
+    except json.JSONDecodeError:
+        pass
+    fixed, used = repair_json_text(segment)
+    try:
+        item = json.loads(fixed)
+    except json.JSONDecodeError:
+        return None
+    repairs.update(used)
+    return item
+
+
+def salvage_array(text, start, required, repairs):
+    """
+    从 start (紧跟 '[' 之后) 开始逐条解析数组元素：能解析 (或修复后能解析) 且字段齐全的条目保留，
+    其余丢弃；遇到文本结束 (截断) 时停止。返回 (保留的条目, 丢弃的片段, 结束位置, 是否截断)。
+
+    每个条目先用 raw_decode 直接解析 (C 实现，正常条目不走慢路径)；失败时按括号匹配找到条目结尾再修复，
+    引号被打乱导致括号匹配失效时，退到下一个 "}, {" 条目边界重新同步，只丢弃这一个条目。
+    """
+    items, dropped = [], []
+    n = len(text)
+    pos = start
+    while True:
+        while pos < n and text[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= n:
+            return items, dropped, pos, True
+        if text[pos] == ']':
+            return items, dropped, pos + 1, False
+        if text[pos] == '}':
+            # 同层出现了不属于数组的 } ，说明数组本身没有闭合
+            return items, dropped, pos, False
+        try:
+            item, end = _DECODER.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            item, end = None, scan_value_end(text, pos)
+            if end is not None:
+                item = _decode_item(text[pos:end], repairs)
+            if not _is_valid_item(item, required):
+                boundary = _BOUNDARY_RE.search(text, pos)
+                if boundary is None:
+                    # 最后一个条目只写了一半 (或者坏到无法找到边界)
+                    dropped.append(text[pos:])
+                    return items, dropped, n, True
+                if end is None or boundary.start() + 1 < end:
+                    end = boundary.start() + 1
+                    item = _decode_item(text[pos:end], repairs)
+        if _is_valid_item(item, required):
+            items.append(item)
+        else:
+            dropped.append(text[pos:end])
+        pos = end
+
+
+def _report(mode, graph, repairs=(), truncated=False, dropped=None, missing=()):
+    dropped = dropped or {}
+    kept = {section: len(graph.get(section) or []) if isinstance(graph, dict) else 0 for section in GRAPH_SECTIONS}
+    lost = {section: len(dropped.get(section, [])) for section in GRAPH_SECTIONS}
+    # 取各数组中最差的抢救率；被截断掉、根本没有出现的数组按 0 计
+    rates = []
+    for section in GRAPH_SECTIONS:
+        if section in missing:
+            rates.append(0.0)
+        elif kept[section] + lost[section]:
+            rates.append(kept[section] / (kept[section] + lost[section]))
+    samples = [fragment[:DROPPED_SAMPLE_CHARS] for section in GRAPH_SECTIONS for fragment in dropped.get(section, [])]
+    return {
+        'mode': mode,
+        'repairs': sorted(repairs),
+        'truncated': truncated,
+        'kept': kept,
+        'dropped': lost,
+        'missing_sections': list(missing),
+        'salvage_rate': round(min(rates), 4) if rates else 1.0,
+        'dropped_samples': samples[:DROPPED_SAMPLE_COUNT],
+    }
+
+
+def recover_graph_json(text):
+    """
+    尽量从模型输出中恢复知识图谱 JSON，返回 (graph, report)，完全无法恢复时 graph 为 None。
+    依次尝试 (前一步成功就不再做后面更慢的步骤)：
+      1. strict：去掉代码块标记后直接 json.loads，与原来的行为相同；
+      2. repaired：整体修复常见语法错误后再解析；
+      3. salvaged：定位 nodes / relationships 数组，逐条解析并保留有效条目，
+         截断时保留最长的有效前缀，语法坏掉且修不好的单个条目被丢弃。
+    report['salvage_rate'] 为各数组保留条目的比例 (取最小值)，由调用方决定是否需要重跑。
+    截断点之后本该输出的内容无从计数，salvage_rate 只反映截断处丢掉的半个条目，
+    因此 report['truncated'] 为 True 时应视为结果不完整，不能只看 salvage_rate。
+    """
+    cleaned = strip_fences(text)
+    try:
+        graph = json.loads(cleaned)
+        return graph, _report('strict', graph)
+    except json.JSONDecodeError:
+        pass
+    fixed, repairs = repair_json_text(cleaned)
+    try:
+        graph = json.loads(fixed)
+        return graph, _report('repaired', graph, repairs)
+    except json.JSONDecodeError:
+        pass
+
+    graph, dropped = {}, {}
+    truncated = False
+    repairs = set()
+    pos = 0
+    for match in _SECTION_RE.finditer(cleaned):
+        section = match.group(1)
+        if section in graph or match.start() < pos:
+            continue
+        items, lost, pos, cut = salvage_array(cleaned, match.end(), GRAPH_SECTIONS[section], repairs)
+        graph[section], dropped[section] = items, lost
+        if cut:
+            truncated = True
+            break
+    # 数组都完整闭合、但整个对象没有闭合：截断发生在两个数组之间
+    truncated = truncated or not cleaned.rstrip().endswith('}')
+    if not graph:
+        return None, _report('failed', {}, truncated=True, missing=list(GRAPH_SECTIONS))
+    # 截断发生在某个数组开始之前：该数组整个丢失；没有截断但缺少数组则按空数组处理
+    missing = [section for section in GRAPH_SECTIONS if section not in graph and truncated]
+    for section in GRAPH_SECTIONS:
+        graph.setdefault(section, [])
+    return graph, _report('salvaged', graph, repairs, truncated, dropped, missing)
+
+
+# ================================
+# 离线自检
+# ================================
+def _sample_graph(rng, nodes, rels):
+    node_list = [{'id': f"alloy_{i}", 'label': 'Alloy',
+                  'properties': {'name': f"合金 {i}", 'description': f"γ' 强化的镍基高温合金 #{i}"}}
+                 for i in range(nodes)]
+    rel_list = [{'source': f"alloy_{rng.randrange(nodes)}", 'target': f"alloy_{rng.randrange(nodes)}",
+                 'type': 'RELATED_TO', 'properties': {'context': f"第 {i} 条关系"}} for i in range(rels)]
+    return {'nodes': node_list, 'relationships': rel_list}
+
+
+def _damage(text, kind, rng):
+    if kind == 'fenced':
+        return f"下面是抽取结果：\n```json\n{text}\n```\n以上。"
+    if kind == 'truncated':
+        return text[:rng.randrange(len(text) // 2, len(text))]
+    if kind == 'trailing_comma':
+        return re.sub(r'\}(\s*)\]', r'},\1]', text)
+    if kind == 'python_literal':
+        return text.replace('"description"', '"verified": True, "description"', 5)
+    if kind == 'newline_in_string':
+        return text.replace('镍基', '镍基\n', 5)
+    if kind == 'broken_item':
+        # 把中间某个条目的一个引号删掉
+        index = text.find('"label"', len(text) // 3)
+        return text[:index] + text[index + 1:]
+    raise ValueError(kind)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用人为损坏的图谱 JSON 检验容错解析的恢复效果与耗时")
+    parser.add_argument('--nodes', type=int, default=300)
+    parser.add_argument('--relationships', type=int, default=600)
+    parser.add_argument('--cases', type=int, default=20, help="每种损坏方式的样本数")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    kinds = ['fenced', 'truncated', 'trailing_comma', 'python_literal', 'newline_in_string', 'broken_item']
+    print(f"{'损坏方式':<20} {'strict 可解析':>12} {'恢复成功':>8} {'平均抢救率':>10} {'平均耗时(ms)':>12}")
+    for kind in kinds:
+        strict_ok = recovered = 0
+        rates, seconds = [], []
+        for _ in range(args.cases):
+            text = _damage(json.dumps(_sample_graph(rng, args.nodes, args.relationships), ensure_ascii=False,
+                                      indent=2), kind, rng)
+            try:
+                json.loads(text.strip().replace("```json", "").replace("```", "").strip())
+                strict_ok += 1
+            except json.JSONDecodeError:
+                pass
+            start = time.perf_counter()
+            graph, report = recover_graph_json(text)
+            seconds.append(time.perf_counter() - start)
+            if graph is not None:
+                recovered += 1
+                rates.append(report['salvage_rate'])
+        print(f"{kind:<20} {strict_ok:>12} {recovered:>8} {sum(rates) / max(1, len(rates)):>10.3f} "
+              f"{sum(seconds) / len(seconds) * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
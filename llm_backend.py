@@ -0,0 +1,95 @@
+import os
+from abc import ABC, abstractmethod
+
+# ================================
+# 配置区
+# ================================
+# 选择后端：gemini (真实 API) 或 fake (本地替身，不联网)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+LLM_MODEL = os.getenv("LLM_MODEL", "models/gemini-2.5-pro")
+# 访问 Gemini 需要的代理，设为空字符串则不设置代理
+LLM_PROXY = os.getenv("LLM_PROXY", "http://127.0.0.1:7890")
+# 批处理结果文件的下载地址，以及流式下载时每次写盘的字节数
+RESULT_DOWNLOAD_URL = "https://generativelanguage.googleapis.com/download/v1beta/{name}:download?alt=media"
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+DOWNLOAD_TIMEOUT_SECONDS = 600
+
+
+def is_not_found(e):
+    """google.api_core.exceptions.NotFound、google.genai.errors.APIError(404) 与替身的 404 都算作未找到。"""
+    return type(e).__name__ == 'NotFound' or getattr(e, 'code', None) == 404
+
+
+def is_server_error(e):
+    """服务端错误 (5xx)，可以退避后重试。"""
+    code = getattr(e, 'code', None)
+    return type(e).__name__ in ('ServerError', 'ServiceUnavailable') or (isinstance(code, int) and code >= 500)
+
+
+class LLMBackend(ABC):
+    """
+    流水线用到的全部大模型能力，接口与 google.genai.Client 保持一致，现有调用无需改写：
+
+        files.upload(file=, config=) / files.get(name=) / files.delete(name=) / files.list()
+        batches.create(model=, src=, config=) / batches.get(name=) / batches.cancel(name=) / batches.list()
+        models.generate_content(model=, contents=, config=)
+        caches.create(model=, config=)            (可选，见 prompt_assets.PromptContextCache)
+
+    另外提供 download(file_name, dest_path) 把批处理结果文件流式写入磁盘，以及 model_name。
+    不支持缓存上下文的后端把 caches 设为 None，提示词直接内联。
+    本地替身实现见 fake_backend.FakeBackend。
+    """
+
+    model_name = LLM_MODEL
+    caches = None
+
+    @abstractmethod
+    def download(self, file_name, dest_path):
+        """把批处理结果文件 file_name 写入 dest_path。"""
+
+
+class GeminiBackend(LLMBackend):
+    """真实的 Gemini API。SDK 只在这里导入，使用替身后端时不需要安装。"""
+
+    def __init__(self, api_key, model_name=LLM_MODEL, proxy=LLM_PROXY):
+        if proxy:
+            os.environ["http_proxy"] = proxy
+            os.environ["https_proxy"] = proxy
+        from google import genai
+        self.api_key = api_key
+        self.model_name = model_name
+        self.client = genai.Client(api_key=api_key)
+        self.files = self.client.files
+        self.batches = self.client.batches
+        self.models = self.client.models
+        self.caches = self.client.caches
+
+    def download(self, file_name, dest_path):
+        """
+        以流的方式把批处理结果文件分块写入磁盘。
+        client.files.download 会把整个结果 (20 本书的响应，可达数百 MB) 读进内存，这里不保留完整内容。
+        """
+        import httpx
+        url = RESULT_DOWNLOAD_URL.format(name=file_name)
+        with httpx.stream('GET', url, headers={'x-goog-api-key': self.api_key},
+                          timeout=DOWNLOAD_TIMEOUT_SECONDS, follow_redirects=True) as response:
+            response.raise_for_status()
+            with open(dest_path, 'wb') as f:
+                for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+
+
+def create_backend(name=None, api_key=None, model_name=None):
+    """按 LLM_BACKEND 环境变量 (或 name 参数) 创建后端。gemini 后端需要 GEMINI_API_KEY。"""
+    name = name or LLM_BACKEND
+    model_name = model_name or LLM_MODEL
+    if name == 'fake':
+        # 替身只在离线测试时导入
+        from fake_backend import FakeBackend
+        return FakeBackend(model_name)
+    if name == 'gemini':
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("❌ 错误：请设置 GEMINI_API_KEY 环境变量")
+        return GeminiBackend(api_key, model_name)
+    raise ValueError(f"未知的 LLM_BACKEND: {name} (可选 gemini / fake)")
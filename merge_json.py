@@ -1,5 +1,54 @@
 import os
+import re
+import time
+import csv
 import json
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+import functools
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from entity_dedup import GraphDeduplicator, load_alias_file
+
+
+# 流式解析时每次从磁盘读取的字符数
+STREAM_CHUNK_SIZE = 1 << 16
+
+# 流式解析时需要逐条展开的顶层数组
+GRAPH_SECTIONS = ('nodes', 'relationships')
+
+# 增量合并的缓存目录与清单文件
+MERGE_CACHE_DIR = '.merge_cache'
+MANIFEST_FILENAME = 'manifest.json'
+
+# 分片输出：单个分片的最大字节数、同时保持打开的分片文件数
+SHARD_MAX_BYTES = 16 * 1024 * 1024
+SHARD_MAX_OPEN_FILES = 64
+# 生成的导入脚本中每个事务提交的行数
+SHARD_IMPORT_BATCH_SIZE = 10000
+
+# neo4j-admin CSV 输出：数组属性的分隔符、写出 CSV 前的暂存目录
+CSV_ARRAY_DELIMITER = ';'
+CSV_STAGING_DIR = '.staging'
+
+# 图谱版本节点，每种导入方式 (neo4j_import.py、import.cypher、neo4j-admin CSV) 导入后都会更新，
+# rag.py 的查询结果缓存以此判断是否失效。CSV 中该节点使用独立的 id 空间，不与图谱节点冲突
+GRAPH_META_LABEL = '_KGMeta'
+GRAPH_META_ID = 'graph'
+# 在数据库中写入新版本号的语句 (版本号由数据库生成)
+GRAPH_VERSION_STAMP_CYPHER = (f"MERGE (m:`{GRAPH_META_LABEL}` {{id: '{GRAPH_META_ID}'}}) "
+                              f"SET m.version = toString(datetime()) + '-' + substring(randomUUID(), 0, 8), "
+                              f"m.updated_at = timestamp() / 1000.0;")
+
+
+def new_graph_version():
+    """新的图谱版本号 (时间戳 + 随机后缀)。"""
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{random.getrandbits(32):08x}"
 
 
 def flatten_properties(obj, parent_key='', sep='.'):
@@ -16,6 +65,836 @@ def flatten_properties(obj, parent_key='', sep='.'):
     return dict(items)
 
 
+def flatten_node(node):
+    """扁平化单个节点的 properties，返回节点本身。"""
+    if 'properties' in node and isinstance(node['properties'], dict):
+        node['properties'] = flatten_properties(node['properties'])
+    return node
+
+
+def flatten_relationship(rel):
+    """
+    扁平化单个关系的 properties。
+    type 字段不存在或为空的关系视为无效，返回 None。
+    """
+    if not rel.get('type'):
+        return None
+    if 'properties' in rel and isinstance(rel['properties'], dict):
+        rel['properties'] = flatten_properties(rel['properties'])
+    return rel
+
+
+# ================================
+# 流式 JSON 解析
+# ================================
+class _JsonStreamReader:
+    """
+    基于 json.JSONDecoder.raw_decode 的增量读取器。
+    缓冲区只保存尚未解析的文本，因此内存占用与单个元素的大小相关，而不是整个文件。
+    """
+
+    def __init__(self, f, chunk_size=STREAM_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, min_size=0):
+        """丢弃已解析部分并读入新数据，读到文件末尾时返回 False。"""
+        data = self.f.read(max(self.chunk_size, min_size))
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """跳过空白并返回下一个字符，文件结束时返回空字符串。"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buf, self.pos)
+        self.pos += 1
+
+    def decode_value(self):
+        """解析下一个完整的 JSON 值，缓冲区不足时继续读取。"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # 数字等值可能恰好被截断在缓冲区末尾，需要再读一段确认
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # 按已缓冲长度成倍读取，避免超大元素反复重试
+            if not self._fill(min_size=len(self.buf) - self.pos):
+                if self.pos >= len(self.buf):
+                    raise json.JSONDecodeError("Unexpected end of data", self.buf, self.pos)
+
+
+def iter_graph_items(f, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    增量解析一个知识图谱 JSON 文件，逐条产出 (section, item)。
+    section 为 'nodes' 或 'relationships'；其他顶层字段会被解析后丢弃。
+
+    Args:
+        f: 以文本模式打开的文件对象。
+        chunk_size (int): 每次读取的字符数。
+    """
+    reader = _JsonStreamReader(f, chunk_size)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.decode_value()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Expecting property name", reader.buf, reader.pos)
+        reader.expect(':')
+        if key in GRAPH_SECTIONS and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    yield key, reader.decode_value()
+                    if reader.peek() == ',':
+                        reader.expect(',')
+                        continue
+                    reader.expect(']')
+                    break
+        else:
+            reader.decode_value()
+        if reader.peek() == ',':
+            reader.expect(',')
+            continue
+        reader.expect('}')
+        break
+
+
+def iter_flattened_items(f):
+    """
+    在 iter_graph_items 的基础上完成扁平化与关系校验，逐条产出：
+    ('node', 节点) / ('relationship', 关系) / ('filtered', 被过滤的关系)。
+    """
+    for section, item in iter_graph_items(f):
+        if section == 'nodes':
+            yield 'node', flatten_node(item)
+        elif flatten_relationship(item) is None:
+            yield 'filtered', item
+        else:
+            yield 'relationship', item
+
+
+def _iter_flattened_file(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        yield from iter_flattened_items(f)
+
+
+def load_flattened_graph_file(file_path):
+    """
+    一次性解析并扁平化单个文件，返回与 iter_flattened_items 顺序相同的列表。
+    供进程池中的 worker 调用，因此必须是模块级函数。
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise json.JSONDecodeError("Expecting object", '', 0)
+    items = []
+    # 保持与流式解析一致的顺序：按顶层字段在文件中出现的先后产出
+    for section in data:
+        if section == 'nodes' and isinstance(data[section], list):
+            items.extend(('node', flatten_node(node)) for node in data[section])
+        elif section == 'relationships' and isinstance(data[section], list):
+            for rel in data[section]:
+                items.append(('filtered', rel) if flatten_relationship(rel) is None else ('relationship', rel))
+    return items
+
+
+def iter_source_loaders(file_paths, workers=1):
+    """
+    按 file_paths 的顺序为每个文件产出一个无参加载函数，调用后返回扁平化条目的可迭代对象。
+
+    workers <= 1 时在当前进程中增量解析；否则在进程池中并行解析，
+    主进程按原顺序依次取回结果，所以输出与串行运行完全相同。
+    同时在途的文件数限制为 workers 的两倍，避免结果堆积占用内存。
+    """
+    if workers <= 1:
+        for path in file_paths:
+            yield functools.partial(_iter_flattened_file, path)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        paths = iter(file_paths)
+        pending = deque(pool.submit(load_flattened_graph_file, path)
+                        for _, path in zip(range(workers * 2), paths))
+        while pending:
+            future = pending.popleft()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append(pool.submit(load_flattened_graph_file, next_path))
+            yield future.result
+
+
+# ================================
+# 流式写出
+# ================================
+class RawJson(str):
+    """已经序列化好的紧凑 JSON 文本，写出器遇到它时原样写入而不再重新编码。"""
+
+
+class StreamingGraphWriter:
+    """
+    将节点直接写入输出文件，关系先写入临时文件，全部写完后再拼接到节点数组之后。
+    每个元素占一行（紧凑格式），输出仍是 {"nodes": [...], "relationships": [...]} 结构，
+    可被 apoc.load.json 直接读取。
+
+    通过 begin_file / commit_file / rollback_file 实现单个源文件的原子写入：
+    源文件中途解析失败时，把两个文件截断回该文件开始前的位置。
+    """
+
+    def __init__(self, output_filename):
+        self.output_filename = output_filename
+        self.out = open(output_filename, 'wb')
+        self.spill = tempfile.TemporaryFile(
+            prefix='merge_rels_', dir=os.path.dirname(os.path.abspath(output_filename)))
+        self.node_count = 0
+        self.rel_count = 0
+        self._checkpoint = None
+        self.out.write(b'{\n  "nodes": [')
+
+    @staticmethod
+    def _encode(item):
+        if isinstance(item, RawJson):
+            return item.encode('utf-8')
+        return json.dumps(item, ensure_ascii=False).encode('utf-8')
+
+    def write_node(self, node):
+        self.out.write(b'\n    ' if self.node_count == 0 else b',\n    ')
+        self.out.write(self._encode(node))
+        self.node_count += 1
+
+    def write_relationship(self, rel):
+        self.spill.write(b'\n    ' if self.rel_count == 0 else b',\n    ')
+        self.spill.write(self._encode(rel))
+        self.rel_count += 1
+
+    def begin_file(self):
+        self._checkpoint = (self.out.tell(), self.spill.tell(), self.node_count, self.rel_count)
+
+    def commit_file(self):
+        self._checkpoint = None
+
+    def rollback_file(self):
+        if self._checkpoint is None:
+            return
+        out_pos, spill_pos, self.node_count, self.rel_count = self._checkpoint
+        self.out.seek(out_pos)
+        self.out.truncate()
+        self.spill.seek(spill_pos)
+        self.spill.truncate()
+        self._checkpoint = None
+
+    def close(self):
+        """拼接关系临时文件并关闭输出。"""
+        try:
+            self.out.write(b'\n  ],\n  "relationships": [' if self.node_count else b'],\n  "relationships": [')
+            self.spill.seek(0)
+            while True:
+                chunk = self.spill.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.out.write(chunk)
+            self.out.write(b'\n  ]\n}' if self.rel_count else b']\n}')
+        finally:
+            self.spill.close()
+            self.out.close()
+
+    def abort(self):
+        """出错时关闭并删除不完整的输出文件。"""
+        self.spill.close()
+        self.out.close()
+        if os.path.exists(self.output_filename):
+            os.remove(self.output_filename)
+
+
+class ShardedGraphWriter:
+    """
+    按节点 label 与关系 type 分片写出 JSONL，每个分片不超过 max_shard_bytes：
+
+        <output_dir>/nodes/<Label>/part-00000.jsonl
+        <output_dir>/relationships/<TYPE>/part-00000.jsonl
+        <output_dir>/manifest.json   分片清单 (路径、行数、字节数)
+        <output_dir>/import.cypher   每个分片一条导入语句，可按分片并行或断点续导，最后更新图谱版本
+
+    Neo4j 可以用 apoc.load.json 逐行读取 JSONL，不必一次解析整个文件。
+    分片文件不支持截断回滚，因此单个源文件的条目先缓存在内存中，commit_file 时再写出。
+    """
+
+    def __init__(self, output_dir, max_shard_bytes=SHARD_MAX_BYTES, import_prefix=None):
+        self.output_dir = output_dir
+        self.max_shard_bytes = max_shard_bytes
+        self.import_prefix = import_prefix or f"file:///{os.path.basename(os.path.abspath(output_dir))}/"
+        self.manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.node_count = 0
+        self.rel_count = 0
+        self.shards = []         # 按创建顺序记录的分片信息
+        self._current = {}       # (kind, name) -> 当前分片信息
+        self._handles = OrderedDict()  # 分片相对路径 -> 文件句柄，超出上限时关闭最久未用的
+        self._pending = None
+
+        # 清理上一次运行留下的分片，避免旧分片混入新清单
+        for sub in ('nodes', 'relationships'):
+            shutil.rmtree(os.path.join(output_dir, sub), ignore_errors=True)
+        os.makedirs(output_dir, exist_ok=True)
+
+    @staticmethod
+    def _shard_name(value, default):
+        name = re.sub(r'[^\w\-]', '_', value) if isinstance(value, str) and value else ''
+        return name or default
+
+    def _handle(self, rel_path):
+        f = self._handles.pop(rel_path, None)
+        if f is None:
+            if len(self._handles) >= SHARD_MAX_OPEN_FILES:
+                _, oldest = self._handles.popitem(last=False)
+                oldest.close()
+            full_path = os.path.join(self.output_dir, rel_path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            f = open(full_path, 'ab')
+        self._handles[rel_path] = f
+        return f
+
+    def _emit(self, kind, name, item):
+        line = StreamingGraphWriter._encode(item) + b'\n'
+        shard = self._current.get((kind, name))
+        if shard is None or (shard['rows'] and shard['bytes'] + len(line) > self.max_shard_bytes):
+            index = shard['part'] + 1 if shard else 0
+            shard = {
+                'kind': kind,
+                'name': name,
+                'part': index,
+                'file': f"{kind}/{name}/part-{index:05d}.jsonl",
+                'rows': 0,
+                'bytes': 0,
+            }
+            self._current[(kind, name)] = shard
+            self.shards.append(shard)
+        self._handle(shard['file']).write(line)
+        shard['rows'] += 1
+        shard['bytes'] += len(line)
+
+    def _emit_node(self, node):
+        self._emit('nodes', self._shard_name(node.get('label'), '_unlabeled'), node)
+        self.node_count += 1
+
+    def _emit_relationship(self, rel):
+        self._emit('relationships', self._shard_name(rel.get('type'), '_untyped'), rel)
+        self.rel_count += 1
+
+    def write_node(self, node):
+        if self._pending is not None:
+            self._pending[0].append(node)
+        else:
+            self._emit_node(node)
+
+    def write_relationship(self, rel):
+        if self._pending is not None:
+            self._pending[1].append(rel)
+        else:
+            self._emit_relationship(rel)
+
+    def begin_file(self):
+        self._pending = ([], [])
+
+    def commit_file(self):
+        nodes, rels = self._pending
+        self._pending = None
+        for node in nodes:
+            self._emit_node(node)
+        for rel in rels:
+            self._emit_relationship(rel)
+
+    def rollback_file(self):
+        self._pending = None
+
+    def _import_statement(self, shard):
+        url = self.import_prefix + shard['file']
+        if shard['kind'] == 'nodes':
+            action = f"MERGE (n:`{shard['name']}` {{id: value.id}}) SET n += value.properties"
+        else:
+            action = ("MATCH (s {id: value.source}) MATCH (t {id: value.target}) "
+                      f"MERGE (s)-[r:`{shard['name']}`]->(t) SET r += value.properties")
+        return (f"// {shard['file']} ({shard['rows']} 行)\n"
+                f"CALL apoc.periodic.iterate(\n"
+                f"  'CALL apoc.load.json($url) YIELD value RETURN value',\n"
+                f"  '{action}',\n"
+                f"  {{batchSize: {SHARD_IMPORT_BATCH_SIZE}, params: {{url: '{url}'}}}});\n")
+
+    def close(self):
+        """关闭所有分片，写出分片清单与导入脚本。节点分片排在关系分片之前。"""
+        for f in self._handles.values():
+            f.close()
+        self._handles.clear()
+        shards = sorted(self.shards, key=lambda sh: (sh['kind'] != 'nodes', sh['name'], sh['part']))
+        labels = sorted({sh['name'] for sh in shards if sh['kind'] == 'nodes'})
+        rel_types = sorted({sh['name'] for sh in shards if sh['kind'] == 'relationships'})
+        manifest = {
+            'format': 'jsonl',
+            'max_shard_bytes': self.max_shard_bytes,
+            'node_count': self.node_count,
+            'relationship_count': self.rel_count,
+            'labels': labels,
+            'relationship_types': rel_types,
+            'shards': shards,
+        }
+        with open(os.path.join(self.output_dir, 'import.cypher'), 'w', encoding='utf-8') as f:
+            f.write("// 由 merge_json.py 生成：先创建唯一约束，再按分片导入节点和关系\n")
+            for label in labels:
+                f.write(f"CREATE CONSTRAINT IF NOT EXISTS FOR (n:`{label}`) REQUIRE n.id IS UNIQUE;\n")
+            f.write("\n")
+            for shard in shards:
+                f.write(self._import_statement(shard) + "\n")
+            f.write("// 全部分片导入后更新图谱版本，rag.py 缓存的查询结果与回答随之失效\n")
+            f.write(GRAPH_VERSION_STAMP_CYPHER + "\n")
+        # 清单最后写入，作为输出完整的标志
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def abort(self):
+        for f in self._handles.values():
+            f.close()
+        self._handles.clear()
+        for sub in ('nodes', 'relationships'):
+            shutil.rmtree(os.path.join(self.output_dir, sub), ignore_errors=True)
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+
+
+def _csv_scalar_type(value):
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        # 超出 long 范围的整数只能按字符串保存
+        return 'long' if -2 ** 63 <= value < 2 ** 63 else 'string'
+    if isinstance(value, float):
+        return 'double'
+    if isinstance(value, str):
+        return 'string'
+    return None
+
+
+def csv_value_type(value):
+    """
+    推断单个扁平化属性值在 neo4j-admin 表头中的类型：boolean / long / double / string，
+    或由同类基本值组成的数组 (如 string[])。long 与 double 混合的数组视为 double[]；
+    其他列表 (嵌套、含字典、混合类型、字符串中含数组分隔符) 按 JSON 字符串保存。
+    空值与空列表返回 None，不影响列类型。
+    """
+    if value is None or value == []:
+        return None
+    if not isinstance(value, list):
+        return _csv_scalar_type(value) or 'string'
+    element_types = set()
+    for v in value:
+        t = _csv_scalar_type(v)
+        if t is None or (t == 'string' and CSV_ARRAY_DELIMITER in v):
+            return 'string'
+        element_types.add(t)
+    if element_types == {'long', 'double'}:
+        return 'double[]'
+    if len(element_types) == 1:
+        return element_types.pop() + '[]'
+    return 'string'
+
+
+def widen_csv_type(current, incoming):
+    """合并同一列在不同行中的类型：long 与 double 放宽为 double，其他冲突退化为 string。"""
+    if current is None or current == incoming:
+        return incoming
+    if incoming is None:
+        return current
+    if {current, incoming} == {'long', 'double'}:
+        return 'double'
+    if {current, incoming} == {'long[]', 'double[]'}:
+        return 'double[]'
+    return 'string'
+
+
+def _csv_scalar(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def csv_cell(value, column_type):
+    """按列的最终类型编码单元格；空单元格在导入时表示没有该属性。"""
+    if value is None or value == []:
+        return ''
+    if column_type.endswith('[]'):
+        return CSV_ARRAY_DELIMITER.join(_csv_scalar(v) for v in value)
+    if column_type == 'string' and not isinstance(value, str):
+        return json.dumps(value, ensure_ascii=False)
+    return _csv_scalar(value)
+
+
+class AdminCsvGraphWriter(ShardedGraphWriter):
+    """
+    为 neo4j-admin database import 写出 CSV，适合整库重建：
+
+        <output_dir>/nodes/<Label>.csv                 id:ID, :LABEL, 属性列...
+        <output_dir>/relationships/<TYPE>.csv          :START_ID, :END_ID, :TYPE, 属性列...
+        <output_dir>/nodes/_KGMeta.csv                 图谱版本节点 (独立 id 空间)
+        <output_dir>/import.sh, import.bat             生成的 neo4j-admin 导入命令
+        <output_dir>/manifest.json                     文件清单 (行数、表头)
+
+    属性列来自扁平化后的 properties，表头带类型 (如 composition.ni:double、synonyms:string[])。
+    列与类型要看完全部数据才能确定，因此先借用分片写出器按 label/type 把条目暂存为 JSONL，
+    同时累计各列类型，close 时再逐行转换为 CSV，内存占用与图的规模无关。
+
+    所有节点共用一个全局 id 空间 (与 MERGE 导入按 id 匹配节点一致)，
+    重复 id 与端点不存在的关系交给 neo4j-admin 跳过；需要合并重复节点的属性时请同时使用 --dedup。
+    没有 id 的节点和缺少端点的关系无法导入，直接跳过并计入清单。
+    """
+
+    def __init__(self, output_dir):
+        super().__init__(os.path.join(output_dir, CSV_STAGING_DIR), max_shard_bytes=float('inf'))
+        self.csv_dir = output_dir
+        self.manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.columns = {}        # (kind, 暂存名) -> {列名: 类型}
+        self.skipped_nodes = 0
+        self.skipped_relationships = 0
+        for sub in ('nodes', 'relationships'):
+            shutil.rmtree(os.path.join(output_dir, sub), ignore_errors=True)
+
+    @staticmethod
+    def _column_name(key):
+        # 表头用冒号分隔属性名与类型，属性名中的冒号需要替换
+        return str(key).replace(':', '_')
+
+    def _emit(self, kind, name, item):
+        columns = self.columns.setdefault((kind, name), {})
+        properties = item.get('properties')
+        if isinstance(properties, dict):
+            for key, value in properties.items():
+                column = self._column_name(key)
+                if kind == 'nodes' and column == 'id':
+                    continue
+                columns[column] = widen_csv_type(columns.get(column), csv_value_type(value))
+        super()._emit(kind, name, item)
+
+    def _emit_node(self, node):
+        if node.get('id') is None or node.get('id') == '':
+            self.skipped_nodes += 1
+            return
+        super()._emit_node(node)
+
+    def _emit_relationship(self, rel):
+        if rel.get('source') is None or rel.get('target') is None:
+            self.skipped_relationships += 1
+            return
+        super()._emit_relationship(rel)
+
+    def _write_csv(self, shard):
+        """把一个暂存分片转换为 CSV，返回清单条目。没有任何值的列不写出。"""
+        kind, name = shard['kind'], shard['name']
+        columns = [(column, column_type) for column, column_type in self.columns[(kind, name)].items()
+                   if column_type is not None]
+        if kind == 'nodes':
+            header = ['id:ID', ':LABEL']
+        else:
+            header = [':START_ID', ':END_ID', ':TYPE']
+        header += [f"{column}:{column_type}" for column, column_type in columns]
+
+        rel_path = f"{kind}/{name}.csv"
+        csv_path = os.path.join(self.csv_dir, rel_path)
+        os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+        with open(os.path.join(self.output_dir, shard['file']), 'r', encoding='utf-8') as src, \
+                open(csv_path, 'w', encoding='utf-8', newline='') as out:
+            csv_writer = csv.writer(out)
+            csv_writer.writerow(header)
+            for line in src:
+                item = json.loads(line)
+                properties = item.get('properties')
+                if not isinstance(properties, dict):
+                    properties = {}
+                properties = {self._column_name(k): v for k, v in properties.items()}
+                if kind == 'nodes':
+                    row = [_csv_scalar(item['id']), item.get('label') or '']
+                else:
+                    row = [_csv_scalar(item['source']), _csv_scalar(item['target']), item['type']]
+                row += [csv_cell(properties.get(column), column_type) for column, column_type in columns]
+                csv_writer.writerow(row)
+        return {'kind': kind, 'name': name, 'file': rel_path, 'rows': shard['rows'], 'header': header}
+
+    def _write_graph_version(self):
+        """写出图谱版本节点，整库导入后 rag.py 读到的是新版本号。不计入清单中的图谱文件。"""
+        rel_path = f"nodes/{GRAPH_META_LABEL}.csv"
+        os.makedirs(os.path.join(self.csv_dir, 'nodes'), exist_ok=True)
+        with open(os.path.join(self.csv_dir, rel_path), 'w', encoding='utf-8', newline='') as f:
+            csv_writer = csv.writer(f)
+            csv_writer.writerow([f'id:ID({GRAPH_META_LABEL})', ':LABEL', 'version:string', 'updated_at:double'])
+            csv_writer.writerow([GRAPH_META_ID, GRAPH_META_LABEL, new_graph_version(), repr(time.time())])
+        return {'kind': 'nodes', 'file': rel_path}
+
+    @staticmethod
+    def _import_arguments(files):
+        args = [f"--{f['kind']}={f['file']}" for f in files]
+        args += ['--skip-duplicate-nodes=true', '--skip-bad-relationships=true', '--bad-tolerance=-1',
+                 '--multiline-fields=true', f"--array-delimiter={CSV_ARRAY_DELIMITER}"]
+        return args
+
+    def _write_import_commands(self, files):
+        """生成 Linux/macOS 与 Windows 的导入命令 (Neo4j 5 语法，需先停止数据库)。"""
+        args = self._import_arguments(files)
+        with open(os.path.join(self.csv_dir, 'import.sh'), 'w', encoding='utf-8', newline='\n') as f:
+            f.write("#!/bin/sh\n"
+                    "# 由 merge_json.py --format csv 生成。导入前先停止数据库，目标库会被整体覆盖。\n"
+                    "# Neo4j 4.x 请改用: neo4j-admin import --database=neo4j ... (参数相同)\n"
+                    "cd \"$(dirname \"$0\")\" || exit 1\n"
+                    "\"${NEO4J_HOME:+$NEO4J_HOME/bin/}neo4j-admin\" database import full \"${NEO4J_DATABASE:-neo4j}\" \\\n"
+                    "  --overwrite-destination=true")
+            for arg in args:
+                f.write(f" \\\n  '{arg}'")
+            f.write("\n")
+        os.chmod(os.path.join(self.csv_dir, 'import.sh'), 0o755)
+        with open(os.path.join(self.csv_dir, 'import.bat'), 'w', encoding='utf-8', newline='\r\n') as f:
+            f.write("@echo off\n"
+                    "rem 由 merge_json.py --format csv 生成。导入前先停止数据库，目标库会被整体覆盖。\n"
+                    "cd /d \"%~dp0\"\n"
+                    "if not defined NEO4J_DATABASE set NEO4J_DATABASE=neo4j\n"
+                    "if defined NEO4J_HOME (set NEO4J_ADMIN=\"%NEO4J_HOME%\\bin\\neo4j-admin.bat\") "
+                    "else (set NEO4J_ADMIN=neo4j-admin.bat)\n"
+                    "call %NEO4J_ADMIN% database import full %NEO4J_DATABASE% ^\n"
+                    "  --overwrite-destination=true")
+            for arg in args:
+                f.write(f" ^\n  \"{arg}\"")
+            f.write("\n")
+
+    def close(self):
+        """关闭暂存分片，逐个转换为 CSV，写出导入命令与清单，最后删除暂存目录。"""
+        for f in self._handles.values():
+            f.close()
+        self._handles.clear()
+        shards = sorted(self.shards, key=lambda sh: (sh['kind'] != 'nodes', sh['name']))
+        files = [self._write_csv(shard) for shard in shards]
+        self._write_import_commands(files + [self._write_graph_version()])
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+        manifest = {
+            'format': 'neo4j-admin-csv',
+            'array_delimiter': CSV_ARRAY_DELIMITER,
+            'node_count': self.node_count,
+            'relationship_count': self.rel_count,
+            'skipped_nodes': self.skipped_nodes,
+            'skipped_relationships': self.skipped_relationships,
+            'labels': sorted({f['name'] for f in files if f['kind'] == 'nodes'}),
+            'relationship_types': sorted({f['name'] for f in files if f['kind'] == 'relationships'}),
+            'files': files,
+        }
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def abort(self):
+        super().abort()
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+        for sub in ('nodes', 'relationships'):
+            shutil.rmtree(os.path.join(self.csv_dir, sub), ignore_errors=True)
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+
+
+def open_graph_writer(output, output_format='json', max_shard_bytes=SHARD_MAX_BYTES):
+    """
+    根据输出格式创建写出器，返回 (writer, 用于判断输出是否最新的文件路径)。
+    json: 单个 merged_knowledge_graph.json；shards: 按 label/type 分片的 JSONL 目录；
+    csv: 供 neo4j-admin 离线导入的 CSV 目录。
+    """
+    if output_format == 'csv':
+        writer = AdminCsvGraphWriter(output)
+        return writer, writer.manifest_path
+    if output_format == 'shards':
+        writer = ShardedGraphWriter(output, max_shard_bytes)
+        return writer, writer.manifest_path
+    if output_format == 'json':
+        return StreamingGraphWriter(output), output
+    raise ValueError(f"未知的输出格式: {output_format}")
+
+
+# ================================
+# 增量合并
+# ================================
+def file_sha256(file_path, chunk_size=1 << 20):
+    """分块计算文件的 SHA-256，避免一次性读入大文件。"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _iter_fragment(fragment_path, raw=False):
+    """
+    读取缓存片段，每行格式为 "kind\t紧凑JSON"。
+    raw 为 True 时不解析 JSON，直接以 RawJson 产出，供不需要去重的写出器原样拷贝。
+    """
+    with open(fragment_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            kind, _, text = line.rstrip('\n').partition('\t')
+            yield kind, RawJson(text) if raw else json.loads(text)
+
+
+class MergeManifest:
+    """
+    增量合并的文件清单，记录每个源文件的大小、mtime、内容哈希，
+    以及它扁平化后的条目在缓存目录中的片段文件 (<sha256>.jsonl)。
+
+    再次运行时，大小与 mtime 均未变化的文件直接复用片段；变化的文件重新计算哈希，
+    内容确实改变才重新解析。清单中存在但目录中已删除的文件，其片段被丢弃，
+    贡献也就从合并结果中撤回。片段按内容寻址，重命名的文件无需重新解析。
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, MANIFEST_FILENAME)
+        self.files = {}
+        self.output = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.files = data.get('files', {})
+            self.output = data.get('output', {})
+
+    def save(self):
+        """先写临时文件再替换，中途崩溃不会损坏已有清单；随后清理不再被引用的片段。"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files, 'output': self.output}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+        referenced = {entry.get('fragment') for entry in self.files.values()}
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.jsonl') and name not in referenced:
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def _fragment_path(self, sha256):
+        return os.path.join(self.cache_dir, sha256 + '.jsonl')
+
+    def plan(self, source_directory, source_files):
+        """
+        对比清单与目录现状，返回 (计划列表, 已删除的文件名列表)。
+        计划列表中每项包含文件信息，reuse 为 True 表示可以直接复用缓存片段。
+        """
+        plan = []
+        by_hash = {entry.get('sha256'): entry for entry in self.files.values() if entry.get('fragment')}
+        for filename in source_files:
+            path = os.path.join(source_directory, filename)
+            stat = os.stat(path)
+            info = {'filename': filename, 'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            entry = self.files.get(filename)
+            if entry and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+                info['sha256'] = entry.get('sha256')
+            else:
+                info['sha256'] = file_sha256(path)
+            cached = entry if entry and entry.get('sha256') == info['sha256'] else by_hash.get(info['sha256'])
+            info['reuse'] = bool(cached) and (
+                bool(cached.get('error')) or os.path.exists(self._fragment_path(info['sha256'])))
+            info['error'] = cached.get('error') if info['reuse'] else None
+            plan.append(info)
+        current = set(source_files)
+        deleted = [filename for filename in self.files if filename not in current]
+        return plan, deleted
+
+    def retract(self, deleted):
+        """移除已删除文件的清单条目，其片段会在 save 时清理。"""
+        for filename in deleted:
+            self.files.pop(filename, None)
+
+    def _record(self, info, error=None):
+        entry = {'size': info['size'], 'mtime_ns': info['mtime_ns'], 'sha256': info['sha256']}
+        if error:
+            entry['error'] = error
+        else:
+            entry['fragment'] = os.path.basename(self._fragment_path(info['sha256']))
+        self.files[info['filename']] = entry
+
+    def _iter_reused(self, info, raw=False):
+        if info['error']:
+            raise ValueError(f"文件内容未变化，上次解析失败: {info['error']}")
+        self._record(info)
+        yield from _iter_fragment(self._fragment_path(info['sha256']), raw)
+
+    def _iter_and_cache(self, load_items, info):
+        """边产出条目边写入片段，全部成功后再原子地替换为正式片段。"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fragment_path = self._fragment_path(info['sha256'])
+        tmp_path = fragment_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as out:
+                for kind, item in load_items():
+                    text = 'null' if kind == 'filtered' else json.dumps(item, ensure_ascii=False)
+                    out.write(kind + '\t' + text + '\n')
+                    yield kind, item
+            os.replace(tmp_path, fragment_path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self._record(info, error=str(e))
+            raise
+        self._record(info)
+
+    def iter_loaders(self, plan, workers=1, raw=False):
+        """
+        按计划顺序为每个文件产出加载函数：复用的文件读缓存片段 (raw 时不解析)，
+        其余文件交给 iter_source_loaders (可多进程) 解析并写入新片段。
+        """
+        changed = [info for info in plan if not info['reuse']]
+        changed_loaders = iter_source_loaders([info['path'] for info in changed], workers)
+        for info in plan:
+            if info['reuse']:
+                yield functools.partial(self._iter_reused, info, raw)
+            else:
+                yield functools.partial(self._iter_and_cache, next(changed_loaders), info)
+
+    def output_is_current(self, output_filename, options):
+        """输出文件是否由当前清单、以相同选项生成且之后未被改动。"""
+        if not os.path.exists(output_filename):
+            return False
+        return (self.output.get('filename') == os.path.abspath(output_filename)
+                and self.output.get('options') == options
+                and self.output.get('mtime_ns') == os.stat(output_filename).st_mtime_ns)
+
+    def record_output(self, output_filename, options):
+        self.output = {
+            'filename': os.path.abspath(output_filename),
+            'options': options,
+            'mtime_ns': os.stat(output_filename).st_mtime_ns,
+        }
+
+
+def list_source_files(source_directory):
+    """按文件名排序返回目录中的 JSON 文件，保证多次运行的合并顺序一致。"""
+    return sorted(f for f in os.listdir(source_directory) if f.endswith('.json'))
+
+
 def merge_and_flatten_knowledge_graph_json(source_directory, output_filename):
     """
     遍历指定目录下的所有 JSON 文件，将它们的 'nodes' 和 'relationships'
@@ -32,37 +911,33 @@ def merge_and_flatten_knowledge_graph_json(source_directory, output_filename):
 
     print(f"开始扫描目录: '{source_directory}'...")
 
-    for filename in os.listdir(source_directory):
-        if filename.endswith('.json'):
-            file_path = os.path.join(source_directory, filename)
+    for filename in list_source_files(source_directory):
+        file_path = os.path.join(source_directory, filename)
 
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-
-                    if 'nodes' in data and isinstance(data['nodes'], list):
-                        for node in data['nodes']:
-                            if 'properties' in node and isinstance(node['properties'], dict):
-                                node['properties'] = flatten_properties(node['properties'])
-                        merged_nodes.extend(data['nodes'])
-
-                    if 'relationships' in data and isinstance(data['relationships'], list):
-                        for rel in data['relationships']:
-                            # 校验 type 字段，只有存在且不为 None 的关系才处理
-                            if not rel.get('type'):
-                                filtered_rels_count += 1
-                                continue
-                            if 'properties' in rel and isinstance(rel['properties'], dict):
-                                rel['properties'] = flatten_properties(rel['properties'])
-                            merged_relationships.append(rel)
-
-                    print(f"  [+] 成功处理文件: {filename}")
-                    processed_files_count += 1
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
 
-            except json.JSONDecodeError:
-                print(f"  [!] 警告: 文件 '{filename}' 不是有效的 JSON 格式，已跳过。")
-            except Exception as e:
-                print(f"  [!] 错误: 处理文件 '{filename}' 时发生错误: {e}")
+                if 'nodes' in data and isinstance(data['nodes'], list):
+                    for node in data['nodes']:
+                        flatten_node(node)
+                    merged_nodes.extend(data['nodes'])
+
+                if 'relationships' in data and isinstance(data['relationships'], list):
+                    for rel in data['relationships']:
+                        # 校验 type 字段，只有存在且不为 None 的关系才处理
+                        if flatten_relationship(rel) is None:
+                            filtered_rels_count += 1
+                            continue
+                        merged_relationships.append(rel)
+
+                print(f"  [+] 成功处理文件: {filename}")
+                processed_files_count += 1
+
+        except json.JSONDecodeError:
+            print(f"  [!] 警告: 文件 '{filename}' 不是有效的 JSON 格式，已跳过。")
+        except Exception as e:
+            print(f"  [!] 错误: 处理文件 '{filename}' 时发生错误: {e}")
 
     if processed_files_count == 0:
         print("未找到任何 JSON 文件，程序退出。")
@@ -89,9 +964,185 @@ def merge_and_flatten_knowledge_graph_json(source_directory, output_filename):
         print(f"\n[!] 错误: 无法写入输出文件 '{output_filename}': {e}")
 
 
+def stream_merge_knowledge_graph_json(source_directory, output_filename, dedup=False, alias_file=None, workers=1,
+                                      incremental=False, cache_dir=None, output_format='json',
+                                      max_shard_bytes=SHARD_MAX_BYTES):
+    """
+    流式版本的合并：逐个文件增量解析，边扁平化边写出。
+    内存峰值只与单个节点/关系的大小有关，与目录中的文件数量无关。
+
+    workers > 1 时由进程池并行解析和扁平化文件，主进程按文件名顺序归并，
+    输出与串行运行逐字节相同。
+
+    开启 dedup 后，节点先进入 GraphDeduplicator 按 id 和规范化名称去重，
+    关系改写为规范 id 后再写出；此时内存占用与去重后的实体数量成正比。
+
+    开启 incremental 后，只解析新增或内容变化的文件，其余文件复用 MergeManifest
+    缓存的扁平化片段，已删除文件的贡献被撤回；没有任何变化时直接跳过。
+
+    output_format 为 'shards' 时 output_filename 是一个目录，按 label/type 写出
+    大小受限的 JSONL 分片、分片清单和逐分片的导入脚本 (见 ShardedGraphWriter)；
+    为 'csv' 时写出 neo4j-admin 离线导入用的 CSV 与导入命令 (见 AdminCsvGraphWriter)。
+
+    Args:
+        source_directory (str): 包含源 JSON 文件的文件夹路径。
+        output_filename (str): 合并后输出的 JSON 文件名 (分片模式下为输出目录)。
+        dedup (bool): 是否执行实体去重与 id 规范化。
+        alias_file (str): 可选的人工别名表 JSON，仅在 dedup 时使用。
+        workers (int): 解析文件的进程数。
+        incremental (bool): 是否基于清单做增量合并。
+        cache_dir (str): 增量缓存目录，默认为输出文件旁的 .merge_cache。
+        output_format (str): 'json'、'shards' 或 'csv'。
+        max_shard_bytes (int): 分片模式下单个分片的最大字节数。
+    """
+    processed_files_count = 0
+    filtered_rels_count = 0
+
+    print(f"开始扫描目录 (流式模式, {workers} 个进程): '{source_directory}'...")
+    deduplicator = None
+    if dedup:
+        try:
+            aliases = load_alias_file(alias_file) if alias_file else None
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[!] 错误: 无法加载别名表 '{alias_file}': {e}")
+            return
+        deduplicator = GraphDeduplicator(aliases)
+    source_files = list_source_files(source_directory)
+    if not source_files:
+        print("未找到任何 JSON 文件，程序退出。")
+        return
+
+    file_paths = [os.path.join(source_directory, filename) for filename in source_files]
+    manifest = None
+    if incremental:
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(output_filename)), MERGE_CACHE_DIR)
+        options = {'dedup': dedup, 'alias_file': alias_file and os.path.abspath(alias_file),
+                   'output_format': output_format, 'max_shard_bytes': max_shard_bytes}
+        artifact_path = (os.path.join(output_filename, MANIFEST_FILENAME) if output_format != 'json'
+                         else output_filename)
+        try:
+            manifest = MergeManifest(cache_dir)
+            plan, deleted = manifest.plan(source_directory, source_files)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[!] 错误: 无法读取增量清单 '{cache_dir}': {e}")
+            return
+        changed_count = sum(1 for info in plan if not info['reuse'])
+        print(f"  - 增量模式: 复用 {len(plan) - changed_count} 个文件，重新解析 {changed_count} 个，"
+              f"撤回 {len(deleted)} 个已删除文件。")
+        if changed_count == 0 and not deleted and manifest.output_is_current(artifact_path, options):
+            print(f"\n没有文件发生变化，'{output_filename}' 已是最新。")
+            return
+        manifest.retract(deleted)
+        # 只有单文件 JSON 写出器可以原样拷贝缓存文本，分片需要读取 label/type
+        loaders = manifest.iter_loaders(plan, workers, raw=not dedup and output_format == 'json')
+    else:
+        loaders = iter_source_loaders(file_paths, workers)
+
+    try:
+        writer, artifact_path = open_graph_writer(output_filename, output_format, max_shard_bytes)
+    except Exception as e:
+        print(f"\n[!] 错误: 无法写入输出文件 '{output_filename}': {e}")
+        return
+
+    # 去重时先写入索引，全部文件处理完后再统一写出
+    sink = deduplicator or writer
+    # 每个文件的 merge span 挂在本次合并的 merge_run span 下，导入时按输出路径关联到 import span
+    run_span_id = metrics.new_span_id()
+    run_start = time.perf_counter()
+    merged_rows = 0
+    try:
+        for filename, load_items in zip(source_files, loaders):
+            sink.begin_file()
+            file_filtered = 0
+            file_rows = 0
+            file_start = time.perf_counter()
+            status = 'ok'
+            try:
+                for kind, item in load_items():
+                    if kind == 'node':
+                        sink.write_node(item)
+                    elif kind == 'relationship':
+                        sink.write_relationship(item)
+                    else:
+                        file_filtered += 1
+                    file_rows += 1
+                sink.commit_file()
+                filtered_rels_count += file_filtered
+                processed_files_count += 1
+                merged_rows += file_rows
+                print(f"  [+] 成功处理文件: {filename}")
+
+            except json.JSONDecodeError:
+                status = 'error'
+                sink.rollback_file()
+                print(f"  [!] 警告: 文件 '{filename}' 不是有效的 JSON 格式，已跳过。")
+            except Exception as e:
+                status = 'error'
+                sink.rollback_file()
+                print(f"  [!] 错误: 处理文件 '{filename}' 时发生错误: {e}")
+            metrics.record_span('merge', metrics.trace_id_for(filename), time.perf_counter() - file_start,
+                                parent_id=run_span_id, status=status, file=filename, rows=file_rows)
+
+        if deduplicator:
+            deduplicator.flush(writer)
+        writer.close()
+        if manifest:
+            manifest.record_output(artifact_path, options)
+            manifest.save()
+    except OSError as e:
+        writer.abort()
+        print(f"\n[!] 错误: 无法写入输出文件 '{output_filename}': {e}")
+        return
+
+    run_seconds = time.perf_counter() - run_start
+    metrics.record_span('merge_run', run_span_id, run_seconds, span_id=run_span_id, output=output_filename,
+                        files=processed_files_count, rows=merged_rows, format=output_format)
+    if run_seconds > 0:
+        metrics.observe('merge_rows_per_second', merged_rows / run_seconds, format=output_format)
+
+    print("\n合并并扁平化完成！")
+    print(f"  - 总共处理了 {processed_files_count} 个 JSON 文件。")
+    if filtered_rels_count > 0:
+        print(f"  - 总共过滤了 {filtered_rels_count} 个无效关系。")
+    if deduplicator:
+        stats = deduplicator.summary()
+        print(f"  - 去重前节点数: {stats['input_nodes']}，其中 {stats['alias_merges']} 个通过规范化名称归并。")
+        print(f"  - 去重前关系数: {stats['input_relationships']}，丢弃别名归并产生的自环 {stats['dropped_self_loops']} 个。")
+    print(f"  - 合并后的节点总数: {writer.node_count}")
+    print(f"  - 合并后的关系总数: {writer.rel_count}")
+    print(f"  - 结果已保存至: '{output_filename}'")
+
+
 # --- 使用示例 ---
 if __name__ == "__main__":
     SOURCE_FOLDER = './json/'  # 使用 './' 代表当前脚本所在的文件夹
     OUTPUT_FILE = 'merged_knowledge_graph.json'
+    SHARDS_OUTPUT_DIR = 'merged_shards'
+    CSV_OUTPUT_DIR = 'merged_csv'
+
+    parser = argparse.ArgumentParser(description="合并并扁平化知识图谱 JSON 文件")
+    parser.add_argument('--source', default=SOURCE_FOLDER, help="源 JSON 文件夹")
+    parser.add_argument('--output', default=OUTPUT_FILE, help="输出文件名")
+    parser.add_argument('--stream', action='store_true', help="流式合并，内存占用与文件数量无关")
+    parser.add_argument('--dedup', action='store_true', help="按 id 与规范化名称去重节点 (隐含 --stream)")
+    parser.add_argument('--aliases', default=None, help="人工别名表 JSON，格式为 {\"别名\": \"标准名称\"}")
+    parser.add_argument('--workers', type=int, default=1, help="并行解析文件的进程数 (大于 1 时隐含 --stream)")
+    parser.add_argument('--incremental', action='store_true', help="只重新解析新增或变化的文件 (隐含 --stream)")
+    parser.add_argument('--cache-dir', default=None, help=f"增量缓存目录，默认为输出文件旁的 {MERGE_CACHE_DIR}")
+    parser.add_argument('--format', default='json', choices=['json', 'shards', 'csv'],
+                        help="输出格式：单个 JSON 文件、按 label/type 分片的 JSONL 目录，"
+                             "或 neo4j-admin 离线导入用的 CSV 目录 (隐含 --stream)")
+    parser.add_argument('--shard-size', type=int, default=SHARD_MAX_BYTES // (1024 * 1024), help="单个分片的最大 MB 数")
+    args = parser.parse_args()
+
+    if args.format != 'json' and args.output == OUTPUT_FILE:
+        args.output = SHARDS_OUTPUT_DIR if args.format == 'shards' else CSV_OUTPUT_DIR
 
-    merge_and_flatten_knowledge_graph_json(SOURCE_FOLDER, OUTPUT_FILE)
\ No newline at end of file
+    if args.stream or args.dedup or args.workers > 1 or args.incremental or args.format != 'json':
+        stream_merge_knowledge_graph_json(args.source, args.output, dedup=args.dedup, alias_file=args.aliases,
+                                          workers=args.workers, incremental=args.incremental,
+                                          cache_dir=args.cache_dir, output_format=args.format,
+                                          max_shard_bytes=args.shard_size * 1024 * 1024)
+    else:
+        merge_and_flatten_knowledge_graph_json(args.source, args.output)
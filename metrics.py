@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import bisect
+import hashlib
+import argparse
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+# ================================
+# 配置区
+# ================================
+# 指标输出文件与格式：jsonl 逐条追加事件 (span、直方图观测值、计数器)，
+# prometheus 在进程退出时写出 Prometheus 文本格式 (可交给 node_exporter 的 textfile 采集器)
+METRICS_FILE = os.getenv("KG_METRICS_FILE", "metrics.jsonl")
+METRICS_FORMAT = os.getenv("KG_METRICS_FORMAT", "jsonl")
+# 设为 0 时完全关闭指标输出
+METRICS_ENABLED = os.getenv("KG_METRICS", "1") != "0"
+# 每个直方图保留的样本数上限，用于计算 p50/p95
+SAMPLE_LIMIT = 10000
+# Prometheus 直方图的桶边界：1e-3 到 5e9 的 1/2.5/5 倍序列，同时覆盖秒数和字节/行吞吐量
+HISTOGRAM_BUCKETS = [round(m * 10 ** e, 6) for e in range(-3, 10) for m in (1, 2.5, 5)]
+METRIC_PREFIX = "kg_"
+
+
+def trace_id_for(filename):
+    """
+    一本书在整个流程中的 trace id：由去掉扩展名的文件名哈希得到，
+    上传 (book.pdf)、解析、合并 (book.json) 在不同进程里算出的 id 相同，无需额外传递。
+    """
+    stem = os.path.splitext(os.path.basename(str(filename)))[0]
+    return hashlib.sha1(stem.encode('utf-8')).hexdigest()[:16]
+
+
+def new_span_id():
+    return uuid.uuid4().hex[:16]
+
+
+def quantile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class Histogram:
+    """累计桶计数、总和，并保留最多 SAMPLE_LIMIT 个样本 (水塘抽样) 用于分位数。"""
+
+    def __init__(self):
+        self.buckets = [0] * len(HISTOGRAM_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = []
+
+    def observe(self, value):
+        index = bisect.bisect_left(HISTOGRAM_BUCKETS, value)
+        if index < len(self.buckets):
+            self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+        if len(self.samples) < SAMPLE_LIMIT:
+            self.samples.append(value)
+        else:
+            # 用计数做确定性的水塘替换，不引入随机数
+            slot = hash((self.count, value)) % self.count
+            if slot < SAMPLE_LIMIT:
+                self.samples[slot] = value
+
+    def percentiles(self):
+        values = sorted(self.samples)
+        return {'count': self.count, 'sum': round(self.sum, 6), 'p50': quantile(values, 0.50),
+                'p95': quantile(values, 0.95), 'max': values[-1] if values else 0.0}
+
+
+class Span:
+    """一次 span 的上下文：attrs 可以在 with 块内补充 (如行数、字节数)。"""
+
+    def __init__(self, name, trace_id, parent_id=None, attrs=None, span_id=None):
+        self.name = name
+        self.trace_id = trace_id or new_span_id()
+        self.span_id = span_id or new_span_id()
+        self.parent_id = parent_id
+        self.attrs = dict(attrs or {})
+        self.status = 'ok'
+
+
+class MetricsRegistry:
+    """
+    各脚本共用的埋点层：计数器、直方图、计时器与 span。所有方法线程安全。
+
+      - counter(name, value, **labels)：累加，进程退出时写出一次汇总；
+      - observe(name, value, **labels)：直方图观测值 (耗时、字节/秒、行/秒)；
+      - timer(name, **labels)：with 块耗时记入直方图 name (单位秒)；
+      - span(name, trace_id, ...)：with 块耗时记入直方图 "<name>_seconds"，
+        并在 jsonl 中写出带 trace_id / span_id / parent_id 的事件，同一本书各阶段的 span 共享 trace_id；
+      - record_span(name, trace_id, seconds, ...)：补记已知耗时的 span (排队时间、作业运行时间)；
+        需要先把 span_id 交给子 span 时可以预先用 new_span_id() 生成再传入。
+
+    format 为 jsonl 时事件即时追加到 path；为 prometheus 时只在内存中聚合，flush 时整体写出。
+    """
+
+    def __init__(self, path=METRICS_FILE, fmt=METRICS_FORMAT, enabled=METRICS_ENABLED):
+        if fmt not in ('jsonl', 'prometheus'):
+            raise ValueError(f"未知的指标格式: {fmt}")
+        self.path = path
+        self.format = fmt
+        self.enabled = enabled and bool(path)
+        self.counters = defaultdict(float)
+        self.histograms = defaultdict(Histogram)
+        self._file = None
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def _emit(self, record):
+        if not self.enabled or self.format != 'jsonl':
+            return
+        record = {'ts': round(time.time(), 3), 'pid': os.getpid(), **record}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+            self._file.write(line)
+
+    # ---------- 计数器与直方图 ----------
+    def counter(self, name, value=1, **labels):
+        with self._lock:
+            self.counters[self._key(name, labels)] += value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            self.histograms[self._key(name, labels)].observe(value)
+        self._emit({'type': 'histogram', 'name': name, 'value': value, 'labels': labels})
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    # ---------- span ----------
+    def record_span(self, name, trace_id, seconds, parent_id=None, status='ok', span_id=None, **attrs):
+        span = Span(name, trace_id, parent_id, attrs, span_id)
+        span.status = status
+        self._finish(span, seconds)
+        return span
+
+    def _finish(self, span, seconds):
+        with self._lock:
+            self.histograms[self._key(f"{span.name}_seconds", {})].observe(seconds)
+            self.counters[self._key('spans_total', {'stage': span.name, 'status': span.status})] += 1
+        self._emit({'type': 'span', 'name': span.name, 'trace_id': span.trace_id, 'span_id': span.span_id,
+                    'parent_id': span.parent_id, 'seconds': round(seconds, 6), 'status': span.status,
+                    'attrs': span.attrs})
+
+    @contextmanager
+    def span(self, name, trace_id=None, parent_id=None, **attrs):
+        span = Span(name, trace_id, parent_id, attrs)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.status = 'error'
+            span.attrs.setdefault('error', str(e)[:200])
+            raise
+        finally:
+            self._finish(span, time.perf_counter() - start)
+
+    # ---------- 输出 ----------
+    def snapshot(self):
+        with self._lock:
+            return ({key: value for key, value in self.counters.items()},
+                    {key: hist.percentiles() for key, hist in self.histograms.items()})
+
+    def prometheus_text(self):
+        """按 Prometheus 文本格式 (0.0.4) 输出全部计数器与直方图。"""
+        def fmt_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+            return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+        lines = []
+        with self._lock:
+            by_name = defaultdict(list)
+            for (name, labels), value in sorted(self.counters.items()):
+                by_name[name].append((labels, value))
+            for name, series in by_name.items():
+                metric = METRIC_PREFIX + name
+                lines.append(f"# TYPE {metric} counter")
+                lines += [f"{metric}{fmt_labels(labels)} {value:g}" for labels, value in series]
+            by_name = defaultdict(list)
+            for (name, labels), hist in sorted(self.histograms.items()):
+                by_name[name].append((labels, hist))
+            for name, series in by_name.items():
+                metric = METRIC_PREFIX + name
+                lines.append(f"# TYPE {metric} histogram")
+                for labels, hist in series:
+                    cumulative = 0
+                    for bound, count in zip(HISTOGRAM_BUCKETS, hist.buckets):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{fmt_labels(labels, [('le', f'{bound:g}')])} {cumulative}")
+                    lines.append(f"{metric}_bucket{fmt_labels(labels, [('le', '+Inf')])} {hist.count}")
+                    lines.append(f"{metric}_sum{fmt_labels(labels)} {hist.sum:g}")
+                    lines.append(f"{metric}_count{fmt_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """写出计数器汇总 (jsonl) 或整份 Prometheus 文本 (prometheus)。进程退出时自动调用。"""
+        # 进程池的子进程继承了父进程的注册表，只由记录过数据的进程自己写出
+        if not self.enabled or os.getpid() != self._pid and not (self.counters or self.histograms):
+            return
+        if self.format == 'prometheus':
+            if not (self.counters or self.histograms):
+                return
+            text = self.prometheus_text()
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+            return
+        counters, _ = self.snapshot()
+        for (name, labels), value in counters.items():
+            self._emit({'type': 'counter', 'name': name, 'value': value, 'labels': dict(labels)})
+        with self._lock:
+            self.counters.clear()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# 默认注册表：各脚本通过下面的模块级函数埋点
+REGISTRY = MetricsRegistry()
+atexit.register(REGISTRY.flush)
+
+
+def counter(name, value=1, **labels):
+    REGISTRY.counter(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+
+def timer(name, **labels):
+    return REGISTRY.timer(name, **labels)
+
+
+def span(name, trace_id=None, parent_id=None, **attrs):
+    return REGISTRY.span(name, trace_id, parent_id, **attrs)
+
+
+def record_span(name, trace_id, seconds, parent_id=None, status='ok', span_id=None, **attrs):
+    return REGISTRY.record_span(name, trace_id, seconds, parent_id, status, span_id, **attrs)
+
+
+# ================================
+# 离线汇总
+# ================================
+def load_events(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def replay(events):
+    """把 jsonl 事件重新聚合进一个不写文件的注册表，可用于汇总或转换为 Prometheus 文本。"""
+    registry = MetricsRegistry(enabled=False)
+    for event in events:
+        if event.get('type') == 'histogram':
+            registry.observe(event['name'], event['value'], **event.get('labels', {}))
+        elif event.get('type') == 'counter' and event['name'] != 'spans_total':
+            # spans_total 由下面的 span 事件重新计数
+            registry.counter(event['name'], event['value'], **event.get('labels', {}))
+        elif event.get('type') == 'span':
+            registry.histograms[(f"{event['name']}_seconds", ())].observe(event['seconds'])
+            registry.counter('spans_total', 1, stage=event['name'], status=event.get('status', 'ok'))
+    return registry
+
+
+def trace_journey(events, filename):
+    """
+    一本书从上传到 Neo4j 的全部 span：按 trace_id 匹配各阶段，
+    导入阶段处理的是合并后的整体图谱，通过 merge_run 的 output 与 import 的 input 关联。
+    """
+    trace_id = trace_id_for(filename)
+    spans = [e for e in events if e.get('type') == 'span']
+    journey = [e for e in spans if e.get('trace_id') == trace_id]
+    merge_runs = {e.get('parent_id') for e in journey if e['name'] == 'merge'}
+    outputs = {os.path.abspath(e['attrs']['output']) for e in spans
+               if e['span_id'] in merge_runs and e['attrs'].get('output')}
+    journey += [e for e in spans if e['span_id'] in merge_runs]
+    journey += [e for e in spans if e['name'] == 'import' and e['attrs'].get('input')
+                and os.path.abspath(e['attrs']['input']) in outputs]
+    return sorted(journey, key=lambda e: e['ts'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="汇总各脚本写出的指标 jsonl：各阶段 p50/p95、吞吐量，或单本书的完整链路")
+    parser.add_argument('--input', default=METRICS_FILE, help="指标 jsonl 文件")
+    parser.add_argument('--prometheus', default=None, metavar='PATH', help="同时转换为 Prometheus 文本格式写出")
+    parser.add_argument('--trace', default=None, metavar='PDF', help="显示一本书从上传到导入的所有 span")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"❌ 指标文件不存在: {args.input}")
+        return
+    events = list(load_events(args.input))
+
+    if args.trace:
+        journey = trace_journey(events, args.trace)
+        print(f"🔎 '{args.trace}' (trace {trace_id_for(args.trace)}) 共 {len(journey)} 个 span:")
+        for e in journey:
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(e['ts']))
+            print(f"  {stamp}  {e['name']:<14} {e['seconds']:>10.3f}s  {e['status']:<5} "
+                  f"span={e['span_id']} parent={e.get('parent_id') or '-'}  {json.dumps(e['attrs'], ensure_ascii=False)}")
+        return
+
+    registry = replay(events)
+    counters, histograms = registry.snapshot()
+    print(f"📊 {args.input}: {len(events)} 条事件")
+    print(f"{'指标':<36} {'次数':>8} {'p50':>12} {'p95':>12} {'最大':>12}")
+    for (name, labels), stats in sorted(histograms.items()):
+        label = name + (''.join(f" {k}={v}" for k, v in labels))
+        print(f"{label:<36} {stats['count']:>8} {stats['p50']:>12.4g} {stats['p95']:>12.4g} {stats['max']:>12.4g}")
+    for (name, labels), value in sorted(counters.items()):
+        label = name + (''.join(f" {k}={v}" for k, v in labels))
+        print(f"{label:<36} {value:>8g}")
+    if args.prometheus:
+        with open(args.prometheus, 'w', encoding='utf-8') as f:
+            f.write(registry.prometheus_text())
+        print(f"✅ 已写出 Prometheus 文本格式: {args.prometheus}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,700 @@
+import os
+import re
+import json
+import time
+import zlib
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from merge_json import iter_graph_items, MANIFEST_FILENAME, GRAPH_META_LABEL, GRAPH_META_ID, new_graph_version
+
+# ================================
+# 配置区
+# ================================
+# Neo4j 数据库连接配置 (与 rag.py 保持一致)
+NEO4J_URI = "bolt://localhost:7687"
+NEO4J_USER = "neo4j"
+NEO4J_PASSWORD = "123456789"
+
+# 每个 UNWIND 事务包含的行数
+IMPORT_BATCH_SIZE = 5000
+# 没有 label 的节点统一使用的标签
+UNLABELED_LABEL = 'Unlabeled'
+# 并发导入的最大会话数 (也是驱动连接池的下限)
+MAX_IMPORT_WORKERS = 16
+# 瞬时错误 (死锁、锁等待超时等) 的最大重试次数与初始退避秒数
+TRANSIENT_RETRIES = 5
+TRANSIENT_BACKOFF_SECONDS = 0.2
+
+
+# ================================
+# 数据读取
+# ================================
+def iter_graph_source(path, section):
+    """
+    从 merge_json.py 的输出中逐条读取 'nodes' 或 'relationships'。
+    path 可以是单个 merged_knowledge_graph.json，也可以是 --format shards 生成的分片目录。
+    """
+    if os.path.isdir(path):
+        with open(os.path.join(path, MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        for shard in manifest['shards']:
+            if shard['kind'] != section:
+                continue
+            with open(os.path.join(path, shard['file']), 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            for item_section, item in iter_graph_items(f):
+                if item_section == section:
+                    yield item
+
+
+def quote_identifier(name):
+    """用反引号转义 label / 关系类型，防止特殊字符破坏 Cypher 语句。"""
+    return '`' + str(name).replace('`', '``') + '`'
+
+
+def _is_primitive(value):
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+def to_neo4j_properties(properties):
+    """
+    Neo4j 属性只接受基本类型和同类型基本值组成的列表；
+    其他值 (嵌套列表、字典列表、混合类型列表) 序列化为 JSON 字符串保存。
+    """
+    if not isinstance(properties, dict):
+        return {}
+    result = {}
+    for key, value in properties.items():
+        if value is None:
+            continue
+        if _is_primitive(value):
+            result[key] = value
+        elif (isinstance(value, list) and all(_is_primitive(v) and v is not None for v in value)
+              and len({type(v) for v in value}) <= 1):
+            result[key] = value
+        else:
+            result[key] = json.dumps(value, ensure_ascii=False)
+    return result
+
+
+def node_merge_query(label):
+    return (f"UNWIND $rows AS row\n"
+            f"MERGE (n:{quote_identifier(label)} {{id: row.id}})\n"
+            f"SET n += row.properties")
+
+
+def relationship_merge_query(rel_type, source_label, target_label):
+    return (f"UNWIND $rows AS row\n"
+            f"MATCH (s:{quote_identifier(source_label)} {{id: row.source}})\n"
+            f"MATCH (t:{quote_identifier(target_label)} {{id: row.target}})\n"
+            f"MERGE (s)-[r:{quote_identifier(rel_type)}]->(t)\n"
+            f"SET r += row.properties")
+
+
+GRAPH_VERSION_QUERY = (f"MATCH (m:{quote_identifier(GRAPH_META_LABEL)} {{id: '{GRAPH_META_ID}'}}) "
+                       f"RETURN m.version AS version")
+
+
+def stamp_graph_version(driver, database=None):
+    """写入新的图谱版本号 (时间戳 + 随机后缀)，返回该版本号。"""
+    version = new_graph_version()
+    session = driver.session(database=database) if database else driver.session()
+    with session:
+        session.run(node_merge_query(GRAPH_META_LABEL),
+                    rows=[{'id': GRAPH_META_ID, 'properties': {'version': version, 'updated_at': time.time()}}])
+    return version
+
+
+def read_graph_version(session):
+    """读取当前图谱版本号；数据库中没有版本节点 (未经上述任何导入方式) 时返回 '0'。"""
+    record = session.run(GRAPH_VERSION_QUERY).single()
+    return str(record['version']) if record and record['version'] is not None else '0'
+
+
+def constraint_query(label):
+    return f"CREATE CONSTRAINT IF NOT EXISTS FOR (n:{quote_identifier(label)}) REQUIRE n.id IS UNIQUE"
+
+
+# ================================
+# 批量导入
+# ================================
+class ImportStats:
+    """记录导入的行数、批次数与耗时，用于计算吞吐量。"""
+
+    def __init__(self):
+        self.rows = defaultdict(int)
+        self.batches = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.skipped = defaultdict(int)
+        self.retries = defaultdict(int)
+        # 并发导入时 seconds 按挂钟时间统计，而不是各批次耗时之和
+        self.wall_seconds = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, rows, seconds):
+        with self._lock:
+            self.rows[kind] += rows
+            self.batches[kind] += 1
+            self.seconds[kind] += seconds
+
+    def add_retry(self, kind):
+        with self._lock:
+            self.retries[kind] += 1
+
+    def elapsed(self, kind):
+        return self.wall_seconds.get(kind, self.seconds[kind])
+
+    def rows_per_second(self, kind):
+        elapsed = self.elapsed(kind)
+        return self.rows[kind] / elapsed if elapsed else 0.0
+
+    def as_dict(self):
+        return {kind: {'rows': self.rows[kind], 'batches': self.batches[kind], 'seconds': round(self.elapsed(kind), 3),
+                       'rows_per_sec': round(self.rows_per_second(kind), 1), 'skipped': self.skipped[kind],
+                       'retries': self.retries[kind]}
+                for kind in ('nodes', 'relationships')}
+
+
+def is_transient_error(error):
+    """
+    判断是否为可重试的瞬时错误，例如 Neo.TransientError.Transaction.DeadlockDetected。
+    按错误码和类名判断，不强制依赖 neo4j 包。
+    """
+    code = getattr(error, 'code', None) or ''
+    if 'TransientError' in code:
+        return True
+    is_retryable = getattr(error, 'is_retryable', None)
+    if callable(is_retryable):
+        try:
+            return bool(is_retryable())
+        except TypeError:
+            pass
+    return type(error).__name__ in ('TransientError', 'DeadlockDetected', 'SessionExpired', 'ServiceUnavailable')
+
+
+class BatchedGraphLoader:
+    """
+    基于 neo4j 驱动的批量导入器。
+
+    节点按 label 分组，以 UNWIND $rows 批量执行 MERGE (n:Label {id: row.id})，
+    可以命中每个 label 上的唯一约束索引；关系按 (type, 源 label, 目标 label) 分组，
+    两端都用带 label 的 MATCH 查找，避免全库扫描。
+    端点 label 来自导入节点时记录的 id -> label 映射，找不到端点的关系会被跳过并计数。
+    """
+
+    def __init__(self, driver, batch_size=IMPORT_BATCH_SIZE, database=None):
+        self.driver = driver
+        self.batch_size = batch_size
+        self.database = database
+        self.node_labels = {}  # id -> label
+        self.constrained_labels = set()
+        self.stats = ImportStats()
+
+    def _session(self):
+        return self.driver.session(database=self.database) if self.database else self.driver.session()
+
+    @staticmethod
+    def _write_statements(tx, statements):
+        for query, rows in statements:
+            tx.run(query, rows=rows).consume()
+
+    def run_batch(self, kind, statements):
+        """
+        在一个写事务中执行一组 (query, rows) 语句并记录耗时；
+        遇到死锁等瞬时错误时指数退避后重试整个事务。
+        """
+        start = time.perf_counter()
+        for attempt in range(TRANSIENT_RETRIES + 1):
+            try:
+                with self._session() as session:
+                    session.execute_write(self._write_statements, statements)
+                break
+            except Exception as e:
+                if attempt == TRANSIENT_RETRIES or not is_transient_error(e):
+                    raise
+                self.stats.add_retry(kind)
+                time.sleep(TRANSIENT_BACKOFF_SECONDS * (2 ** attempt) * (0.5 + random.random()))
+        self.stats.add(kind, sum(len(rows) for _, rows in statements), time.perf_counter() - start)
+
+    def ensure_constraints(self, labels):
+        """为尚未处理过的 label 创建 id 唯一约束，MERGE 才能走索引。"""
+        new_labels = sorted(set(labels) - self.constrained_labels)
+        if not new_labels:
+            return
+        with self._session() as session:
+            for label in new_labels:
+                session.run(constraint_query(label)).consume()
+        self.constrained_labels.update(new_labels)
+
+    def pack_statements(self, statements):
+        """把零散的小语句打包成若干事务，每个事务合计不超过 batch_size 行。"""
+        batch, batch_rows = [], 0
+        for query, rows in statements:
+            if batch and batch_rows + len(rows) > self.batch_size:
+                yield batch
+                batch, batch_rows = [], 0
+            batch.append((query, rows))
+            batch_rows += len(rows)
+        if batch:
+            yield batch
+
+    def _flush_groups(self, kind, groups, query_for, force=False):
+        """
+        满一批的组单独提交；force 时把各组剩余的零散行打包进少量事务 (事务内每组一条语句)，
+        避免 label/type 组合很多时产生大量小事务。
+        """
+        leftovers = []
+        for key in list(groups):
+            rows = groups[key]
+            if len(rows) >= self.batch_size:
+                self.run_batch(kind, [(query_for(key), rows)])
+                groups[key] = []
+            elif rows and force:
+                leftovers.append((query_for(key), rows))
+                groups[key] = []
+        for batch in self.pack_statements(leftovers):
+            self.run_batch(kind, batch)
+
+    def load_nodes(self, nodes):
+        groups = defaultdict(list)
+        for node in nodes:
+            node_id = node.get('id')
+            if node_id is None:
+                self.stats.skipped['nodes'] += 1
+                continue
+            label = node.get('label') or UNLABELED_LABEL
+            if label not in self.constrained_labels:
+                self.ensure_constraints([label])
+            self.node_labels.setdefault(node_id, label)
+            groups[label].append({'id': node_id, 'properties': to_neo4j_properties(node.get('properties'))})
+            if len(groups[label]) >= self.batch_size:
+                self._flush_groups('nodes', groups, node_merge_query)
+        self._flush_groups('nodes', groups, node_merge_query, force=True)
+
+    def load_relationships(self, relationships):
+        groups = defaultdict(list)
+        query_for = lambda key: relationship_merge_query(*key)
+        for rel in relationships:
+            source_label = self.node_labels.get(rel.get('source'))
+            target_label = self.node_labels.get(rel.get('target'))
+            if not rel.get('type') or source_label is None or target_label is None:
+                self.stats.skipped['relationships'] += 1
+                continue
+            key = (rel['type'], source_label, target_label)
+            groups[key].append({'source': rel['source'], 'target': rel['target'],
+                                'properties': to_neo4j_properties(rel.get('properties'))})
+            if len(groups[key]) >= self.batch_size:
+                self._flush_groups('relationships', groups, query_for)
+        self._flush_groups('relationships', groups, query_for, force=True)
+
+
+def partition_of(node_id, partitions):
+    """稳定的 id 分区函数 (不受 PYTHONHASHSEED 影响)。"""
+    return zlib.crc32(str(node_id).encode('utf-8')) % partitions
+
+
+def partition_rounds(partitions):
+    """
+    把所有分区对 {i, j} (含 i == j) 排成若干轮，同一轮内的分区对互不相交 (循环赛排程)。
+    partitions 必须为偶数：第一轮是全部 (i, i)，之后 partitions - 1 轮各有 partitions / 2 个分区对。
+    """
+    rounds = [[(i, i) for i in range(partitions)]]
+    teams = list(range(partitions))
+    for _ in range(partitions - 1):
+        rounds.append([tuple(sorted((teams[i], teams[-1 - i]))) for i in range(partitions // 2)])
+        teams = [teams[0], teams[-1]] + teams[1:-1]
+    return rounds
+
+
+class ConcurrentGraphLoader(BatchedGraphLoader):
+    """
+    多会话并发导入器，按锁冲突的范围划分工作，避免事务之间互相等待或死锁。
+
+    节点：按 id 的哈希分成 workers 个分区，每个分区固定由一条单线程通道执行，
+    同一个 id 永远不会出现在两个并发事务中。
+
+    关系：MERGE 关系会锁住两端节点。节点最多分成 2 * workers 个分区，关系按两端所在的
+    分区对 {p(source), p(target)} 落入桶中 (先溢写到临时文件，内存占用不随关系数增长)，
+    再按 partition_rounds 的排程逐轮执行：同一轮中并发的桶涉及的节点分区互不相交，
+    因此不同会话不会争用同一个节点锁。数据量较小时会减少分区数，保证每个桶足够大。
+    残余的瞬时错误由 run_batch 自动重试。
+    """
+
+    def __init__(self, driver, batch_size=IMPORT_BATCH_SIZE, database=None, workers=4):
+        super().__init__(driver, batch_size, database)
+        self.workers = max(1, min(workers, MAX_IMPORT_WORKERS))
+
+    def load_nodes(self, nodes):
+        lanes = [ThreadPoolExecutor(max_workers=1) for _ in range(self.workers)]
+        # 限制在途批次数量，避免读取速度远快于写入时缓冲无限增长
+        in_flight = threading.BoundedSemaphore(self.workers * 2)
+        futures = []
+        groups = defaultdict(list)  # (label, 分区) -> 行
+
+        def submit(partition, statements):
+            in_flight.acquire()
+            future = lanes[partition].submit(self.run_batch, 'nodes', statements)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+
+        start = time.perf_counter()
+        try:
+            for node in nodes:
+                node_id = node.get('id')
+                if node_id is None:
+                    self.stats.skipped['nodes'] += 1
+                    continue
+                label = node.get('label') or UNLABELED_LABEL
+                if label not in self.constrained_labels:
+                    self.ensure_constraints([label])
+                self.node_labels.setdefault(node_id, label)
+                key = (label, partition_of(node_id, self.workers))
+                groups[key].append({'id': node_id, 'properties': to_neo4j_properties(node.get('properties'))})
+                if len(groups[key]) >= self.batch_size:
+                    submit(key[1], [(node_merge_query(label), groups.pop(key))])
+            # 各分区剩余的零散行按分区打包，仍由该分区的通道执行
+            for partition in range(self.workers):
+                leftovers = [(node_merge_query(label), rows) for (label, p), rows in groups.items()
+                             if p == partition and rows]
+                for batch in self.pack_statements(leftovers):
+                    submit(partition, batch)
+        finally:
+            for lane in lanes:
+                lane.shutdown(wait=True)
+        self.stats.wall_seconds['nodes'] = time.perf_counter() - start
+        for future in futures:
+            future.result()
+
+    def _load_bucket(self, bucket_paths):
+        """顺序执行一个桶中的全部关系，桶内按 (type, 源 label, 目标 label) 分批。"""
+        groups = defaultdict(list)
+        query_for = lambda key: relationship_merge_query(*key)
+        for bucket_path in bucket_paths:
+            with open(bucket_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    rel_type, source_label, target_label, row = json.loads(line)
+                    key = (rel_type, source_label, target_label)
+                    groups[key].append(row)
+                    if len(groups[key]) >= self.batch_size:
+                        self._flush_groups('relationships', groups, query_for)
+        self._flush_groups('relationships', groups, query_for, force=True)
+
+    def _choose_partitions(self, max_partitions, total_rows):
+        """
+        桶越多，每个桶越小，轮次之间的等待占比越高。
+        在 max_partitions 的偶数因子中选最大的一个，使每个桶平均至少有两批数据。
+        """
+        candidates = [p for p in range(max_partitions, 1, -1) if max_partitions % p == 0 and p % 2 == 0]
+        for partitions in candidates:
+            buckets = partitions * (partitions + 1) // 2
+            if total_rows / buckets >= self.batch_size * 2:
+                return partitions
+        return candidates[-1]
+
+    def load_relationships(self, relationships):
+        max_partitions = self.workers * 2
+        spill_dir = tempfile.mkdtemp(prefix='kg_import_rels_')
+        spill_files = {}
+        total_rows = 0
+        start = time.perf_counter()
+        try:
+            # 1. 按端点所在的细分区对溢写到文件
+            for rel in relationships:
+                source_label = self.node_labels.get(rel.get('source'))
+                target_label = self.node_labels.get(rel.get('target'))
+                if not rel.get('type') or source_label is None or target_label is None:
+                    self.stats.skipped['relationships'] += 1
+                    continue
+                pair = tuple(sorted((partition_of(rel['source'], max_partitions),
+                                     partition_of(rel['target'], max_partitions))))
+                if pair not in spill_files:
+                    spill_files[pair] = open(os.path.join(spill_dir, f"{pair[0]}_{pair[1]}.jsonl"), 'w',
+                                             encoding='utf-8')
+                row = {'source': rel['source'], 'target': rel['target'],
+                       'properties': to_neo4j_properties(rel.get('properties'))}
+                spill_files[pair].write(json.dumps([rel['type'], source_label, target_label, row],
+                                                   ensure_ascii=False) + '\n')
+                total_rows += 1
+            for f in spill_files.values():
+                f.close()
+
+            # 2. 按数据量选择实际分区数；它是细分区数的因子，
+            #    所以 partition_of(id, 细) % 粗 == partition_of(id, 粗)，可以直接合并细桶
+            partitions = self._choose_partitions(max_partitions, total_rows)
+            buckets = defaultdict(list)
+            for (i, j), f in sorted(spill_files.items()):
+                buckets[tuple(sorted((i % partitions, j % partitions)))].append(f.name)
+
+            # 3. 逐轮执行，同一轮中的桶互不共享节点分区
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for round_pairs in partition_rounds(partitions):
+                    futures = [pool.submit(self._load_bucket, buckets[pair])
+                               for pair in round_pairs if pair in buckets]
+                    for future in futures:
+                        future.result()
+        finally:
+            for f in spill_files.values():
+                f.close()
+            shutil.rmtree(spill_dir, ignore_errors=True)
+        self.stats.wall_seconds['relationships'] = time.perf_counter() - start
+
+
+def import_graph(path, driver, batch_size=IMPORT_BATCH_SIZE, database=None, workers=1):
+    """
+    将 merge_json.py 的输出导入 Neo4j：先导入全部节点，再导入全部关系。
+
+    Args:
+        path (str): merged_knowledge_graph.json 或分片目录。
+        driver: neo4j.Driver 或兼容接口的替身 (FakeNeo4jDriver)。
+        batch_size (int): 每批行数。
+        workers (int): 并发会话数，大于 1 时使用 ConcurrentGraphLoader。
+    Returns:
+        ImportStats: 导入统计。
+    """
+    if workers > 1:
+        loader = ConcurrentGraphLoader(driver, batch_size, database, workers)
+        print(f"⚙️ 并发导入: {loader.workers} 个会话")
+    else:
+        loader = BatchedGraphLoader(driver, batch_size, database)
+    # import span 的 input 与 merge_run span 的 output 相同，metrics.py --trace 据此把导入接到每本书的链路上
+    with metrics.span('import', input=path, workers=workers, batch_size=batch_size) as span:
+        print(f"📥 正在导入节点: {path}")
+        loader.load_nodes(iter_graph_source(path, 'nodes'))
+        print(f"  - ✅ 节点: {loader.stats.rows['nodes']} 行，{loader.stats.rows_per_second('nodes'):.0f} 行/秒")
+        print("🔗 正在导入关系...")
+        loader.load_relationships(iter_graph_source(path, 'relationships'))
+        print(f"  - ✅ 关系: {loader.stats.rows['relationships']} 行，"
+              f"{loader.stats.rows_per_second('relationships'):.0f} 行/秒")
+        for kind in ('nodes', 'relationships'):
+            span.attrs[f'{kind}_rows'] = loader.stats.rows[kind]
+            metrics.counter('import_rows_total', loader.stats.rows[kind], kind=kind)
+            if loader.stats.elapsed(kind):
+                metrics.observe('import_rows_per_second', loader.stats.rows_per_second(kind), kind=kind)
+    if loader.stats.skipped['relationships']:
+        print(f"  - ⚠️ 跳过 {loader.stats.skipped['relationships']} 个端点不存在或缺少类型的关系。")
+    retries = loader.stats.retries['nodes'] + loader.stats.retries['relationships']
+    if retries:
+        print(f"  - 🔁 瞬时错误 (死锁等) 重试 {retries} 次。")
+    version = stamp_graph_version(driver, database)
+    print(f"  - 🏷️ 图谱版本已更新为 {version}，rag.py 的查询结果缓存随之失效。")
+    return loader.stats
+
+
+# ================================
+# 离线替身驱动
+# ================================
+_NODE_QUERY_RE = re.compile(r"MERGE \(n:`((?:[^`]|``)+)` \{id: row\.id\}\)")
+_REL_QUERY_RE = re.compile(r"MATCH \(s:`((?:[^`]|``)+)` .*?MATCH \(t:`((?:[^`]|``)+)` .*?MERGE \(s\)-\[r:`((?:[^`]|``)+)`\]->\(t\)",
+                           re.DOTALL)
+
+
+class FakeTransientError(Exception):
+    """模拟 neo4j 的 Neo.TransientError.Transaction.DeadlockDetected。"""
+    code = 'Neo.TransientError.Transaction.DeadlockDetected'
+
+
+_READ_QUERY_RE = re.compile(r"^\s*MATCH \((\w+):`?(\w+)`?(?: \{id: '([^']*)'\})?\)\s+RETURN ((?:\1\.\w+ AS \w+(?:,\s*)?)+)"
+                            r"(?:\s+LIMIT (\d+))?\s*$")
+_RETURN_ITEM_RE = re.compile(r"\w+\.(\w+) AS (\w+)")
+
+
+class _FakeResult:
+    def __init__(self, records=()):
+        self.records = list(records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def single(self):
+        return self.records[0] if self.records else None
+
+    def data(self):
+        return [dict(record) for record in self.records]
+
+    def consume(self):
+        return None
+
+
+class _FakeTransaction:
+    def __init__(self, driver):
+        self.driver = driver
+        self.statements = []
+
+    def run(self, query, parameters=None, **kwargs):
+        if _READ_QUERY_RE.match(query):
+            return self.driver.read(query)
+        params = dict(parameters or {}, **kwargs)
+        self.statements.append((query, params.get('rows', [])))
+        return _FakeResult()
+
+
+class FakeNeo4jSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def close(self):
+        pass
+
+    def run(self, query, parameters=None, **kwargs):
+        if _READ_QUERY_RE.match(query):
+            return self.driver.read(query)
+        params = dict(parameters or {}, **kwargs)
+        self.driver.commit([(query, params.get('rows', []))])
+        return _FakeResult()
+
+    def execute_write(self, fn, *args, **kwargs):
+        tx = _FakeTransaction(self.driver)
+        result = fn(tx, *args, **kwargs)
+        self.driver.commit(tx.statements)
+        return result
+
+    execute_read = execute_write
+
+
+class FakeNeo4jDriver:
+    """
+    不依赖数据库的 neo4j 驱动替身，理解本模块生成的 MERGE 语句并在内存中保存图，
+    可以模拟每次请求的网络延迟。用于离线测试导入逻辑和测量客户端侧的吞吐量。
+    读查询只支持 "MATCH (n:Label [{id: '...'}]) RETURN n.prop AS name, ... [LIMIT k]" 这一种形式，
+    足够读取图谱版本号和离线演示 rag.py；其他读查询返回空结果。
+
+    替身会像数据库一样在事务期间"锁住"涉及的节点 id：如果两个并发事务碰到同一个节点，
+    后到的一方抛出 FakeTransientError 并计入 lock_conflicts，可用于验证分区策略；
+    deadlock_rate 可额外随机注入瞬时错误以测试重试。
+    """
+
+    def __init__(self, latency=0.0, deadlock_rate=0.0):
+        self.latency = latency
+        self.deadlock_rate = deadlock_rate
+        self.nodes = {}          # (label, id) -> properties
+        self.relationships = {}  # (source, type, target) -> properties
+        self.queries = 0
+        self.lock_conflicts = 0
+        self._locked = set()
+        self._lock = threading.Lock()
+
+    def session(self, **kwargs):
+        return FakeNeo4jSession(self)
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _touched_ids(statements):
+        touched = set()
+        for _, rows in statements:
+            for row in rows:
+                for key in ('id', 'source', 'target'):
+                    if key in row:
+                        touched.add(row[key])
+        return touched
+
+    def commit(self, statements):
+        """模拟一个写事务：加锁 -> 等待延迟 (每个事务一次) -> 写入内存图 -> 释放锁。"""
+        touched = self._touched_ids(statements)
+        with self._lock:
+            if touched & self._locked:
+                self.lock_conflicts += 1
+                raise FakeTransientError("模拟死锁：节点正被其他事务锁定")
+            if self.deadlock_rate and random.random() < self.deadlock_rate:
+                raise FakeTransientError("模拟随机死锁")
+            self._locked |= touched
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            with self._lock:
+                for query, rows in statements:
+                    self.apply(query, rows)
+        finally:
+            with self._lock:
+                self._locked -= touched
+
+    def read(self, query):
+        match = _READ_QUERY_RE.match(query)
+        if not match:
+            return _FakeResult()
+        _, label, node_id, returns, limit = match.groups()
+        columns = _RETURN_ITEM_RE.findall(returns)
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.queries += 1
+            matched = [props for (node_label, key), props in self.nodes.items()
+                       if node_label == label and (node_id is None or key == node_id)]
+        records = [{alias: props.get(prop) for prop, alias in columns} for props in matched]
+        return _FakeResult(records[:int(limit)] if limit else records)
+
+    def apply(self, query, rows):
+        self.queries += 1
+        node_match = _NODE_QUERY_RE.search(query)
+        if node_match:
+            label = node_match.group(1).replace('``', '`')
+            for row in rows:
+                self.nodes.setdefault((label, row['id']), {}).update(row['properties'])
+            return
+        rel_match = _REL_QUERY_RE.search(query)
+        if rel_match:
+            source_label, target_label, rel_type = (g.replace('``', '`') for g in rel_match.groups())
+            for row in rows:
+                if (source_label, row['source']) in self.nodes and (target_label, row['target']) in self.nodes:
+                    self.relationships.setdefault((row['source'], rel_type, row['target']), {}).update(
+                        row['properties'])
+
+
+def open_driver(uri=NEO4J_URI, user=NEO4J_USER, password=NEO4J_PASSWORD, fake=False, fake_latency=0.0,
+                fake_deadlock_rate=0.0, workers=1, pool_size=None):
+    """pool_size 为连接池大小；不指定时按并发会话数估算 (至少 100)。"""
+    if fake:
+        return FakeNeo4jDriver(latency=fake_latency, deadlock_rate=fake_deadlock_rate)
+    # 只有真正连接数据库时才需要安装 neo4j 驱动
+    from neo4j import GraphDatabase
+    return GraphDatabase.driver(uri, auth=(user, password),
+                                max_connection_pool_size=pool_size or max(100, workers * 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用 UNWIND 批量 MERGE 将合并后的知识图谱导入 Neo4j")
+    parser.add_argument('--input', default='merged_knowledge_graph.json', help="合并后的 JSON 文件或分片目录")
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help="每个事务的行数")
+    parser.add_argument('--uri', default=NEO4J_URI)
+    parser.add_argument('--user', default=NEO4J_USER)
+    parser.add_argument('--password', default=NEO4J_PASSWORD)
+    parser.add_argument('--database', default=None)
+    parser.add_argument('--fake', action='store_true', help="使用内存替身驱动，不连接数据库")
+    parser.add_argument('--fake-latency', type=float, default=0.0, help="替身驱动每次请求的模拟延迟 (秒)")
+    parser.add_argument('--fake-deadlock-rate', type=float, default=0.0, help="替身驱动随机注入死锁的概率")
+    parser.add_argument('--workers', type=int, default=1, help=f"并发会话数 (上限 {MAX_IMPORT_WORKERS})")
+    args = parser.parse_args()
+
+    driver = open_driver(args.uri, args.user, args.password, args.fake, args.fake_latency,
+                         args.fake_deadlock_rate, args.workers)
+    try:
+        stats = import_graph(args.input, driver, args.batch_size, args.database, args.workers)
+        print("\n📊 导入统计:")
+        print(json.dumps(stats.as_dict(), ensure_ascii=False, indent=2))
+        if isinstance(driver, FakeNeo4jDriver):
+            print(f"  - 替身驱动: {len(driver.nodes)} 个节点，{len(driver.relationships)} 个关系，"
+                  f"锁冲突 {driver.lock_conflicts} 次。")
+    finally:
+        driver.close()
+
+
+if __name__ == "__main__":
+    main()
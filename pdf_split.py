@@ -0,0 +1,376 @@
+import os
+import json
+import math
+import shutil
+import argparse
+import tempfile
+
+from pypdf import PdfReader, PdfWriter
+
+from batch_packing import MAX_PDF_BYTES, MAX_PDF_PAGES, MAX_REQUEST_TOKENS, TOKENS_PER_PAGE, estimate_pdf
+from entity_dedup import GraphDeduplicator
+from merge_json import StreamingGraphWriter
+from state_store import StateStore
+
+# ================================
+# 配置区
+# ================================
+# 每个分卷的最大页数，低于 MAX_PDF_PAGES 留出余量 (提示词与输出也占 token)
+SPLIT_MAX_PAGES = 800
+# 相邻分卷重叠的页数，跨页的段落、表格在两边都能被完整读到
+SPLIT_OVERLAP_PAGES = 2
+# 分卷写在 PDF 目录下的子目录中，状态中的文件名为 "parts/<书名>.p0001-0800.pdf"
+SPLIT_PARTS_DIR = "parts"
+# 分片抽取模式 (--chunk-pages)：每个片段的最大页数与固定窗口之间的重叠页数；
+# 有书签时按顶层章节切分，只有超过窗口的章节才按固定窗口再切
+CHUNK_PAGES = 50
+CHUNK_OVERLAP_PAGES = 1
+# error_process.py 归档超限书籍的目录，--recover 时从这里取回
+OVERSIZED_FOLDER = "files_oversized"
+PDF_SOURCE_FOLDER = "data"
+OUTPUT_FOLDER = "json"
+
+
+def plan_page_ranges(page_count, max_pages=SPLIT_MAX_PAGES, overlap=SPLIT_OVERLAP_PAGES):
+    """
+    把 1..page_count 切成若干个不超过 max_pages 页的区间 (从 1 开始、含两端)，
+    相邻区间重叠 overlap 页，各区间页数尽量相等。
+    """
+    if page_count <= max_pages:
+        return [(1, page_count)]
+    overlap = max(0, min(overlap, max_pages // 2))
+    count = math.ceil((page_count - overlap) / (max_pages - overlap))
+    span = math.ceil((page_count + (count - 1) * overlap) / count)
+    ranges = []
+    start = 1
+    while True:
+        end = min(page_count, start + span - 1)
+        ranges.append((start, end))
+        if end >= page_count:
+            return ranges
+        start = end - overlap + 1
+
+
+def max_pages_per_part(page_count, size_bytes, max_pages=SPLIT_MAX_PAGES):
+    """同时满足页数、token、文件大小三项限制的每卷页数 (按页平均大小估算)。"""
+    limit = min(max_pages, MAX_PDF_PAGES, MAX_REQUEST_TOKENS // TOKENS_PER_PAGE)
+    if size_bytes > MAX_PDF_BYTES * 0.9 and page_count:
+        limit = min(limit, int(page_count * MAX_PDF_BYTES * 0.9 / size_bytes))
+    return max(1, limit)
+
+
+def part_filename(pdf_file, start, end):
+    stem = os.path.splitext(os.path.basename(pdf_file))[0]
+    return f"{SPLIT_PARTS_DIR}/{stem}.p{start:04d}-{end:04d}.pdf"
+
+
+def chapter_starts(reader):
+    """PDF 顶层书签 (章节) 的起始页码 (从 1 开始、升序去重)；没有书签或书签无法解析时返回空列表。"""
+    try:
+        outline = reader.outline
+    except Exception:
+        return []
+    starts = set()
+    for item in outline:
+        # 嵌套列表是上一个书签的子书签，只取顶层
+        if isinstance(item, list):
+            continue
+        try:
+            page = reader.get_destination_page_number(item)
+        except Exception:
+            continue
+        if page is not None and page >= 0:
+            starts.add(page + 1)
+    return sorted(starts)
+
+
+def plan_chunk_ranges(page_count, starts, window=CHUNK_PAGES, overlap=CHUNK_OVERLAP_PAGES):
+    """
+    把一本书切成不超过 window 页的片段：有章节起始页时把相邻的短章节合并进同一个片段，
+    片段边界都落在章节开头；单个章节超过 window 时在章内按固定窗口 (带 overlap) 再切。
+    没有章节信息时整本书按固定窗口切。
+    """
+    if page_count <= window:
+        return [(1, page_count)]
+    starts = [p for p in starts if 1 < p <= page_count]
+    if not starts:
+        return plan_page_ranges(page_count, window, overlap)
+    chapters = list(zip([1] + starts, [p - 1 for p in starts] + [page_count]))
+    ranges = []
+    current = None
+    for start, end in chapters:
+        if end - start + 1 > window:
+            if current:
+                ranges.append(current)
+                current = None
+            ranges += [(start + s - 1, start + e - 1) for s, e in plan_page_ranges(end - start + 1, window, overlap)]
+        elif current and end - current[0] + 1 <= window:
+            current = (current[0], end)
+        else:
+            if current:
+                ranges.append(current)
+            current = (start, end)
+    if current:
+        ranges.append(current)
+    return ranges
+
+
+def split_pdf(path, ranges, pdf_folder, pdf_file, reader=None):
+    """按页码区间写出分卷，返回分卷在状态中的文件名列表。已存在的分卷不重复生成。"""
+    reader = reader or PdfReader(path)
+    names = []
+    for start, end in ranges:
+        name = part_filename(pdf_file, start, end)
+        part_path = os.path.join(pdf_folder, name)
+        names.append(name)
+        if os.path.exists(part_path):
+            continue
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        writer = PdfWriter()
+        for index in range(start - 1, end):
+            writer.add_page(reader.pages[index])
+        # 先写临时文件再改名，中途中断不会留下半个分卷
+        with open(part_path + '.tmp', 'wb') as f:
+            writer.write(f)
+        os.replace(part_path + '.tmp', part_path)
+    return names
+
+
+def split_oversized(state, pdf_folder, max_pages=SPLIT_MAX_PAGES, overlap=SPLIT_OVERLAP_PAGES):
+    """
+    拆分状态为 needs_split 的书：分卷作为新的 pending_upload 条目进入批处理流程，
+    原书状态改为 split 并记录分卷列表，等全部分卷完成后由 stitch_completed_books 拼接。
+    返回 {书名: 分卷数}。
+    """
+    result = {}
+    for pdf_file, entry in state.by_status('needs_split').items():
+        path = os.path.join(pdf_folder, pdf_file)
+        if not os.path.exists(path):
+            print(f"  - ⚠️ 警告：待拆分的文件不存在: {path}")
+            continue
+        if 'size_bytes' not in entry:
+            estimate = estimate_pdf(path)
+            estimate.pop('oversized')
+            entry.update(estimate)
+        try:
+            # 状态里的 page_count 只是估算 (可能来自文件大小)，分卷区间必须按实际页数规划
+            reader = PdfReader(path)
+            entry['page_count'] = len(reader.pages)
+            limit = max_pages_per_part(entry['page_count'], entry['size_bytes'], max_pages)
+            if entry['page_count'] <= limit:
+                # 本地估算没有超限、但 API 仍然拒绝 (token 估算偏小)，至少拆成两卷
+                limit = max(1, math.ceil(entry['page_count'] / 2))
+            ranges = plan_page_ranges(entry['page_count'], limit, overlap)
+            parts = split_pdf(path, ranges, pdf_folder, pdf_file, reader)
+        except Exception as e:
+            state.update(pdf_file, status='failed_split', error=f"拆分失败: {e}")
+            print(f"  - ❌ 拆分 '{pdf_file}' 失败: {e}")
+            continue
+        register_parts(state, pdf_folder, pdf_file, entry, parts, ranges)
+        result[pdf_file] = len(parts)
+        print(f"  - ✂️ '{pdf_file}' ({entry['page_count']} 页) 已拆分为 {len(parts)} 卷: "
+              f"{', '.join(f'{s}-{e}' for s, e in ranges)}")
+    return result
+
+
+def register_parts(state, pdf_folder, pdf_file, entry, parts, ranges, **fields):
+    """分卷作为新的 pending_upload 条目加入状态，原书改为 split 并记录分卷列表。"""
+    for part, (start, end) in zip(parts, ranges):
+        estimate = estimate_pdf(os.path.join(pdf_folder, part))
+        estimate.pop('oversized')
+        state.set(part, {'status': 'pending_upload', 'parent': pdf_file, 'page_start': start, 'page_end': end,
+                         **estimate})
+    state.update(pdf_file, status='split', parts=parts, page_count=entry['page_count'],
+                 size_bytes=entry['size_bytes'], **fields)
+
+
+def chunk_pending_books(state, pdf_folder, window=CHUNK_PAGES, overlap=CHUNK_OVERLAP_PAGES):
+    """
+    分片抽取模式：把待上传的整本书 (不含已经是分卷的条目) 按章节或页码窗口切成片段，
+    每个片段是同一批处理作业里的一个独立请求，单个请求的输出长度和耗时有上限，失败时只重跑一个片段。
+    全部片段完成后由 stitch_completed_books 按 id 与规范化名称合并为整本书的图谱。
+    不超过 window 页的书保持整本处理。返回 {书名: 片段数}。
+    """
+    result = {}
+    for pdf_file, entry in state.by_status('pending_upload').items():
+        if entry.get('parent'):
+            continue
+        path = os.path.join(pdf_folder, pdf_file)
+        if not os.path.exists(path):
+            continue
+        if 'page_count' not in entry:
+            estimate = estimate_pdf(path)
+            estimate.pop('oversized')
+            entry.update(estimate)
+        if entry['page_count'] <= window:
+            continue
+        try:
+            reader = PdfReader(path)
+            entry['page_count'] = len(reader.pages)
+            ranges = plan_chunk_ranges(entry['page_count'], chapter_starts(reader), window, overlap)
+            parts = split_pdf(path, ranges, pdf_folder, pdf_file, reader)
+        except Exception as e:
+            # 无法切分的书 (加密、损坏) 仍按整本提交
+            print(f"  - ⚠️ 无法切分 '{pdf_file}'，按整本处理: {e}")
+            continue
+        register_parts(state, pdf_folder, pdf_file, entry, parts, ranges, chunked=True)
+        result[pdf_file] = len(parts)
+        print(f"  - 📑 '{pdf_file}' ({entry['page_count']} 页) 切分为 {len(parts)} 个片段: "
+              f"{', '.join(f'{s}-{e}' for s, e in ranges)}")
+    return result
+
+
+def chunk_context(pdf_file, entry):
+    """片段请求附加的说明：告诉模型这是哪本书的哪几页，实体 id 要按 Schema 规则由规范名称生成，便于与其他片段合并。"""
+    parent = entry.get('parent')
+    if not parent:
+        return None
+    title = os.path.splitext(os.path.basename(parent))[0]
+    return (f"注意：本 PDF 是《{title}》第 {entry['page_start']}-{entry['page_end']} 页的片段，"
+            f"只需抽取这些页面中的内容。同一实体在其他片段中也会出现，"
+            f"请严格按 Schema 的 id 规则由实体的规范名称生成 id，不要使用与页码或片段相关的 id。")
+
+
+def stitch_book(state, pdf_file, output_folder):
+    """
+    把一本书各分卷的图谱 JSON 合并为整本书的 JSON：同一 id / 同名实体按 entity_dedup 的规则合并，
+    每个节点和关系的 properties.source_pages 记录它出现在哪些页码区间。
+    分卷尚未全部完成时返回 False。
+    """
+    entry = state.get(pdf_file)
+    parts = [(part, state.get(part, {})) for part in entry.get('parts', [])]
+    if not parts or any(part_entry.get('status') != 'completed' for _, part_entry in parts):
+        return False
+
+    dedup = GraphDeduplicator()
+    for part, part_entry in parts:
+        pages = f"{part_entry['page_start']}-{part_entry['page_end']}"
+        with open(part_entry['output_path'], 'r', encoding='utf-8') as f:
+            graph = json.load(f)
+        for section, add in (('nodes', dedup.add_node), ('relationships', dedup.add_relationship)):
+            for item in graph.get(section) or []:
+                if not isinstance(item, dict):
+                    continue
+                properties = item.get('properties')
+                if not isinstance(properties, dict):
+                    properties = item['properties'] = {}
+                properties['source_pages'] = [pages]
+                add(item)
+
+    output_path = os.path.join(output_folder, os.path.splitext(pdf_file)[0] + ".json")
+    writer = StreamingGraphWriter(output_path + '.tmp')
+    dedup.flush(writer)
+    writer.close()
+    os.replace(output_path + '.tmp', output_path)
+    state.update(pdf_file, status='completed', output_path=output_path)
+    summary = dedup.summary()
+    print(f"  - 🧵 已拼接 '{pdf_file}' 的 {len(parts)} 个分卷: {writer.node_count} 个节点、"
+          f"{writer.rel_count} 条关系 (合并 {summary['input_nodes'] - summary['unique_nodes']} 个重复实体) -> {output_path}")
+    return True
+
+
+def stitch_completed_books(state, output_folder):
+    """拼接所有分卷都已完成的书，返回拼接的数量。分卷失败的书保持 split 状态，等分卷重试。"""
+    stitched = 0
+    for pdf_file in state.by_status('split'):
+        try:
+            stitched += stitch_book(state, pdf_file, output_folder)
+        except (OSError, KeyError, json.JSONDecodeError) as e:
+            print(f"  - ❌ 拼接 '{pdf_file}' 失败: {e}")
+    return stitched
+
+
+def recover_quarantined(state, pdf_folder, quarantine_folder=OVERSIZED_FOLDER):
+    """把以前归档到 files_oversized 的书移回 PDF 目录并标记为 needs_split。"""
+    if not os.path.isdir(quarantine_folder):
+        return []
+    recovered = []
+    for pdf_file in sorted(f for f in os.listdir(quarantine_folder) if f.lower().endswith('.pdf')):
+        shutil.move(os.path.join(quarantine_folder, pdf_file), os.path.join(pdf_folder, pdf_file))
+        state.set(pdf_file, {'status': 'needs_split'})
+        recovered.append(pdf_file)
+        print(f"  - ♻️ 已取回 '{pdf_file}'，等待拆分。")
+    return recovered
+
+
+# ================================
+# 离线演示
+# ================================
+def write_blank_pdf(path, pages, chapters=()):
+    """chapters 为顶层书签的起始页码 (从 1 开始)。"""
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=612, height=792)
+    for number, page in enumerate(chapters, start=1):
+        writer.add_outline_item(f"第 {number} 章", page - 1)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+def demo(pages, max_pages, overlap, chunk_pages=0):
+    """
+    生成一本空白大书，拆分后为每个分卷伪造图谱 JSON，再拼接回整本书。
+    chunk_pages 大于 0 时演示分片抽取：书中带有长短不一的章节书签，按章节切分。
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        pdf_folder = os.path.join(folder, 'data')
+        output_folder = os.path.join(folder, 'json')
+        os.makedirs(pdf_folder)
+        os.makedirs(output_folder)
+        chapters = sorted({1 + int(pages * f) for f in (0.0, 0.1, 0.18, 0.2, 0.5, 0.83)}) if chunk_pages else ()
+        write_blank_pdf(os.path.join(pdf_folder, 'big_book.pdf'), pages, chapters)
+        with StateStore(os.path.join(folder, 'state.db'), legacy_json=None) as state:
+            if chunk_pages:
+                print(f"  章节起始页: {', '.join(map(str, chapters))}")
+                state.set('big_book.pdf', {'status': 'pending_upload'})
+                chunk_pending_books(state, pdf_folder, chunk_pages, overlap)
+            else:
+                state.set('big_book.pdf', {'status': 'needs_split'})
+                split_oversized(state, pdf_folder, max_pages, overlap)
+            for part, entry in state.by_status('pending_upload').items():
+                assert len(PdfReader(os.path.join(pdf_folder, part)).pages) == entry['page_end'] - entry['page_start'] + 1
+                # 每卷都提到同一种合金，另有一个只在本卷出现的概念
+                graph = {'nodes': [{'id': 'alloy_inconel_718', 'label': 'Alloy',
+                                    'properties': {'name': 'Inconel 718'}},
+                                   {'id': f"concept_{entry['page_start']}", 'label': 'Concept',
+                                    'properties': {'name': f"第 {entry['page_start']} 页起的概念"}}],
+                         'relationships': [{'source': 'alloy_inconel_718', 'target': f"concept_{entry['page_start']}",
+                                            'type': 'RELATED_TO', 'properties': {'context': '...'}}]}
+                output_path = os.path.join(output_folder, os.path.splitext(part)[0] + '.json')
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    json.dump(graph, f, ensure_ascii=False)
+                state.update(part, status='completed', output_path=output_path)
+            stitch_completed_books(state, output_folder)
+            with open(state.get('big_book.pdf')['output_path'], 'r', encoding='utf-8') as f:
+                book = json.load(f)
+        for node in book['nodes']:
+            print(f"    {node['id']}: source_pages={node['properties']['source_pages']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按页码区间拆分超限的 PDF，并把各分卷的图谱 JSON 拼接回整本书")
+    parser.add_argument('--pdf-folder', default=PDF_SOURCE_FOLDER)
+    parser.add_argument('--output-folder', default=OUTPUT_FOLDER)
+    parser.add_argument('--max-pages', type=int, default=SPLIT_MAX_PAGES, help="每个分卷的最大页数")
+    parser.add_argument('--overlap', type=int, default=SPLIT_OVERLAP_PAGES, help="相邻分卷重叠的页数")
+    parser.add_argument('--recover', action='store_true', help=f"先把 {OVERSIZED_FOLDER} 中归档的书取回并拆分")
+    parser.add_argument('--demo', type=int, default=0, metavar='PAGES', help="用一本指定页数的空白书离线演示")
+    parser.add_argument('--chunk-pages', type=int, default=0, metavar='PAGES',
+                        help=f"配合 --demo 演示按章节切分的分片抽取 (建议 {CHUNK_PAGES})")
+    args = parser.parse_args()
+
+    if args.demo:
+        demo(args.demo, args.max_pages, args.overlap, args.chunk_pages)
+        return
+
+    with StateStore() as state:
+        if args.recover:
+            recover_quarantined(state, args.pdf_folder)
+        split = split_oversized(state, args.pdf_folder, args.max_pages, args.overlap)
+        stitched = stitch_completed_books(state, args.output_folder)
+    print(f"✅ 拆分 {len(split)} 本书，拼接 {stitched} 本书。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from batch_packing import BATCH_MAX_TOKENS
+from job_scheduler import TERMINAL_JOB_STATES, POLL_MIN_SECONDS, POLL_MAX_SECONDS, FakeBatchJob, JobPollScheduler
+
+# ================================
+# 配置区
+# ================================
+# 每个批处理作业包含的 PDF 数量 (与 gemini_json_batch.BATCH_SIZE 相同)
+PIPELINE_BATCH_SIZE = 20
+# 并发上传数、并发解析结果数
+PIPELINE_UPLOAD_WORKERS = 4
+PIPELINE_PARSE_WORKERS = 2
+# 各阶段之间队列的容量，上游过快时会在此处等待
+PIPELINE_QUEUE_SIZE = 64
+
+_DONE = object()
+
+
+class BatchPipeline:
+    """
+    upload -> batch -> poll -> parse 四个阶段用有界 asyncio 队列串成流水线：
+
+      - 上传协程 (upload_workers 个) 从待上传队列取文件，上传成功的文件进入批次队列；
+      - 打包协程凑满 batch_size 个文件、或再加一个文件就超出 max_tokens 时立即创建作业，
+        上游全部结束时提交剩余的不满一批的文件；
+      - 轮询协程驱动一个 JobPollScheduler (与分阶段执行相同的自适应间隔、超时与耗时记录)，
+        新建的作业随时加入，到期的作业在线程中查询，结束后放入解析队列；
+      - 解析协程 (parse_workers 个) 下载并解析结果，与新的上传、轮询同时进行。
+
+    SDK 调用和状态库 (sqlite) 读写都是阻塞的，统一放到独立的线程池中执行 (相当于 asyncio.to_thread)，
+    事件循环中不做任何阻塞调用。端到端耗时接近最慢的单个阶段，而不是各阶段之和。
+
+    stages 需要提供以下方法 (都是同步函数)：
+        upload(pdf_file) -> bool                 上传并更新状态
+        estimate_tokens(pdf_file) -> int         该文件请求的输入 token 估算
+        create_job(files) -> job_name | None     为一组已上传的文件创建批处理作业
+        get_job(job_name) -> job                 查询作业
+        process_job(job)                         作业结束后的处理 (成功时下载并解析结果)
+        on_timeout(job_name)                     作业超时
+        on_poll_error(job_name, e) -> bool       查询出错，返回 True 表示不再跟踪
+        record_durations(durations)              保存作业耗时历史
+    """
+
+    def __init__(self, stages, batch_size=PIPELINE_BATCH_SIZE, max_tokens=BATCH_MAX_TOKENS,
+                 upload_workers=PIPELINE_UPLOAD_WORKERS,
+                 parse_workers=PIPELINE_PARSE_WORKERS, queue_size=PIPELINE_QUEUE_SIZE, durations=None,
+                 timeout_seconds=8 * 60 * 60, min_poll_seconds=POLL_MIN_SECONDS, max_poll_seconds=POLL_MAX_SECONDS):
+        self.stages = stages
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.upload_workers = upload_workers
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size
+        self._finished = []
+        self.scheduler = JobPollScheduler(stages.get_job, self._finished.append, stages.on_timeout,
+                                          stages.on_poll_error, durations=durations,
+                                          timeout_seconds=timeout_seconds, verbose=False,
+                                          min_poll_seconds=min_poll_seconds, max_poll_seconds=max_poll_seconds)
+        self.stats = {'uploaded': 0, 'failed_uploads': 0, 'jobs_created': 0, 'jobs_finished': 0, 'polls': 0}
+
+    async def _call(self, fn, *args):
+        """在线程池中执行阻塞调用 (SDK 请求、状态库读写)。"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # ---------- 各阶段 ----------
+    async def _feed(self, queue, items, sentinels):
+        for item in items:
+            await queue.put(item)
+        for _ in range(sentinels):
+            await queue.put(_DONE)
+
+    async def _upload_worker(self, upload_queue, batch_queue):
+        while True:
+            pdf_file = await upload_queue.get()
+            if pdf_file is _DONE:
+                return
+            if await self._call(self.stages.upload, pdf_file):
+                self.stats['uploaded'] += 1
+                await batch_queue.put(pdf_file)
+            else:
+                self.stats['failed_uploads'] += 1
+
+    async def _upload_stage(self, pending_uploads, uploaded, batch_queue):
+        upload_queue = asyncio.Queue(self.queue_size)
+        workers = [asyncio.create_task(self._upload_worker(upload_queue, batch_queue))
+                   for _ in range(self.upload_workers)]
+        # 上次运行已上传但未提交作业的文件直接进入批次队列
+        await asyncio.gather(self._feed(batch_queue, uploaded, 0),
+                             self._feed(upload_queue, pending_uploads, self.upload_workers), *workers)
+        await batch_queue.put(_DONE)
+
+    def _track(self, job_name):
+        self.scheduler.add(job_name)
+        self._job_added.set()
+
+    async def _submit(self, files):
+        job_name = await self._call(self.stages.create_job, files)
+        if job_name:
+            self.stats['jobs_created'] += 1
+            self._track(job_name)
+
+    async def _batch_stage(self, batch_queue, processing_jobs):
+        for job_name in processing_jobs:
+            self._track(job_name)
+        chunk, chunk_tokens = [], 0
+        while True:
+            pdf_file = await batch_queue.get()
+            if pdf_file is _DONE:
+                break
+            tokens = await self._call(self.stages.estimate_tokens, pdf_file)
+            if chunk and chunk_tokens + tokens > self.max_tokens:
+                await self._submit(chunk)
+                chunk, chunk_tokens = [], 0
+            chunk.append(pdf_file)
+            chunk_tokens += tokens
+            if len(chunk) >= self.batch_size:
+                await self._submit(chunk)
+                chunk, chunk_tokens = [], 0
+        if chunk:
+            await self._submit(chunk)
+        self._submitting = False
+        self._job_added.set()
+
+    async def _poll_stage(self, parse_queue):
+        """等到最早到期的作业 (或有新作业加入) 时醒来，逐个轮询到期的作业，结束的作业进入解析队列。"""
+        while True:
+            due = self.scheduler.next_due()
+            if due is None and not self._submitting:
+                break
+            delay = None if due is None else due - time.time()
+            if delay is None or delay > 0:
+                self._job_added.clear()
+                try:
+                    await asyncio.wait_for(self._job_added.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._call(self.scheduler.poll_job, self.scheduler.pop_due())
+            self.stats['polls'] = self.scheduler.poll_count
+            while self._finished:
+                await parse_queue.put(self._finished.pop(0))
+        for _ in range(self.parse_workers):
+            await parse_queue.put(_DONE)
+
+    async def _parse_worker(self, parse_queue):
+        while True:
+            job = await parse_queue.get()
+            if job is _DONE:
+                return
+            await self._call(self.stages.process_job, job)
+            self.stats['jobs_finished'] += 1
+            await self._call(self.stages.record_durations, list(self.scheduler.model.durations))
+
+    async def run(self, pending_uploads=(), uploaded=(), processing_jobs=()):
+        """
+        pending_uploads: 待上传的文件；uploaded: 已上传、尚未提交作业的文件；
+        processing_jobs: 上次运行留下的、仍在处理中的作业名。返回统计信息。
+        """
+        self._executor = ThreadPoolExecutor(max_workers=self.upload_workers + self.parse_workers + 2)
+        self._job_added = asyncio.Event()
+        self._submitting = True
+        try:
+            batch_queue = asyncio.Queue(self.queue_size)
+            parse_queue = asyncio.Queue(self.queue_size)
+            await asyncio.gather(
+                self._upload_stage(list(pending_uploads), list(uploaded), batch_queue),
+                self._batch_stage(batch_queue, list(processing_jobs)),
+                self._poll_stage(parse_queue),
+                *[self._parse_worker(parse_queue) for _ in range(self.parse_workers)])
+        finally:
+            self._executor.shutdown(wait=True)
+        return dict(self.stats)
+
+
+# ================================
+# 离线模拟
+# ================================
+class FakePipelineStages:
+    """
+    用 sleep 模拟各阶段耗时的替身：上传每个文件 upload_seconds，
+    作业耗时 job_base_seconds + 每个文件 job_seconds_per_file，解析每个作业 parse_seconds。
+    """
+
+    def __init__(self, upload_seconds=0.2, job_base_seconds=1.0, job_seconds_per_file=0.05, parse_seconds=0.3):
+        self.upload_seconds = upload_seconds
+        self.job_base_seconds = job_base_seconds
+        self.job_seconds_per_file = job_seconds_per_file
+        self.parse_seconds = parse_seconds
+        self.jobs = {}
+        self.processed_files = 0
+
+    def upload(self, pdf_file):
+        time.sleep(self.upload_seconds)
+        return True
+
+    def estimate_tokens(self, pdf_file):
+        return 0
+
+    def create_job(self, files):
+        name = f"batches/fake-{len(self.jobs) + 1}"
+        self.jobs[name] = (time.time(), self.job_base_seconds + self.job_seconds_per_file * len(files), len(files))
+        return name
+
+    def get_job(self, job_name):
+        created, duration, _ = self.jobs[job_name]
+        create_time = datetime.fromtimestamp(created, timezone.utc)
+        if time.time() - created >= duration:
+            return FakeBatchJob(job_name, 'JOB_STATE_SUCCEEDED', create_time,
+                                datetime.fromtimestamp(created + duration, timezone.utc))
+        return FakeBatchJob(job_name, 'JOB_STATE_RUNNING', create_time)
+
+    def process_job(self, job):
+        time.sleep(self.parse_seconds)
+        self.processed_files += self.jobs[job.name][2]
+
+    def on_timeout(self, job_name):
+        pass
+
+    def on_poll_error(self, job_name, e):
+        return True
+
+    def record_durations(self, durations):
+        pass
+
+
+def run_sequential(stages, files, batch_size, upload_workers, poll_seconds):
+    """按原来的顺序执行：全部上传 -> 全部建作业 -> 轮询到全部结束 -> 逐个解析。"""
+    with ThreadPoolExecutor(max_workers=upload_workers) as pool:
+        uploaded = [f for f, ok in zip(files, pool.map(stages.upload, files)) if ok]
+    jobs = [stages.create_job(uploaded[i:i + batch_size]) for i in range(0, len(uploaded), batch_size)]
+    finished = []
+    while jobs:
+        time.sleep(poll_seconds)
+        for job_name in list(jobs):
+            job = stages.get_job(job_name)
+            if job.state.name in TERMINAL_JOB_STATES:
+                jobs.remove(job_name)
+                finished.append(job)
+    for job in finished:
+        stages.process_job(job)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用替身阶段比较顺序执行与流水线执行的端到端耗时")
+    parser.add_argument('--files', type=int, default=100, help="模拟的 PDF 数量")
+    parser.add_argument('--batch-size', type=int, default=PIPELINE_BATCH_SIZE)
+    parser.add_argument('--upload-workers', type=int, default=PIPELINE_UPLOAD_WORKERS)
+    parser.add_argument('--upload-seconds', type=float, default=0.1, help="每个文件的上传耗时")
+    parser.add_argument('--job-seconds', type=float, default=2.0, help="每个作业的基础耗时")
+    parser.add_argument('--parse-seconds', type=float, default=0.5, help="每个作业结果的解析耗时")
+    parser.add_argument('--poll-seconds', type=float, default=0.2, help="模拟中的轮询间隔下限")
+    args = parser.parse_args()
+
+    files = [f"book_{i:04d}.pdf" for i in range(args.files)]
+
+    stages = FakePipelineStages(args.upload_seconds, args.job_seconds, 0.0, args.parse_seconds)
+    start = time.perf_counter()
+    run_sequential(stages, files, args.batch_size, args.upload_workers, args.poll_seconds)
+    sequential = time.perf_counter() - start
+    print(f"顺序执行: {sequential:.2f}s，处理 {stages.processed_files} 个文件")
+
+    stages = FakePipelineStages(args.upload_seconds, args.job_seconds, 0.0, args.parse_seconds)
+    pipeline = BatchPipeline(stages, args.batch_size, upload_workers=args.upload_workers,
+                             min_poll_seconds=args.poll_seconds, max_poll_seconds=args.poll_seconds * 4)
+    start = time.perf_counter()
+    stats = asyncio.run(pipeline.run(pending_uploads=files))
+    pipelined = time.perf_counter() - start
+    print(f"流水线:   {pipelined:.2f}s，处理 {stages.processed_files} 个文件，统计: {stats}")
+
+    upload_stage = args.files / args.upload_workers * args.upload_seconds
+    print(f"单阶段下限参考：上传 {upload_stage:.2f}s，单个作业 {args.job_seconds:.2f}s，"
+          f"解析 {args.parse_seconds * -(-args.files // args.batch_size):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import os
+import json
+import hashlib
+import argparse
+import tempfile
+import threading
+import functools
+from datetime import datetime, timedelta, timezone
+
+from batch_packing import estimate_text_tokens
+from batch_upload import write_json_atomic
+
+# ================================
+# 配置区
+# ================================
+GRAPH_INSTRUCTIONS_FILE = "任务：根据混合Schema从PDF构建可直接导入的知识图谱.md"
+CYPHER_PROMPT_FILE = "Prompt：为高温合金知识图谱生成灵活的Cypher查询.md"
+# 已注册的缓存上下文：(模型, 内容哈希) -> cachedContents 名称与过期时间
+PROMPT_CACHE_FILE = "prompt_cache.json"
+# 缓存上下文的存活时间；剩余时间不足以跑完一个批处理作业 (见 BATCH_POLLING_TIMEOUT_SECONDS) 的不再复用
+PROMPT_CACHE_TTL_HOURS = 24
+PROMPT_CACHE_MIN_REMAINING_HOURS = 9
+# 显式缓存的最小 token 数随模型而定，更短的提示词直接内联；KG_PROMPT_CACHE_MIN_TOKENS 可统一覆盖。
+# 注意：现有提示词约 1.1k ~ 2k token，在默认的 gemini-2.5-pro 下都低于下限，缓存不会生效；
+# 换用 gemini-2.5-flash (LLM_MODEL) 或提示词变长后才会注册缓存
+PROMPT_CACHE_MIN_TOKENS = {'gemini-2.5-pro': 4096, 'gemini-2.5-flash': 1024}
+PROMPT_CACHE_DEFAULT_MIN_TOKENS = 4096
+
+
+class PromptAsset:
+    """一个提示词文件：文本、SHA-256 与 token 估算。由 load_asset 创建，同一版本的文件只读一次。"""
+
+    def __init__(self, path, text):
+        self.path = path
+        self.text = text
+        self.sha256 = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        self.tokens = estimate_text_tokens(text)
+
+    def split(self, placeholder):
+        """按占位符切成 (静态前缀, 后缀)，前缀可以注册为缓存上下文，问题等变量只放在后缀之前。"""
+        prefix, found, suffix = self.text.partition(placeholder)
+        if not found:
+            return self.text, ''
+        return prefix, suffix
+
+
+@functools.lru_cache(maxsize=None)
+def _read_asset(path, mtime_ns, size):
+    with open(path, 'r', encoding='utf-8') as f:
+        return PromptAsset(path, f.read())
+
+
+def load_asset(path):
+    """读取提示词文件；文件未修改时直接返回内存中的同一个对象 (按大小与 mtime 判断)。"""
+    stat = os.stat(path)
+    return _read_asset(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def cache_min_tokens(model_name):
+    """模型允许显式缓存的最小 token 数；设置了 KG_PROMPT_CACHE_MIN_TOKENS 时以其为准。"""
+    override = os.getenv("KG_PROMPT_CACHE_MIN_TOKENS")
+    if override:
+        return int(override)
+    name = model_name.rsplit('/', 1)[-1]
+    for prefix, tokens in PROMPT_CACHE_MIN_TOKENS.items():
+        if name.startswith(prefix):
+            return tokens
+    return PROMPT_CACHE_DEFAULT_MIN_TOKENS
+
+
+def _as_utc(value):
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return None
+
+
+class PromptContextCache:
+    """
+    把提示词的静态部分注册为后端的缓存上下文 (Gemini cachedContents)，请求中只引用句柄，
+    不再每次内联几千个 token 的指令。注册结果按 (模型, 内容哈希) 保存在 prompt_cache.json，
+    多次运行、多个进程之间复用；指令文件一改，哈希变化，自然注册新的缓存。
+
+    以下情况返回 None，由调用方内联原文：后端不支持缓存 (client.caches 为 None)、
+    文本短于 min_tokens (默认为该模型的最小缓存长度，见 cache_min_tokens)、注册失败。线程安全。
+    """
+
+    def __init__(self, path=PROMPT_CACHE_FILE, ttl_hours=PROMPT_CACHE_TTL_HOURS,
+                 min_remaining_hours=PROMPT_CACHE_MIN_REMAINING_HOURS, min_tokens=None):
+        self.path = path
+        self.ttl = timedelta(hours=ttl_hours)
+        self.min_remaining = timedelta(hours=min_remaining_hours)
+        self.min_tokens = min_tokens
+        self.entries = {}
+        self.lock = threading.Lock()
+        self._warned = set()
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get('entries', {})
+
+    def _save(self):
+        if self.path:
+            write_json_atomic(self.path, {'entries': self.entries})
+
+    def handle(self, client, model_name, text):
+        """返回 text 对应的缓存上下文名称，不能缓存时返回 None。"""
+        caches = getattr(client, 'caches', None)
+        min_tokens = cache_min_tokens(model_name) if self.min_tokens is None else self.min_tokens
+        if caches is None or estimate_text_tokens(text) < min_tokens:
+            return None
+        key = f"{model_name}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and datetime.fromisoformat(entry['expires_at']) - datetime.now(timezone.utc) >= self.min_remaining:
+                return entry['name']
+            try:
+                cached = caches.create(model=model_name, config={
+                    'contents': [{'role': 'user', 'parts': [{'text': text}]}],
+                    'display_name': f"kg-prompt-{key.rsplit(':', 1)[1][:12]}",
+                    'ttl': f"{int(self.ttl.total_seconds())}s",
+                })
+            except Exception as e:
+                if key not in self._warned:
+                    self._warned.add(key)
+                    print(f"  - ⚠️ 注册提示词缓存失败，改为内联发送: {e}")
+                return None
+            expires_at = _as_utc(getattr(cached, 'expire_time', None)) or datetime.now(timezone.utc) + self.ttl
+            self.entries[key] = {'name': cached.name, 'expires_at': expires_at.isoformat()}
+            self._save()
+            print(f"  - 🧊 已注册提示词缓存 {cached.name} (约 {estimate_text_tokens(text)} token，"
+                  f"有效至 {expires_at:%Y-%m-%d %H:%M} UTC)")
+            return cached.name
+
+    def forget(self, name):
+        """缓存在云端已失效 (被删除或过期) 时调用，下次重新注册。"""
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if entry['name'] == name]:
+                del self.entries[key]
+            self._save()
+
+
+# ================================
+# 离线演示
+# ================================
+def main():
+    from gemini_json_batch import build_batch_request
+    from fake_backend import FakeBackend
+
+    parser = argparse.ArgumentParser(description="显示提示词文件的哈希与 token 估算，并比较内联与缓存引用的请求体大小")
+    parser.add_argument('--requests', type=int, default=1000, help="模拟的批处理请求数")
+    args = parser.parse_args()
+
+    backend = FakeBackend()
+    min_tokens = cache_min_tokens(backend.model_name)
+    print(f"模型 {backend.model_name} 的最小缓存长度: {min_tokens} token")
+    for path in (GRAPH_INSTRUCTIONS_FILE, CYPHER_PROMPT_FILE):
+        if not os.path.exists(path):
+            print(f"  - ❌ 未找到: {path}")
+            continue
+        asset = load_asset(path)
+        cacheable = '可缓存' if asset.tokens >= min_tokens else '低于下限，内联'
+        print(f"  - {path}: {len(asset.text.encode('utf-8'))} 字节，约 {asset.tokens} token，"
+              f"sha256 {asset.sha256[:12]} ({cacheable})")
+    if not os.path.exists(GRAPH_INSTRUCTIONS_FILE):
+        return
+
+    instructions = load_asset(GRAPH_INSTRUCTIONS_FILE).text
+    with tempfile.TemporaryDirectory() as folder:
+        cache = PromptContextCache(os.path.join(folder, 'prompt_cache.json'))
+        handle = cache.handle(backend, backend.model_name, instructions)
+        assert cache.handle(backend, backend.model_name, instructions) == handle
+    if handle is None:
+        print(f"\n抽取指令低于 {backend.model_name} 的最小缓存长度，批处理请求内联原文，请求体不变。"
+              f"换用最小长度更低的模型 (如 LLM_MODEL=models/gemini-2.5-flash) 后才会引用缓存。")
+        return
+    uri = "https://generativelanguage.googleapis.com/v1beta/files/example"
+    inline = sum(len(json.dumps(build_batch_request(f"book_{i:04d}.pdf", uri, instructions)))
+                 for i in range(args.requests))
+    cached = sum(len(json.dumps(build_batch_request(f"book_{i:04d}.pdf", uri, instructions, cached_content=handle)))
+                 for i in range(args.requests))
+    print(f"\n{args.requests} 个请求的请求文件: 内联 {inline / 1024:.0f} KiB，引用缓存 {cached / 1024:.0f} KiB "
+          f"({cached / inline:.1%})")
+
+
+if __name__ == "__main__":
+    main()
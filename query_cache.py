@@ -0,0 +1,223 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+import threading
+import unicodedata
+
+# ================================
+# 配置区
+# ================================
+QUERY_CACHE_DB = "rag_cache.db"
+# 各命名空间的存活时间 (秒)。Cypher 只取决于问题与提示词版本，可以保留较久；
+# 查询结果与回答还以图谱版本为键，导入新数据后即失效，TTL 只是兜底
+CACHE_TTL_SECONDS = {
+    'cypher': 30 * 24 * 3600,
+    'result': 7 * 24 * 3600,
+    'answer': 7 * 24 * 3600,
+}
+# 全部命名空间合计的最大条目数，超过后按最近访问时间淘汰
+MAX_CACHE_ENTRIES = 20000
+# 依赖图谱版本的命名空间，版本变化时整体清空
+VERSIONED_NAMESPACES = ('result', 'answer')
+# 图谱版本的重新读取间隔 (秒)，期间的问题沿用上次读到的版本，不再逐个问题查询 Neo4j
+GRAPH_VERSION_CHECK_SECONDS = 30
+BUSY_TIMEOUT_MS = 30000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS idx_entries_accessed_at ON entries(accessed_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# 问题规范化时去掉的标点 (中英文)，"什么是γ'相？" 与 "什么是 γ' 相?" 视为同一个问题
+_PUNCTUATION_RE = re.compile(r"[\s,.!?;:，。！？；：、\"“”‘’()（）【】《》]+")
+
+
+def normalize_question(question):
+    """NFKC 归一化 (全角转半角)、转小写、去掉空白与标点，作为 Cypher 缓存的键。"""
+    text = unicodedata.normalize('NFKC', question).lower()
+    return _PUNCTUATION_RE.sub('', text)
+
+
+def cache_key(*parts):
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class QueryCache:
+    """
+    rag.py 的持久化查询缓存 (SQLite)，分三个命名空间：
+      cypher: (提示词哈希, 规范化问题) -> 生成的 Cypher
+      result: (图谱版本, Cypher) -> Neo4j 查询结果
+      answer: (图谱版本, 规范化问题, Cypher) -> 最终回答
+    条目按命名空间的 TTL 过期，总数超过 max_entries 时淘汰最久未访问的条目。
+    图谱版本由每次导入写入 (neo4j_import.py、import.cypher 或 neo4j-admin CSV)，sync_graph_version 发现版本变化时清空 result / answer；
+    graph_version 每隔 version_check_seconds 才向数据库重新读取一次。
+    与 StateStore 一样使用 WAL 模式，多线程共享一个连接，由锁串行化。
+    """
+
+    def __init__(self, path=QUERY_CACHE_DB, max_entries=MAX_CACHE_ENTRIES, ttl_seconds=None,
+                 version_check_seconds=GRAPH_VERSION_CHECK_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = dict(CACHE_TTL_SECONDS, **(ttl_seconds or {}))
+        self.version_check_seconds = version_check_seconds
+        self._version = None
+        self._version_checked_at = 0.0
+        self.lock = threading.RLock()
+        self.hits = {}
+        self.misses = {}
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, namespace, key):
+        """返回缓存的值；不存在或已过期时返回 None。命中会刷新访问时间。"""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, created_at FROM entries WHERE namespace = ? AND key = ?",
+                                    (namespace, key)).fetchone()
+            if row and now - row[1] > self.ttl_seconds.get(namespace, float('inf')):
+                self.conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+                row = None
+            if row is None:
+                self.misses[namespace] = self.misses.get(namespace, 0) + 1
+                return None
+            self.conn.execute("UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                              (now, namespace, key))
+            self.hits[namespace] = self.hits.get(namespace, 0) + 1
+        return json.loads(row[0])
+
+    def put(self, namespace, key, value):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO entries (namespace, key, value, created_at, accessed_at) "
+                              "VALUES (?, ?, ?, ?, ?)",
+                              (namespace, key, json.dumps(value, ensure_ascii=False), now, now))
+            self._evict()
+
+    def _evict(self):
+        excess = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self.conn.execute("DELETE FROM entries WHERE rowid IN "
+                              "(SELECT rowid FROM entries ORDER BY accessed_at LIMIT ?)", (excess,))
+
+    def purge_expired(self):
+        """删除全部过期条目，返回删除数量。"""
+        now = time.time()
+        removed = 0
+        with self.lock:
+            for namespace, ttl in self.ttl_seconds.items():
+                removed += self.conn.execute("DELETE FROM entries WHERE namespace = ? AND created_at < ?",
+                                             (namespace, now - ttl)).rowcount
+        return removed
+
+    def sync_graph_version(self, version):
+        """记录当前图谱版本；与上次记录的版本不同时清空依赖版本的命名空间，返回清除的条目数。"""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'graph_version'").fetchone()
+            if row and row[0] == version:
+                return 0
+            placeholders = ', '.join('?' * len(VERSIONED_NAMESPACES))
+            removed = self.conn.execute(f"DELETE FROM entries WHERE namespace IN ({placeholders})",
+                                        VERSIONED_NAMESPACES).rowcount
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('graph_version', ?)", (version,))
+        if row and removed:
+            print(f"  - ♻️ 图谱版本 {row[0]} -> {version}，已清除 {removed} 条过期的查询结果与回答缓存。")
+        return removed
+
+    def graph_version(self, read_version):
+        """
+        返回当前图谱版本。距上次读取不足 version_check_seconds 时直接返回上次的值，
+        否则调用 read_version() 重新读取并 sync_graph_version。
+        """
+        with self.lock:
+            if self._version is not None and time.monotonic() - self._version_checked_at < self.version_check_seconds:
+                return self._version
+        version = read_version()
+        self.sync_graph_version(version)
+        with self.lock:
+            self._version, self._version_checked_at = version, time.monotonic()
+        return version
+
+    def counts(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT namespace, COUNT(*) FROM entries GROUP BY namespace").fetchall())
+
+    def stats_line(self):
+        parts = []
+        for namespace in CACHE_TTL_SECONDS:
+            hits, misses = self.hits.get(namespace, 0), self.misses.get(namespace, 0)
+            if hits or misses:
+                parts.append(f"{namespace} {hits}/{hits + misses}")
+        return "缓存命中 " + (", ".join(parts) if parts else "无查询")
+
+
+# ================================
+# 离线演示
+# ================================
+def main():
+    parser = argparse.ArgumentParser(description="查看或清理 rag.py 的查询缓存，或运行淘汰/失效演示")
+    parser.add_argument('--db', default=QUERY_CACHE_DB, help="缓存数据库路径")
+    parser.add_argument('--purge', action='store_true', help="删除全部过期条目")
+    parser.add_argument('--clear', action='store_true', help="清空整个缓存")
+    parser.add_argument('--demo', action='store_true', help="在临时数据库上演示 LRU 淘汰与版本失效")
+    args = parser.parse_args()
+
+    if args.demo:
+        with tempfile.TemporaryDirectory() as folder, QueryCache(os.path.join(folder, 'cache.db'),
+                                                                 max_entries=3) as cache:
+            cache.sync_graph_version('v1')
+            question = normalize_question("什么是 γ' 相？")
+            assert question == normalize_question("什么是γ'相?")
+            cache.put('cypher', cache_key('prompt', question), "MATCH (p:Phase) RETURN p.name AS name")
+            cache.put('result', cache_key('v1', 'q1'), "γ'")
+            cache.put('answer', cache_key('v1', question, 'q1'), "γ' 相是……")
+            cache.get('cypher', cache_key('prompt', question))
+            cache.put('result', cache_key('v1', 'q2'), "γ''")
+            print(f"  - 容量 3，写入 4 条后: {cache.counts()} (最久未访问的 result 被淘汰)")
+            cache.sync_graph_version('v2')
+            print(f"  - 图谱版本更新后: {cache.counts()}")
+            assert cache.get('cypher', cache_key('prompt', question)) is not None
+        return
+
+    with QueryCache(args.db) as cache:
+        if args.clear:
+            with cache.lock:
+                cache.conn.execute("DELETE FROM entries")
+            print("✅ 缓存已清空。")
+        elif args.purge:
+            print(f"✅ 已删除 {cache.purge_expired()} 条过期条目。")
+        for namespace, count in sorted(cache.counts().items()):
+            print(f"  - {namespace}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
-import os
 import re
 import time
-from neo4j import GraphDatabase
-from google.genai import Client, errors
+import argparse
+
+import metrics
+from llm_backend import create_backend, is_not_found, is_server_error
+from neo4j_import import open_driver, read_graph_version
+from prompt_assets import CYPHER_PROMPT_FILE, PromptContextCache, load_asset
+from query_cache import QUERY_CACHE_DB, QueryCache, cache_key, normalize_question
 
 # -------------------- 1. 配置与初始化 --------------------
 # Neo4j 数据库连接配置
@@ -10,50 +14,84 @@ NEO4J_URI = "bolt://localhost:7687"
 NEO4J_USER = "neo4j"
 NEO4J_PASSWORD = "123456789"
 
-# 从环境变量获取 Gemini API Key
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("错误: 请设置 GEMINI_API_KEY 环境变量。")
+# Neo4j 驱动连接池大小，rag_service.py 的并发问题各自从池中借用会话
+NEO4J_POOL_SIZE = 50
 
-# 配置代理 (如果您的网络环境需要)
-os.environ["http_proxy"] = "http://127.0.0.1:7890"
-os.environ["https_proxy"] = "http://127.0.0.1:7890"
+# 大模型客户端与 Neo4j 驱动由 connect() 创建一次，之后所有问题 (包括 rag_service.py 的并发请求) 共用
+# (GEMINI_API_KEY、模型、代理与 LLM_BACKEND=fake 见 llm_backend.py)
+client = None
+driver = None
 
-# 初始化 Gemini 客户端
-client = Client(api_key=GEMINI_API_KEY)
+# 提示词中 {question} 之前的静态部分 (角色、规则、Schema) 注册为缓存上下文，每次只发送问题
+prompt_cache = PromptContextCache()
 
-# 初始化 Neo4j 驱动
-driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+# 为 False 时不打印每一步的进度 (服务模式下并发请求的进度会交错)，错误信息照常打印
+VERBOSE = True
 
 # 定义要提出的问题
 QUESTION = "什么是堆垛层错（Stacking Fault）？请说明内禀层错和外禀层错的区别"
 
+# 生成失败时的占位查询与回答，不写入缓存
+CYPHER_ERROR_MARKER = "'ERROR:"
+ANSWER_FAILED = "未能根据查询结果生成最终答案。"
+
 
 # -------------------- 2. 定义核心功能函数 --------------------
 
+def connect(fake=False, backend=None):
+    """创建 (或复用已创建的) 模型客户端与 Neo4j 驱动。fake=True 时使用内存替身驱动。"""
+    global client, driver
+    if client is None:
+        client = backend or create_backend()
+    if driver is None:
+        driver = open_driver(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD, fake=fake, pool_size=NEO4J_POOL_SIZE)
+    return client, driver
+
+
+def _progress(message):
+    if VERBOSE:
+        print(message)
+
+
 def generate_cypher_query(question: str) -> str:
     """使用Prompt控制大模型严格生成能用于neo4j数据库查询的cypher语句。"""
-    print("\nStep 1: 正在生成 Cypher 查询语句...")
-    with open("Prompt：为高温合金知识图谱生成灵活的Cypher查询.md", "r", encoding="utf-8") as f:
-        prompt = f.read()
-    prompt = prompt.replace("{question}", question)
+    _progress("\nStep 1: 正在生成 Cypher 查询语句...")
+    # 提示词文件只在首次使用 (或修改后) 读取
+    prefix, suffix = load_asset(CYPHER_PROMPT_FILE).split("{question}")
+    cached_content = prompt_cache.handle(client, client.model_name, prefix)
     retries = 2
     delay = 5
     for i in range(retries):
         try:
-            response = client.models.generate_content(
-                model="models/gemini-2.5-pro",
-                contents=prompt,
-                config={"temperature": 0}
-            )
+            if cached_content:
+                contents, config = question + suffix, {"temperature": 0, "cached_content": cached_content}
+            else:
+                contents, config = prefix + question + suffix, {"temperature": 0}
+            try:
+                response = client.models.generate_content(model=client.model_name, contents=contents, config=config)
+            except Exception as e:
+                if not (cached_content and is_not_found(e)):
+                    raise
+                # 缓存已在云端过期或被删除，本次内联发送，下次重新注册
+                prompt_cache.forget(cached_content)
+                cached_content = None
+                response = client.models.generate_content(model=client.model_name, contents=prefix + question + suffix,
+                                                          config={"temperature": 0})
             raw_text = response.text
             # 清理模型可能返回的Markdown格式
             match = re.search(r"```(?:cypher)?\s*(.*?)\s*```", raw_text, re.DOTALL)
             cleaned_query = match.group(1).strip() if match else raw_text.strip()
 
-            print("✅ Cypher 查询生成成功。")
+            _progress("✅ Cypher 查询生成成功。")
             return cleaned_query
-        except errors.ServerError as e:
+        except (AttributeError, ValueError, TypeError):
+            # 被安全过滤或返回为空时 response.text 为 None
+            print("❌ 生成 Cypher 查询失败：模型返回内容为空或格式不正确。")
+            print(f"   原始返回内容: {response.text if 'response' in locals() else 'N/A'}")
+            return "MATCH (n) RETURN 'ERROR: Query generation failed by safety filter or empty response' LIMIT 1"
+        except Exception as e:
+            if not is_server_error(e):
+                raise
             print(f"第 {i + 1} 次尝试失败，服务器错误: {e}")
             if i < retries - 1:
                 print(f"将在 {delay} 秒后重试...")
@@ -62,10 +100,6 @@ def generate_cypher_query(question: str) -> str:
             else:
                 print("所有重试均失败。")
                 return "MATCH (n) RETURN 'ERROR: Query generation failed due to server overload' LIMIT 1"
-        except (AttributeError, ValueError):
-            print("❌ 生成 Cypher 查询失败：模型返回内容为空或格式不正确。")
-            print(f"   原始返回内容: {response.text if 'response' in locals() else 'N/A'}")
-            return "MATCH (n) RETURN 'ERROR: Query generation failed by safety filter or empty response' LIMIT 1"
     return "MATCH (n) RETURN 'ERROR: Query generation failed unexpectedly' LIMIT 1"
 
 
@@ -78,7 +112,7 @@ def run_cypher_query(tx, query: str) -> str:
 
 def generate_final_answer(question: str, query_result: str) -> str:
     """使用Prompt控制模型基于查询结果生成最终回答。"""
-    print("\nStep 3: 正在根据查询结果生成最终回答...")
+    _progress("\nStep 3: 正在根据查询结果生成最终回答...")
     prompt = f"""
     请根据下面提供的 Neo4j 查询结果，为原始问题生成一个简洁、流畅的自然语言回答。
 
@@ -91,39 +125,105 @@ def generate_final_answer(question: str, query_result: str) -> str:
     """
     try:
         response = client.models.generate_content(
-            model="models/gemini-2.5-pro",
+            model=client.model_name,
             contents=prompt,
             config={"temperature": 0.1}  # slight temperature for more natural language
         )
         final_answer = response.text.strip()
-        print("✅ 最终回答生成成功。")
+        _progress("✅ 最终回答生成成功。")
         return final_answer
-    except (errors.ServerError, AttributeError, ValueError) as e:
+    except Exception as e:
+        if not (is_server_error(e) or isinstance(e, (AttributeError, ValueError))):
+            raise
         print(f"❌ 生成最终回答失败: {e}")
-        return "未能根据查询结果生成最终答案。"
+        return ANSWER_FAILED
+
+
+def answer_question(question: str, session, cache=None) -> dict:
+    """
+    完整的 RAG 流程 (生成 Cypher -> 执行查询 -> 生成回答)，每一步先查缓存：
+    Cypher 以 (提示词哈希, 规范化问题) 为键，查询结果与回答还带上图谱版本，
+    图谱版本变化 (重新导入数据) 后，旧的结果与回答自动失效；版本每隔 GRAPH_VERSION_CHECK_SECONDS 才重新读取一次。
+    失败的生成结果与执行出错的 Cypher 不缓存。
+    各阶段 (generate / execute / answer，含缓存查找) 的耗时记入直方图 rag_stage_seconds，并以毫秒返回在 timings 中。
+    """
+    started = time.perf_counter()
+    normalized = normalize_question(question)
+    version = None
+    if cache is not None:
+        version = cache.graph_version(lambda: read_graph_version(session))
+    cached = {}
+    timings = {}
+
+    def lap(stage, since):
+        elapsed = time.perf_counter() - since
+        metrics.observe('rag_stage_seconds', elapsed, stage=stage)
+        timings[stage] = round(elapsed * 1000, 3)
+        return time.perf_counter()
+
+    stage_started = time.perf_counter()
+
+    # Step 1: 生成 Cypher 查询
+    cypher_key = cache_key(load_asset(CYPHER_PROMPT_FILE).sha256, normalized)
+    cypher_query = cache.get('cypher', cypher_key) if cache is not None else None
+    cached['cypher'] = cypher_query is not None
+    if cypher_query is None:
+        cypher_query = generate_cypher_query(question)
+    stage_started = lap('generate', stage_started)
+
+    # Step 2: 执行查询
+    result_key = cache_key(version or '', cypher_query)
+    query_result = cache.get('result', result_key) if cache is not None else None
+    cached['result'] = query_result is not None
+    if query_result is None:
+        _progress("\nStep 2: 正在 Neo4j 数据库中执行查询...")
+        query_result = session.execute_read(run_cypher_query, cypher_query)
+        _progress("✅ 查询执行完成。")
+        if cache is not None and CYPHER_ERROR_MARKER not in cypher_query:
+            cache.put('result', result_key, query_result)
+    # 新生成的 Cypher 执行成功后才缓存，执行出错的查询下次重新生成
+    if cache is not None and not cached['cypher'] and CYPHER_ERROR_MARKER not in cypher_query:
+        cache.put('cypher', cypher_key, cypher_query)
+    stage_started = lap('execute', stage_started)
+
+    # Step 3: 生成最终回答
+    answer_key = cache_key(version or '', normalized, cypher_query)
+    final_answer = cache.get('answer', answer_key) if cache is not None else None
+    cached['answer'] = final_answer is not None
+    if final_answer is None:
+        final_answer = generate_final_answer(question, query_result)
+        if cache is not None and final_answer != ANSWER_FAILED and CYPHER_ERROR_MARKER not in cypher_query:
+            cache.put('answer', answer_key, final_answer)
+    lap('answer', stage_started)
+    lap('total', started)
+
+    return {'question': question, 'cypher': cypher_query, 'result': query_result, 'answer': final_answer,
+            'cached': cached, 'timings': timings}
 
 
 # -------------------- 3. 执行完整的 RAG 流程 --------------------
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="基于 Neo4j 知识图谱回答问题")
+    parser.add_argument('--question', default=QUESTION, help="要提出的问题")
+    parser.add_argument('--cache', default=QUERY_CACHE_DB, help="查询缓存数据库路径")
+    parser.add_argument('--no-cache', action='store_true', help="不读写查询缓存")
+    args = parser.parse_args()
+
+    connect()
+    query_cache = None if args.no_cache else QueryCache(args.cache)
     with driver.session() as session:
-        # Step 1: 生成 Cypher 查询
-        cypher_query = generate_cypher_query(QUESTION)
-        print("-" * 50)
-        print("生成的 Cypher 查询:\n", cypher_query)
-        print("-" * 50)
-
-        # Step 2: 执行查询
-        print("\nStep 2: 正在 Neo4j 数据库中执行查询...")
-        query_result = session.execute_read(run_cypher_query, cypher_query)
-        print("✅ 查询执行完成。")
-        print("-" * 50)
-        print("数据库查询结果:\n", query_result)
-        print("-" * 50)
-
-        # Step 3: 生成最终回答
-        final_answer = generate_final_answer(QUESTION, query_result)
-        print("=" * 50)
-        print("✨ 最终答案:\n", final_answer)
-        print("=" * 50)
-
-    driver.close()
\ No newline at end of file
+        outcome = answer_question(args.question, session, query_cache)
+    print("-" * 50)
+    print("生成的 Cypher 查询:\n", outcome['cypher'])
+    print("-" * 50)
+    print("数据库查询结果:\n", outcome['result'])
+    print("=" * 50)
+    print("✨ 最终答案:\n", outcome['answer'])
+    print("=" * 50)
+    timings = outcome['timings']
+    print(f"⏱️ 用时 {timings['total']:.1f} ms (生成 {timings['generate']:.1f} / 查询 {timings['execute']:.1f} / "
+          f"回答 {timings['answer']:.1f})" + (f"，{query_cache.stats_line()}" if query_cache is not None else ""))
+    if query_cache is not None:
+        query_cache.close()
+
+    driver.close()
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import rag
+from llm_backend import create_backend
+from query_cache import QUERY_CACHE_DB, QueryCache
+from rag_service import seed_fake_graph, stage_latency
+
+# ================================
+# 配置区
+# ================================
+QUESTIONS_FILE = "questions.jsonl"
+ANSWERS_FILE = "answers.jsonl"
+# 同时处理的问题数 (每个问题占用一个 Neo4j 会话)
+BATCH_QA_WORKERS = 16
+# 模型调用的速率上限 (次/分钟)，生成 Cypher 与生成回答共用；命中缓存的步骤不计入
+MODEL_REQUESTS_PER_MINUTE = 120
+
+
+class RateLimiter:
+    """按固定间隔放行请求的限速器 (每分钟 per_minute 次)，多线程共用；per_minute <= 0 时不限速。"""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self.next_slot = time.monotonic()
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+            self.waited += slot - now
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class _RateLimitedModels:
+    def __init__(self, models, limiter):
+        self.models = models
+        self.limiter = limiter
+
+    def generate_content(self, *args, **kwargs):
+        self.limiter.acquire()
+        return self.models.generate_content(*args, **kwargs)
+
+
+class RateLimitedBackend:
+    """包装一个 LLM 后端，每次 generate_content 之前先向限速器申请配额；其余属性原样转发。"""
+
+    def __init__(self, backend, limiter):
+        self.backend = backend
+        self.models = _RateLimitedModels(backend.models, limiter)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+def question_id(record):
+    """问题的 id：输入里有 id 字段时直接使用，否则取问题文本的哈希，输入文件增删行不影响续跑。"""
+    if record.get('id') not in (None, ''):
+        return str(record['id'])
+    return 'q_' + hashlib.sha1(record['question'].encode('utf-8')).hexdigest()[:12]
+
+
+def load_questions(path):
+    """读取 JSONL 问题文件 (每行 {"id": ..., "question": ...}，也接受纯文本行)，同一 id 只保留第一次出现。"""
+    questions = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = line
+            if isinstance(record, str):
+                record = {'question': record}
+            if not str(record.get('question', '')).strip():
+                print(f"  - ⚠️ 第 {line_no} 行没有 question 字段，已跳过。")
+                continue
+            questions.setdefault(question_id(record), record)
+    return questions
+
+
+def load_finished(path):
+    """
+    读取已有的结果文件，返回成功回答过的 id。失败的记录和中断时写了一半的行被丢弃
+    (原子地重写结果文件)，续跑时重新处理。
+    """
+    if not os.path.exists(path):
+        return set()
+    kept, dropped = [], 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                dropped += 1
+                continue
+            if record.get('status') == 'ok':
+                kept.append(record)
+            else:
+                dropped += 1
+    if dropped:
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for record in kept:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(temp_path, path)
+        print(f"  - 🔁 结果文件中有 {dropped} 条失败或不完整的记录，将重新处理。")
+    return {record['id'] for record in kept}
+
+
+def answer_one(qid, record, cache):
+    started = time.perf_counter()
+    try:
+        with rag.driver.session() as session:
+            outcome = rag.answer_question(record['question'], session, cache)
+    except Exception as e:
+        return {'id': qid, 'question': record['question'], 'status': 'error', 'error': f"{type(e).__name__}: {e}",
+                'timings': {'total': round((time.perf_counter() - started) * 1000, 3)}}
+    failed = rag.CYPHER_ERROR_MARKER in outcome['cypher'] or outcome['answer'] == rag.ANSWER_FAILED
+    return {'id': qid, **{k: v for k, v in record.items() if k not in ('id', 'question')}, **outcome,
+            'status': 'error' if failed else 'ok'}
+
+
+def run_batch(input_path, output_path, cache=None, workers=BATCH_QA_WORKERS, stop_after=None):
+    """
+    批量回答 input_path 中的问题，每完成一个立即追加一行到 output_path。
+    已成功的 id 在续跑时跳过；stop_after 限制本次最多处理的问题数。返回 (成功数, 失败数, 跳过数)。
+    """
+    questions = load_questions(input_path)
+    finished = load_finished(output_path)
+    pending = [(qid, record) for qid, record in questions.items() if qid not in finished]
+    if stop_after is not None:
+        pending = pending[:stop_after]
+    skipped = len(questions) - len(pending)
+    print(f"📋 共 {len(questions)} 个问题，已完成 {len(finished & questions.keys())} 个，本次处理 {len(pending)} 个。")
+
+    ok = failed = 0
+    started = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        futures = [pool.submit(answer_one, qid, record, cache) for qid, record in pending]
+        with open(output_path, 'a', encoding='utf-8') as out:
+            for done, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                if record['status'] == 'ok':
+                    ok += 1
+                else:
+                    failed += 1
+                    print(f"  - ❌ {record['id']}: {record.get('error') or record.get('answer')}")
+                if done % 50 == 0:
+                    print(f"  - 进度 {done}/{len(pending)} ({done / (time.perf_counter() - started):.1f} 问/秒)")
+    except KeyboardInterrupt:
+        print("\n⏹️ 已中断，已完成的回答都已写入结果文件，再次运行即可续跑。")
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+    elapsed = time.perf_counter() - started
+    print(f"\n✅ 本次完成 {ok} 个，失败 {failed} 个，用时 {elapsed:.2f} 秒"
+          + (f" ({(ok + failed) / elapsed:.1f} 问/秒)" if ok + failed else ""))
+    return ok, failed, skipped
+
+
+def print_stage_latency():
+    print(f"{'阶段':<10}{'次数':>8}{'p50 ms':>12}{'p95 ms':>12}{'max ms':>12}")
+    for stage, summary in stage_latency().items():
+        print(f"{stage:<10}{summary['count']:>8}{summary['p50_ms']:>12.2f}{summary['p95_ms']:>12.2f}"
+              f"{summary['max_ms']:>12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量回答 JSONL 中的问题，结果 (回答、Cypher、耗时) 写入 JSONL，可中断续跑")
+    parser.add_argument('--input', default=QUESTIONS_FILE, help="问题文件，每行 {\"id\": ..., \"question\": ...}")
+    parser.add_argument('--output', default=ANSWERS_FILE, help="结果文件，已成功的 id 续跑时跳过")
+    parser.add_argument('--workers', type=int, default=BATCH_QA_WORKERS, help="并发处理的问题数")
+    parser.add_argument('--rpm', type=int, default=MODEL_REQUESTS_PER_MINUTE, help="模型调用速率上限 (次/分钟)，0 为不限")
+    parser.add_argument('--stop-after', type=int, default=None, help="本次最多处理的问题数")
+    parser.add_argument('--cache', default=QUERY_CACHE_DB, help="查询缓存数据库路径")
+    parser.add_argument('--no-cache', action='store_true', help="不读写查询缓存 (评测模型本身时使用)")
+    parser.add_argument('--verbose', action='store_true', help="打印每个问题的处理进度")
+    parser.add_argument('--fake', action='store_true', help="使用替身模型与内存替身 Neo4j 驱动，不连接外部服务")
+    parser.add_argument('--demo', type=int, default=0,
+                        help="离线演示：生成 N 个问题，先处理一半模拟中断，再续跑完剩余部分 (隐含 --fake)")
+    args = parser.parse_args()
+
+    rag.VERBOSE = args.verbose
+    limiter = RateLimiter(args.rpm)
+    fake = args.fake or args.demo > 0
+    if fake:
+        from fake_backend import FakeBackend
+        backend = FakeBackend()
+    else:
+        backend = create_backend()
+    rag.connect(fake=fake, backend=RateLimitedBackend(backend, limiter))
+    if fake:
+        seed_fake_graph(rag.driver)
+        # 替身回答不写入正式的缓存数据库
+        if args.cache == QUERY_CACHE_DB:
+            args.cache = ':memory:'
+    cache = None if args.no_cache else QueryCache(args.cache)
+
+    try:
+        if args.demo:
+            with tempfile.TemporaryDirectory() as folder:
+                input_path, output_path = os.path.join(folder, 'questions.jsonl'), os.path.join(folder, 'answers.jsonl')
+                with open(input_path, 'w', encoding='utf-8') as f:
+                    for i in range(args.demo):
+                        f.write(json.dumps({'id': f'eval_{i:04d}', 'question': f"第 {i} 号合金的强化相是什么？"},
+                                           ensure_ascii=False) + "\n")
+                run_batch(input_path, output_path, cache, args.workers, stop_after=args.demo // 2)
+                with open(output_path, 'a', encoding='utf-8') as f:
+                    f.write('{"id": "eval_9999", "question": "写了一半')
+                print("\n--- 模拟中断后续跑 ---")
+                run_batch(input_path, output_path, cache, args.workers)
+                with open(output_path, 'r', encoding='utf-8') as f:
+                    ids = [json.loads(line)['id'] for line in f]
+                assert sorted(ids) == [f'eval_{i:04d}' for i in range(args.demo)], "续跑后结果不完整或有重复"
+                print(f"  - 结果文件共 {len(ids)} 行，无重复。")
+        else:
+            run_batch(args.input, args.output, cache, args.workers, args.stop_after)
+    except KeyboardInterrupt:
+        return
+    finally:
+        rag.driver.close()
+        if cache is not None:
+            cache.close()
+    print()
+    print_stage_latency()
+    if limiter.waited:
+        print(f"⏳ 限速累计等待 {limiter.waited:.1f} 秒 (--rpm {args.rpm})")
+
+
+if __name__ == "__main__":
+    main()
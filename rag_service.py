@@ -0,0 +1,222 @@
+import json
+import time
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import metrics
+import rag
+from neo4j_import import node_merge_query, stamp_graph_version
+from query_cache import QUERY_CACHE_DB, QueryCache
+
+# ================================
+# 配置区
+# ================================
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+# 同时处理的问题数上限，超出的请求排队等待 (不超过 Neo4j 连接池与模型 API 的并发配额)
+MAX_CONCURRENT_QUESTIONS = 16
+# 对外报告分位数的阶段
+STAGES = ('generate', 'execute', 'answer', 'total')
+
+
+def stage_latency():
+    """从 metrics 直方图 rag_stage_seconds 读取各阶段的 p50 / p95 (毫秒)。"""
+    _, histograms = metrics.REGISTRY.snapshot()
+    report = {}
+    for (name, labels), summary in histograms.items():
+        if name == 'rag_stage_seconds':
+            stage = dict(labels)['stage']
+            report[stage] = {'count': summary['count'], 'p50_ms': round(summary['p50'] * 1000, 3),
+                             'p95_ms': round(summary['p95'] * 1000, 3), 'max_ms': round(summary['max'] * 1000, 3)}
+    return {stage: report[stage] for stage in STAGES if stage in report}
+
+
+class RagService:
+    """
+    常驻的问答服务：模型客户端、Neo4j 驱动 (自带连接池) 和查询缓存在启动时创建一次，
+    每个问题只从池中借一个会话，不再为每个问题付出建连与客户端初始化的开销。
+    """
+
+    def __init__(self, cache=None, max_concurrent=MAX_CONCURRENT_QUESTIONS):
+        self.client, self.driver = rag.connect()
+        self.cache = cache
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.started_at = time.time()
+        self.answered = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def ask(self, question, use_cache=True):
+        with self.slots:
+            try:
+                with self.driver.session() as session:
+                    outcome = rag.answer_question(question, session, self.cache if use_cache else None)
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                raise
+        # 生成或执行 Cypher 出错、回答生成失败时 answer_question 不抛异常，与 rag_batch 一样计为失败
+        failed = rag.CYPHER_ERROR_MARKER in outcome['cypher'] or outcome['answer'] == rag.ANSWER_FAILED
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.answered += 1
+        return outcome
+
+    def status(self):
+        status = {'uptime_seconds': round(time.time() - self.started_at, 1), 'answered': self.answered,
+                  'failed': self.failed, 'stages': stage_latency()}
+        if self.cache is not None:
+            status['cache'] = self.cache.stats_line()
+        return status
+
+
+class RagRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /ask     {"question": "...", "no_cache": false} -> 回答、Cypher、查询结果、各阶段耗时
+    GET  /metrics 各阶段 p50 / p95 (JSON)；?format=prometheus 返回 Prometheus 文本
+    GET  /health  存活检查
+    """
+    service = None
+
+    def _send(self, code, body, content_type='application/json; charset=utf-8'):
+        data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            self._send(200, {'ok': True})
+        elif url.path == '/metrics':
+            if parse_qs(url.query).get('format') == ['prometheus']:
+                self._send(200, metrics.REGISTRY.prometheus_text().encode('utf-8'), 'text/plain; version=0.0.4')
+            else:
+                self._send(200, self.service.status())
+        else:
+            self._send(404, {'error': f"未知路径: {url.path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/ask':
+            self._send(404, {'error': f"未知路径: {self.path}"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            question = str(payload['question']).strip()
+        except (ValueError, KeyError, TypeError):
+            self._send(400, {'error': '请求体应为 {"question": "..."}'})
+            return
+        if not question:
+            self._send(400, {'error': 'question 不能为空'})
+            return
+        try:
+            outcome = self.service.ask(question, use_cache=not payload.get('no_cache'))
+        except Exception as e:
+            self._send(500, {'error': f"{type(e).__name__}: {e}"})
+            return
+        self._send(200, outcome)
+
+    def log_message(self, fmt, *args):
+        # 逐请求的访问日志交给 /metrics 汇总，这里不打印
+        pass
+
+
+def serve(service, host=SERVICE_HOST, port=SERVICE_PORT):
+    """创建 HTTP 服务器 (每个连接一个线程，并发度由 service.slots 限制)，返回服务器对象。"""
+    handler = type('BoundRagRequestHandler', (RagRequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def seed_fake_graph(driver):
+    """替身驱动里放几个合金节点，让替身模型生成的查询有结果可返回。"""
+    rows = [{'id': f'alloy_{name}', 'properties': {'name': name}}
+            for name in ('Inconel 718', 'Waspaloy', 'CMSX-4', 'René 88DT', 'GH4169')]
+    with driver.session() as session:
+        session.run(node_merge_query('Alloy'), rows=rows)
+    stamp_graph_version(driver)
+
+
+# ================================
+# 离线压测
+# ================================
+def post_question(base_url, question, timeout=120):
+    request = urllib.request.Request(f"{base_url}/ask", data=json.dumps({'question': question}).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def load_test(base_url, total, distinct, concurrency):
+    questions = [f"第 {i % distinct} 号问题：Inconel 718 的主要强化相是什么？" for i in range(total)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(lambda q: post_question(base_url, q), questions))
+    elapsed = time.perf_counter() - started
+    hits = sum(1 for outcome in outcomes if all(outcome['cached'].values()))
+    print(f"\n{total} 个问题 ({distinct} 个不同问题，并发 {concurrency})：用时 {elapsed:.2f} 秒，"
+          f"{total / elapsed:.1f} 问/秒，完全命中缓存 {hits} 个")
+    with urllib.request.urlopen(f"{base_url}/metrics") as response:
+        status = json.loads(response.read())
+    print(f"{'阶段':<10}{'次数':>8}{'p50 ms':>12}{'p95 ms':>12}{'max ms':>12}")
+    for stage, summary in status['stages'].items():
+        print(f"{stage:<10}{summary['count']:>8}{summary['p50_ms']:>12.2f}{summary['p95_ms']:>12.2f}"
+              f"{summary['max_ms']:>12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻的知识图谱问答 HTTP 服务 (复用 Neo4j 连接池与模型客户端)")
+    parser.add_argument('--host', default=SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=SERVICE_PORT)
+    parser.add_argument('--max-concurrent', type=int, default=MAX_CONCURRENT_QUESTIONS, help="同时处理的问题数上限")
+    parser.add_argument('--cache', default=QUERY_CACHE_DB, help="查询缓存数据库路径")
+    parser.add_argument('--no-cache', action='store_true', help="不读写查询缓存")
+    parser.add_argument('--verbose', action='store_true', help="打印每个问题的处理进度")
+    parser.add_argument('--fake', action='store_true', help="使用替身模型与内存替身 Neo4j 驱动，不连接外部服务")
+    parser.add_argument('--load', type=int, default=0, help="启动后自测：并发发送 N 个问题，打印各阶段 p50 / p95 后退出")
+    parser.add_argument('--distinct', type=int, default=20, help="自测时不同问题的数量 (其余为重复提问)")
+    parser.add_argument('--concurrency', type=int, default=16, help="自测时的客户端并发数")
+    args = parser.parse_args()
+
+    rag.VERBOSE = args.verbose
+    if args.fake:
+        from fake_backend import FakeBackend
+        rag.connect(fake=True, backend=FakeBackend())
+        seed_fake_graph(rag.driver)
+        # 替身回答不写入正式的缓存数据库
+        if args.cache == QUERY_CACHE_DB:
+            args.cache = ':memory:'
+    cache = None if args.no_cache else QueryCache(args.cache)
+    service = RagService(cache, args.max_concurrent)
+    server = serve(service, args.host, 0 if args.load else args.port)
+    host, port = server.server_address[:2]
+    print(f"✅ 问答服务已启动: http://{host}:{port}  (POST /ask, GET /metrics, GET /health)")
+
+    try:
+        if args.load:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            load_test(f"http://{host}:{port}", args.load, max(1, args.distinct), args.concurrency)
+        else:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹️ 正在停止服务...")
+    finally:
+        if args.load:
+            server.shutdown()
+        server.server_close()
+        rag.driver.close()
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+
+# ================================
+# 配置区
+# ================================
+STATE_DB_FILE = "processing_state.db"
+# 旧版的 JSON 状态文件，首次打开数据库时自动迁移
+LEGACY_STATE_FILE = "processing_state.json"
+# 其他进程持有写锁时最多等待的毫秒数
+BUSY_TIMEOUT_MS = 30000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    batch_job_name TEXT,
+    uploaded_file_name TEXT,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_status ON files(status);
+CREATE INDEX IF NOT EXISTS idx_files_batch_job_name ON files(batch_job_name);
+CREATE INDEX IF NOT EXISTS idx_files_uploaded_file_name ON files(uploaded_file_name);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class StateStore:
+    """
+    基于 SQLite 的处理状态存储，替代每次改动都整体重写的 processing_state.json。
+
+    每个 PDF 一行：完整条目以 JSON 保存在 data 列，status / batch_job_name / uploaded_file_name
+    另存为带索引的列，按状态或按批处理作业查询不必扫描全部条目。
+    每次修改都是一个只涉及相关行的事务，中途崩溃不会损坏已有状态。
+    数据库使用 WAL 模式，gemini_json_batch.py、error_process.py、cloud_manager.py 可以同时读写；
+    同一进程内的多个线程共享一个连接，由锁串行化。
+    """
+
+    def __init__(self, path=STATE_DB_FILE, legacy_json=LEGACY_STATE_FILE):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(_SCHEMA)
+        if legacy_json and os.path.exists(legacy_json):
+            self.migrate_from_json(legacy_json)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE 先拿到写锁，读-改-写之间不会被其他进程插入修改。"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    @staticmethod
+    def _row(filename, entry):
+        return (filename, entry.get('status', ''), entry.get('batch_job_name'), entry.get('uploaded_file_name'),
+                json.dumps(entry, ensure_ascii=False), time.time())
+
+    @staticmethod
+    def _write(conn, filename, entry):
+        conn.execute("INSERT OR REPLACE INTO files (filename, status, batch_job_name, uploaded_file_name, data, "
+                     "updated_at) VALUES (?, ?, ?, ?, ?, ?)", StateStore._row(filename, entry))
+
+    @staticmethod
+    def _read(conn, filename):
+        row = conn.execute("SELECT data FROM files WHERE filename = ?", (filename,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # ---------- 迁移 ----------
+    def migrate_from_json(self, json_path):
+        """
+        把旧版 JSON 状态文件导入数据库 (只在数据库还没有迁移记录时进行)，
+        完成后把原文件改名为 .migrated，避免旧脚本继续写入一份过时的状态。
+        """
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from'").fetchone():
+                return 0
+            with open(json_path, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+            for filename, entry in legacy.items():
+                if conn.execute("SELECT 1 FROM files WHERE filename = ?", (filename,)).fetchone() is None:
+                    self._write(conn, filename, entry)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from', ?)",
+                         (json.dumps(os.path.abspath(json_path), ensure_ascii=False),))
+        os.replace(json_path, json_path + '.migrated')
+        print(f"  - 已将 '{json_path}' 中的 {len(legacy)} 个条目迁移到 '{self.path}'。")
+        return len(legacy)
+
+    # ---------- 单行操作 ----------
+    def __contains__(self, filename):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM files WHERE filename = ?", (filename,)).fetchone() is not None
+
+    def get(self, filename, default=None):
+        with self.lock:
+            entry = self._read(self.conn, filename)
+        return default if entry is None else entry
+
+    def set(self, filename, entry):
+        """整体替换一个条目。"""
+        with self._transaction() as conn:
+            self._write(conn, filename, entry)
+
+    def update(self, filename, **fields):
+        """把 fields 合并进一个已存在的条目，返回更新后的条目。"""
+        with self._transaction() as conn:
+            entry = self._read(conn, filename)
+            if entry is None:
+                raise KeyError(filename)
+            entry.update(fields)
+            self._write(conn, filename, entry)
+        return entry
+
+    def delete(self, filename):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM files WHERE filename = ?", (filename,))
+
+    # ---------- 批量操作 ----------
+    def add_missing(self, filenames, entry):
+        """为尚未跟踪的文件插入初始条目，已有条目保持不变。返回新增数量。"""
+        added = 0
+        with self._transaction() as conn:
+            for filename in filenames:
+                if conn.execute("SELECT 1 FROM files WHERE filename = ?", (filename,)).fetchone() is None:
+                    self._write(conn, filename, dict(entry))
+                    added += 1
+        return added
+
+    def update_many(self, filenames, **fields):
+        """在同一个事务中更新多个条目 (例如一个批处理作业包含的全部文件)。"""
+        with self._transaction() as conn:
+            for filename in filenames:
+                entry = self._read(conn, filename)
+                if entry is not None:
+                    entry.update(fields)
+                    self._write(conn, filename, entry)
+
+    def update_job(self, batch_job_name, **fields):
+        """更新属于某个批处理作业的全部条目，返回更新的数量。"""
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT filename, data FROM files WHERE batch_job_name = ?",
+                                (batch_job_name,)).fetchall()
+            for filename, data in rows:
+                entry = json.loads(data)
+                entry.update(fields)
+                self._write(conn, filename, entry)
+        return len(rows)
+
+    # ---------- 查询 ----------
+    def _select(self, where='', params=()):
+        with self.lock:
+            rows = self.conn.execute(f"SELECT filename, data FROM files {where} ORDER BY filename", params).fetchall()
+        return {filename: json.loads(data) for filename, data in rows}
+
+    def all(self):
+        return self._select()
+
+    def by_status(self, status):
+        return self._select("WHERE status = ?", (status,))
+
+    def by_job(self, batch_job_name):
+        return self._select("WHERE batch_job_name = ?", (batch_job_name,))
+
+    def by_uploaded_file(self, uploaded_file_names):
+        names = list(uploaded_file_names)
+        if not names:
+            return {}
+        placeholders = ', '.join('?' * len(names))
+        return self._select(f"WHERE uploaded_file_name IN ({placeholders})", names)
+
+    def job_names_with_status(self, status):
+        with self.lock:
+            rows = self.conn.execute("SELECT DISTINCT batch_job_name FROM files "
+                                     "WHERE status = ? AND batch_job_name IS NOT NULL", (status,)).fetchall()
+        return {row[0] for row in rows}
+
+    # ---------- 元数据 ----------
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                         (key, json.dumps(value, ensure_ascii=False)))
+
+    def status_counts(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM files GROUP BY status").fetchall())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看处理状态数据库，或从旧版 JSON 状态文件迁移")
+    parser.add_argument('--db', default=STATE_DB_FILE, help="状态数据库路径")
+    parser.add_argument('--migrate', default=LEGACY_STATE_FILE, help="要迁移的旧版 JSON 状态文件")
+    parser.add_argument('--status', default=None, help="列出某个状态下的全部文件")
+    parser.add_argument('--job', default=None, help="列出某个批处理作业包含的全部文件")
+    args = parser.parse_args()
+
+    with StateStore(args.db, args.migrate) as store:
+        if args.status or args.job:
+            entries = store.by_status(args.status) if args.status else store.by_job(args.job)
+            for filename, entry in entries.items():
+                print(f"  - {filename}: {json.dumps(entry, ensure_ascii=False)}")
+            print(f"共 {len(entries)} 个文件。")
+        else:
+            for status, count in sorted(store.status_counts().items()):
+                print(f"  - {status}: {count}")
+
+
+if __name__ == "__main__":
+    main()